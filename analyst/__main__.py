@@ -1,8 +1,10 @@
 import argparse
+import json
 import logging.config
 
-from .screener import run_screener_task
+from .screener import FILTERS, run_screener_task
 from .web_api import run_get_stock_data_task
+from .export import run_export_task
 
 logging.config.fileConfig("logging.ini", disable_existing_loggers=False)
 
@@ -21,10 +23,137 @@ parser_screener.add_argument(
     ),
     type=str,
 )
+parser_screener.add_argument(
+    "--panel",
+    help=(
+        "Screen all the symbols at once over a single DataFrame "
+        "instead of symbol by symbol."
+    ),
+    action="store_true",
+)
+parser_screener.add_argument(
+    "--filter",
+    help="The name of a registered filter function.",
+    type=str,
+    choices=sorted(FILTERS),
+    default="eps_yoy_growth",
+)
+parser_screener.add_argument(
+    "--executor",
+    help=(
+        "Apply the filter in a thread pool, or in a process pool "
+        "to use all the CPU cores for CPU-bound filters."
+    ),
+    type=str,
+    choices=["thread", "process"],
+    default="thread",
+)
+parser_screener.add_argument(
+    "--parquet",
+    help=(
+        "Screen all the symbols at once over the Parquet snapshot of "
+        "target_task_id exported in this directory, instead of the database."
+    ),
+    type=str,
+    metavar="DIRECTORY",
+)
+parser_screener.add_argument(
+    "--filter-params",
+    help=(
+        "Keyword arguments of the filter as a JSON object, "
+        "e.g. '{\"threshold_pct\": 0.3}' for eps_yoy_growth and --panel. "
+        "For a pipeline, the keyword arguments of each stage by the stage name."
+    ),
+    type=json.loads,
+)
+parser_screener.add_argument(
+    "--metric-cache",
+    help=(
+        "Store derived metrics such as year-over-year changes in the database "
+        "and reuse them while the underlying stock data is unchanged."
+    ),
+    action="store_true",
+)
+
+parser_export = subparsers.add_parser("export")
+parser_export.set_defaults(fn=run_export_task)
+parser_export.add_argument(
+    "task_id",
+    help="The task id of a completed getstockdata task to export.",
+    type=str,
+)
+parser_export.add_argument(
+    "directory",
+    help="The directory to write the Parquet snapshot to.",
+    type=str,
+)
 
 parser_get_stock_data = subparsers.add_parser("getstockdata")
 parser_get_stock_data.add_argument(
-    "minimum_price", help="The minimum price threshold.", type=float
+    "minimum_price", help="The minimum price threshold.", type=float, nargs="?"
+)
+parser_get_stock_data.add_argument(
+    "--resume",
+    help=(
+        "Resume an interrupted task by its task id, "
+        "fetching only the symbols not succeeded yet."
+    ),
+    type=str,
+    metavar="TASK_ID",
+)
+parser_get_stock_data.add_argument(
+    "--max-in-flight",
+    help="The maximum number of symbols fetched at once.",
+    type=int,
+    default=10,
+)
+parser_get_stock_data.add_argument(
+    "--incremental",
+    help=(
+        "Refresh the stored stock data with only the new prices "
+        "and financial statements instead of dropping and refetching everything."
+    ),
+    action="store_true",
+)
+parser_get_stock_data.add_argument(
+    "--cache-dir",
+    help="Cache API responses on disk in this directory.",
+    type=str,
+)
+parser_get_stock_data.add_argument(
+    "--replay",
+    help=(
+        "Serve API responses only from the cache specified by --cache-dir, "
+        "without accessing the network."
+    ),
+    action="store_true",
+)
+parser_get_stock_data.add_argument(
+    "--prefilter-yoy-growth",
+    help=(
+        "Fetch financial statements first and fetch prices only for the symbols "
+        "whose latest year-over-year growth of --prefilter-col is more than "
+        "or equal to this threshold, e.g. 0.2 for 20%%. "
+        "Specify it again when resuming a task."
+    ),
+    type=float,
+)
+parser_get_stock_data.add_argument(
+    "--prefilter-col",
+    help="The financial statement column for --prefilter-yoy-growth.",
+    type=str,
+    default="epsdiluted",
+)
+parser_get_stock_data.add_argument(
+    "--layout",
+    help=(
+        "The storage layout of prices and financial statements: "
+        "arrays of records (rows), an array per field (columns), "
+        "or an array per field with OHLCV packed into binary (packed)."
+    ),
+    type=str,
+    choices=["rows", "columns", "packed"],
+    default="rows",
 )
 parser_get_stock_data.set_defaults(fn=run_get_stock_data_task)
 
@@ -1,7 +1,27 @@
+from typing import Callable
+
 from pandas import DataFrame
 import numpy as np
 
 
+def yoy_change(df: DataFrame, col: str, q: int = 4) -> DataFrame:
+    """Adds the year-over-year change columns for the specified column:
+    {col}PrevYear and {col}YoYChangePct.
+
+    :param df: A DataFrame for quarterly financials.
+    :param col: The target column/data name.
+    :param q: The number of quarters in a year.
+    :return: A new DataFrame sorted by date.
+    """
+    df = df.sort_values(by="date", ascending=True)
+    col_change = f"{col}YoYChangePct"
+    col_prev = f"{col}PrevYear"
+
+    df[col_prev] = df[col].shift(q)
+    df[col_change] = (df[col] - df[col_prev]) / abs(df[col_prev])
+    return df
+
+
 def latest_yoy_growth_ratio(
     df: DataFrame, col: str, threshold_pct: float
 ) -> tuple[bool, DataFrame]:
@@ -16,13 +36,8 @@ def latest_yoy_growth_ratio(
     :return: Whether the growth ratio is more than or equal to the threshold:
         True/False.
     """
-    df = df.sort_values(by="date", ascending=True)
+    df = yoy_change(df, col)
     col_change = f"{col}YoYChangePct"
-    col_prev = f"{col}PrevYear"
-    q = 4
-
-    df[col_prev] = df[col].shift(q)
-    df[col_change] = (df[col] - df[col_prev]) / abs(df[col_prev])
 
     filter_result = False
     if df.iloc[-1][col_change] >= threshold_pct:
@@ -31,6 +46,56 @@ def latest_yoy_growth_ratio(
     return filter_result, df
 
 
+def latest_yoy_growth_ratio_panel(
+    df: DataFrame, col: str, threshold_pct: float
+) -> tuple[set[str], DataFrame]:
+    """The cross-sectional version of latest_yoy_growth_ratio.
+    Evaluates all the symbols at once with a grouped shift.
+
+    :param df: A long-format DataFrame for quarterly financials of many symbols,
+        with the columns symbol, date and col.
+    :param col: The target column/data name
+        you want to evaluate the year-over-year growth.
+    :param threshold_pct: The threshold percent in float.
+        For example, 0.2 for 20%.
+    :return: The set of the symbols whose latest growth ratio is more than
+        or equal to the threshold, and the DataFrame with the new columns.
+    """
+    df = df.sort_values(by=["symbol", "date"], ascending=True)
+    col_change = f"{col}YoYChangePct"
+    col_prev = f"{col}PrevYear"
+    q = 4
+
+    df[col_prev] = df.groupby("symbol", sort=False)[col].shift(q)
+    df[col_change] = (df[col] - df[col_prev]) / abs(df[col_prev])
+
+    latest = df.groupby("symbol", sort=False).tail(1)
+    passed = latest.loc[latest[col_change] >= threshold_pct, "symbol"]
+    return set(passed), df
+
+
+def _troughs_and_later_peaks(
+    df: DataFrame, min_: float
+) -> tuple[DataFrame, np.ndarray, np.ndarray]:
+    """Pairs each trough with the highest peak after it.
+
+    :param df: Polygon aggregates data as a DataFrame.
+        It must be preprocessed by the function find_peak_and_trough.
+    :param min_: The minimum price of troughs being evaluated.
+    :return: The pivot rows, the troughs being evaluated
+        and the highest later peak of each of them.
+        A highest later peak is -inf if there is none.
+    """
+    df = df[df["peak"].notna() | df["trough"].notna()].reset_index()
+    troughs = df["trough"].to_numpy(dtype=float)
+    peaks = np.nan_to_num(df["peak"].to_numpy(dtype=float), nan=-np.inf)
+
+    # The suffix maximum of the peaks, shifted to exclude the pivot itself.
+    later_peaks = np.append(np.maximum.accumulate(peaks[::-1])[::-1][1:], -np.inf)
+    is_evaluated = ~np.isnan(troughs) & ~(troughs < min_)
+    return df, troughs[is_evaluated], later_peaks[is_evaluated]
+
+
 def up_x_times_from_lowest(
     df: DataFrame, x: float, min_: float = -1.0
 ) -> tuple[bool, DataFrame]:
@@ -42,21 +107,50 @@ def up_x_times_from_lowest(
     :param min_: The minimum price of price moves being evaluated.
     :return: Whether it has an x times+ up price move or not: True/False.
     """
-    df = df.query("peak.notna() or trough.notna()").reset_index()
-    troughs = df["trough"]
-    peaks = df["peak"]
-    num_records = len(df)
-    for i in range(0, num_records):
-        trough_price = troughs.iat[i]
-        if trough_price < min_:
-            continue
-        if np.isnan(trough_price):
-            continue
-        threshold = trough_price * x
-        next_i = i + 1
-        if next_i >= num_records:
-            break
-        peaks_2x = peaks[next_i:] >= threshold
-        if peaks_2x.any():
-            return True, df
-    return False, df
+    df, troughs, later_peaks = _troughs_and_later_peaks(df, min_)
+    return bool((later_peaks >= troughs * x).any()), df
+
+
+def max_up_multiple_from_lowest(
+    df: DataFrame, min_: float = -1.0
+) -> tuple[float, DataFrame]:
+    """Finds the largest up price move from a trough to a later peak,
+    as a multiple of the trough price. The data has an x times+ up price move
+    if the multiple is x or more, so it answers any x in one pass.
+
+    :param df: Polygon aggregates data as a DataFrame.
+        It must be preprocessed by the function find_peak_and_trough.
+    :param min_: The minimum price of price moves being evaluated.
+    :return: The multiple, or NaN if no trough is followed by a peak.
+    """
+    df, troughs, later_peaks = _troughs_and_later_peaks(df, min_)
+    has_later_peak = later_peaks > -np.inf
+    if not has_later_peak.any():
+        return np.nan, df
+    with np.errstate(divide="ignore"):
+        multiples = later_peaks[has_later_peak] / troughs[has_later_peak]
+    return float(multiples.max()), df
+
+
+def yoy_growth_prefilter(
+    col: str, threshold_pct: float
+) -> Callable[[list[dict]], bool]:
+    """Makes a fundamental pre-filter for the staged fetch mode
+    of GetStockDataTask with latest_yoy_growth_ratio.
+
+    :param col: The target column/data name
+        you want to evaluate the year-over-year growth.
+    :param threshold_pct: The threshold percent in float.
+        For example, 0.2 for 20%.
+    :return: A function that takes quarterly financial statements
+        and returns whether they pass the filter.
+        Its args attribute holds the arguments, so that it can be made again.
+    """
+
+    def prefilter(financials_quarter: list[dict]) -> bool:
+        df = DataFrame.from_records(financials_quarter)
+        filter_result, _ = latest_yoy_growth_ratio(df, col, threshold_pct)
+        return filter_result
+
+    prefilter.args = [col, threshold_pct]
+    return prefilter
@@ -4,13 +4,18 @@ from pandas import DataFrame
 import numpy as np
 
 
-def find_peak_and_trough(df: DataFrame) -> DataFrame:
+def find_peak_and_trough(df: DataFrame, vectorized: bool = True) -> DataFrame:
     """Find the local minimum and the local maximum in price move
     and add new data columns: peak and trough.
 
     :param df: Polygon aggregates data as a DataFrame.
+    :param vectorized: Compares the price differences as whole arrays.
+        If False, it evaluates row by row. Both give the same result.
     :return: A new DataFrame.
     """
+    if vectorized:
+        return _find_peak_and_trough_vectorized(df)
+
     high_low_cols = ("high", "low")
     df = df.copy()
     pivots = df.loc[:, high_low_cols]
@@ -36,6 +41,82 @@ def find_peak_and_trough(df: DataFrame) -> DataFrame:
     return df
 
 
+def _find_peak_and_trough_vectorized(df: DataFrame) -> DataFrame:
+    df = df.copy()
+    df["peak"], df["trough"] = _find_pivots(
+        df["high"].to_numpy(dtype=float), df["low"].to_numpy(dtype=float)
+    )
+    return df
+
+
+def _find_pivots(
+    high: np.ndarray, low: np.ndarray, is_first: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Finds the peaks and the troughs along the last axis.
+
+    :param high: High prices.
+    :param low: Low prices.
+    :param is_first: Whether each price starts a new series, if the arrays hold
+        several series one after another.
+    :return: The peaks and the troughs, NaN where there are none.
+    """
+    high_diff = np.diff(high, axis=-1, prepend=np.nan)
+    low_diff = np.diff(low, axis=-1, prepend=np.nan)
+    if is_first is not None:
+        high_diff[is_first] = np.nan
+        low_diff[is_first] = np.nan
+    high_diff_next = _shift_left(high_diff)
+    low_diff_next = _shift_left(low_diff)
+
+    # Comparisons with NaN are False, as in the row-wise version.
+    is_peak = (high_diff_next < 0) & (0 < high_diff)
+    is_trough = (low_diff < 0) & (0 < low_diff_next)
+    return np.where(is_peak, high, np.nan), np.where(is_trough, low, np.nan)
+
+
+def _shift_left(a: np.ndarray) -> np.ndarray:
+    padding = np.full(a.shape[:-1] + (1,), np.nan)
+    return np.concatenate([a[..., 1:], padding], axis=-1)
+
+
+def _series_starts(symbols: np.ndarray) -> np.ndarray:
+    is_first = np.ones(len(symbols), dtype=bool)
+    is_first[1:] = symbols[1:] != symbols[:-1]
+    return is_first
+
+
+def find_peak_and_trough_panel(df: DataFrame) -> DataFrame:
+    """The cross-sectional version of find_peak_and_trough.
+    Evaluates all the symbols at once, as one array
+    in which the first price of each symbol has no previous price.
+
+    :param df: A long-format DataFrame for the prices of many symbols,
+        with the columns symbol, date, high and low.
+    :return: A new DataFrame sorted by symbol and date,
+        with the new columns peak and trough.
+    """
+    df = df.sort_values(by=["symbol", "date"], ascending=True)
+    df["peak"], df["trough"] = _find_pivots(
+        df["high"].to_numpy(dtype=float),
+        df["low"].to_numpy(dtype=float),
+        _series_starts(df["symbol"].to_numpy()),
+    )
+    return df
+
+
+def find_peak_and_trough_matrix(
+    high: np.ndarray, low: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """The matrix version of find_peak_and_trough.
+
+    :param high: High prices, one row per symbol and one column per date.
+        Symbols with a shorter history are padded with NaN at the start.
+    :param low: Low prices in the same shape.
+    :return: The peaks and the troughs in the same shape, NaN where there are none.
+    """
+    return _find_pivots(np.asarray(high, dtype=float), np.asarray(low, dtype=float))
+
+
 def smoothen_peak_and_trough(df: DataFrame, threshold_pct: float) -> DataFrame:
     """Adds a smoothened pivot data columns: smooth_peak and smooth_trough.
     It will ignore (1) price moves below threshold
@@ -47,49 +128,235 @@ def smoothen_peak_and_trough(df: DataFrame, threshold_pct: float) -> DataFrame:
         For example, 0.03 for 3%.
     :return: A new DataFrame.
     """
+    df = df.copy()
+    df["smooth_peak"], df["smooth_trough"] = _smoothen_pivots(
+        df["peak"].to_numpy(dtype=float),
+        df["trough"].to_numpy(dtype=float),
+        threshold_pct,
+    )
+    return df
 
-    class Pivot:
-        threshold = threshold_pct
 
-        def __init__(self, pivot_type: str, row: int | float, price: float):
-            self.type = pivot_type
-            self.row = row
-            self.price = price
+def _smoothen_pivots(
+    peaks: np.ndarray,
+    troughs: np.ndarray,
+    threshold_pct: float,
+    is_first: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Smoothens the peaks and the troughs of one or more series.
 
-        def is_valid(self, prev: Pivot) -> bool:
-            if np.isnan(self.price):
-                return False
-            if prev.type == "":
-                return True
-            if self.type == "peak" == prev.type:
-                return self.price > prev.price
-            if self.type == "trough" == prev.type:
-                return self.price < prev.price
+    :param peaks: Peaks, NaN where there are none.
+    :param troughs: Troughs in the same shape.
+    :param threshold_pct: The price move threshold in percentage.
+    :param is_first: Whether each row starts a new series, if the arrays
+        hold several series one after another.
+    :return: The smoothened peaks and troughs.
+    """
+    keep_peaks = np.zeros(len(peaks), dtype=bool)
+    keep_troughs = np.zeros(len(troughs), dtype=bool)
+    upper = 1 + threshold_pct
+    lower = 1 - threshold_pct
 
-            diff_pct = self.price / prev.price
-            return diff_pct > 1 + self.threshold or diff_pct < 1 - self.threshold
+    # The series of each row, to forget the last accepted pivot on a new one.
+    series = np.cumsum(is_first) if is_first is not None else np.zeros(len(peaks))
+    current_series = None
+    pivot_rows = np.flatnonzero(~np.isnan(peaks) | ~np.isnan(troughs))
+    for i in pivot_rows:
+        if series[i] != current_series:
+            current_series = series[i]
+            # The last accepted pivot. Its type is 0 until the first pivot,
+            # then 1 for a peak and -1 for a trough.
+            prev_type, prev_row, prev_price = 0, -1, np.nan
+        # A peak is evaluated before a trough on the same row.
+        for pivot_type, prices, keep in (
+            (1, peaks, keep_peaks),
+            (-1, troughs, keep_troughs),
+        ):
+            price = prices[i]
+            if np.isnan(price):
+                continue
+            if prev_type == 0:
+                is_valid = True
+            elif pivot_type == prev_type:
+                # A consecutive peak (trough) replaces a lower (higher) one.
+                is_valid = price > prev_price if pivot_type == 1 else price < prev_price
+            else:
+                diff_pct = price / prev_price
+                is_valid = diff_pct > upper or diff_pct < lower
+            if not is_valid:
+                continue
+            if pivot_type == prev_type:
+                keep[prev_row] = False
+            keep[i] = True
+            prev_type, prev_row, prev_price = pivot_type, i, price
 
-    df = df.copy()
-    peaks = df["peak"].copy()
-    troughs = df["trough"].copy()
-    prev_pivot = Pivot("", np.nan, np.nan)
-    for i in range(0, len(df)):
-        p = Pivot("peak", i, peaks.iat[i])
-        if p.is_valid(prev_pivot):
-            if prev_pivot.type == "peak":
-                peaks.iloc[prev_pivot.row] = np.nan
-            prev_pivot = p
-        else:
-            peaks.iloc[p.row] = np.nan
+    return np.where(keep_peaks, peaks, np.nan), np.where(keep_troughs, troughs, np.nan)
 
-        t = Pivot("trough", i, troughs.iat[i])
-        if t.is_valid(prev_pivot):
-            if prev_pivot.type == "trough":
-                troughs.iloc[prev_pivot.row] = np.nan
-            prev_pivot = t
-        else:
-            troughs.iloc[t.row] = np.nan
 
-    df["smooth_peak"] = peaks
-    df["smooth_trough"] = troughs
+def smoothen_peak_and_trough_panel(df: DataFrame, threshold_pct: float) -> DataFrame:
+    """The cross-sectional version of smoothen_peak_and_trough.
+    Smoothens all the symbols in a single pass over their pivots.
+
+    :param df: A long-format DataFrame for the prices of many symbols.
+        It must be preprocessed by the function find_peak_and_trough_panel.
+    :param threshold_pct: The price move threshold in percentage.
+        For example, 0.03 for 3%.
+    :return: A new DataFrame sorted by symbol and date,
+        with the new columns smooth_peak and smooth_trough.
+    """
+    df = df.sort_values(by=["symbol", "date"], ascending=True)
+    df["smooth_peak"], df["smooth_trough"] = _smoothen_pivots(
+        df["peak"].to_numpy(dtype=float),
+        df["trough"].to_numpy(dtype=float),
+        threshold_pct,
+        _series_starts(df["symbol"].to_numpy()),
+    )
     return df
+
+
+def smoothen_peak_and_trough_matrix(
+    peaks: np.ndarray, troughs: np.ndarray, threshold_pct: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """The matrix version of smoothen_peak_and_trough.
+
+    :param peaks: Peaks, one row per symbol and one column per date,
+        as returned by find_peak_and_trough_matrix.
+    :param troughs: Troughs in the same shape.
+    :param threshold_pct: The price move threshold in percentage.
+        For example, 0.03 for 3%.
+    :return: The smoothened peaks and troughs in the same shape.
+    """
+    peaks = np.asarray(peaks, dtype=float)
+    troughs = np.asarray(troughs, dtype=float)
+    # The rows are smoothened one after another as a single flat array.
+    is_first = np.zeros(peaks.shape, dtype=bool)
+    is_first[:, :1] = True
+    smooth_peaks, smooth_troughs = _smoothen_pivots(
+        peaks.ravel(), troughs.ravel(), threshold_pct, is_first.ravel()
+    )
+    return smooth_peaks.reshape(peaks.shape), smooth_troughs.reshape(peaks.shape)
+
+
+PIVOT_COLUMNS = ("peak", "trough", "smooth_peak", "smooth_trough")
+
+
+class PivotState:
+    def __init__(self, threshold_pct: float):
+        """The pivots of a symbol, updated bar by bar as new daily prices arrive,
+        without evaluating the whole history again. The pivots are the same as
+        find_peak_and_trough and smoothen_peak_and_trough give for the history.
+        A new bar can only turn the previous last bar into a pivot,
+        and it can only drop the last accepted pivot by smoothening,
+        so the state keeps the last two bars and the last accepted pivot.
+
+        :param threshold_pct: The price move threshold in percentage.
+            For example, 0.03 for 3%.
+        """
+        self.threshold_pct = threshold_pct
+        self.num_bars = 0
+        # The high and low prices of the last two bars, NaN before the first bars.
+        self.highs = np.full(2, np.nan)
+        self.lows = np.full(2, np.nan)
+        # The row of the last accepted pivot: its position, its type (peak or trough)
+        # and its values of PIVOT_COLUMNS. None until the first pivot.
+        self.pivot = None
+
+    def update(self, new_bars: DataFrame) -> DataFrame:
+        """Appends bars and evaluates the pivots they change.
+
+        :param new_bars: The new bars sorted by date, with the columns high and low.
+        :return: The changed rows, indexed by their position in the whole history,
+            with the columns peak, trough, smooth_peak and smooth_trough:
+            the previous last bar, the new bars,
+            and the last accepted pivot if it is dropped.
+        """
+        new_highs = new_bars["high"].to_numpy(dtype=float)
+        new_lows = new_bars["low"].to_numpy(dtype=float)
+        if not len(new_highs):
+            return DataFrame(columns=list(PIVOT_COLUMNS), dtype=float)
+
+        highs = np.concatenate([self.highs, new_highs])
+        lows = np.concatenate([self.lows, new_lows])
+        peaks, troughs = _find_pivots(highs, lows)
+        # Skips the bars evaluated before, except the previous last bar.
+        skipped = 2 if self.num_bars == 0 else 1
+        first_row = max(self.num_bars - 1, 0)
+        row_index = np.arange(first_row, first_row + len(peaks) - skipped)
+        columns = {"peak": peaks[skipped:], "trough": troughs[skipped:]}
+
+        # Smoothening starts again from the last accepted pivot alone.
+        pivot = self.pivot
+        head = 0 if pivot is None else 1
+        window = {}
+        for col in ("peak", "trough"):
+            price = np.nan if pivot is None or pivot["type"] != col else pivot[col]
+            window[col] = np.concatenate([[price][:head], columns[col]])
+        smooth = {}
+        smooth["peak"], smooth["trough"] = _smoothen_pivots(
+            window["peak"], window["trough"], self.threshold_pct
+        )
+        columns["smooth_peak"] = smooth["peak"][head:]
+        columns["smooth_trough"] = smooth["trough"][head:]
+
+        if pivot is not None and np.isnan(smooth[pivot["type"]][0]):
+            # Dropped by a later pivot of the same type.
+            row_index = np.concatenate([[pivot["row"]], row_index])
+            for col in PIVOT_COLUMNS:
+                value = np.nan if col == f"smooth_{pivot['type']}" else pivot[col]
+                columns[col] = np.concatenate([[value], columns[col]])
+
+        is_pivot = ~np.isnan(columns["smooth_peak"]) | ~np.isnan(
+            columns["smooth_trough"]
+        )
+        if is_pivot.any():
+            # A trough is evaluated after a peak on the same row.
+            last = np.flatnonzero(is_pivot)[-1]
+            pivot_type = (
+                "peak" if np.isnan(columns["smooth_trough"][last]) else "trough"
+            )
+            self.pivot = {"row": int(row_index[last]), "type": pivot_type}
+            self.pivot.update({c: float(columns[c][last]) for c in PIVOT_COLUMNS})
+
+        self.num_bars += len(new_highs)
+        self.highs = highs[-2:]
+        self.lows = lows[-2:]
+        return DataFrame({c: columns[c] for c in PIVOT_COLUMNS}, index=row_index)
+
+    def to_dict(self) -> dict:
+        """Converts the state to a document to store, with None for NaN.
+
+        :return: The document.
+        """
+        pivot = None
+        if self.pivot is not None:
+            pivot = {k: _nan_to_none(v) for k, v in self.pivot.items()}
+        return {
+            "thresholdPct": self.threshold_pct,
+            "numBars": self.num_bars,
+            "highs": [_nan_to_none(v) for v in self.highs],
+            "lows": [_nan_to_none(v) for v in self.lows],
+            "pivot": pivot,
+        }
+
+    @classmethod
+    def from_dict(cls, doc: dict) -> PivotState:
+        """Restores a state converted by to_dict.
+
+        :param doc: The document.
+        :return: The state.
+        """
+        state = cls(doc["thresholdPct"])
+        state.num_bars = doc["numBars"]
+        state.highs = np.array(doc["highs"], dtype=float)
+        state.lows = np.array(doc["lows"], dtype=float)
+        if doc["pivot"] is not None:
+            state.pivot = {
+                k: np.nan if v is None else v for k, v in doc["pivot"].items()
+            }
+        return state
+
+
+def _nan_to_none(value):
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
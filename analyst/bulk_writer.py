@@ -0,0 +1,130 @@
+import threading
+from logging import getLogger
+from time import monotonic
+from typing import Callable
+
+from pymongo import InsertOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = getLogger("analyst")
+
+
+class BulkWriter:
+    MAX_BUFFER = 500
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(
+        self,
+        collection: Collection,
+        max_buffer: int = MAX_BUFFER,
+        flush_interval: float = FLUSH_INTERVAL,
+        on_flush: Callable[[list, list], None] | None = None,
+    ):
+        """Buffers write operations pushed from worker threads
+        and writes them with a single unordered bulk_write.
+        A background thread flushes the buffer when it reaches max_buffer
+        operations or every flush_interval seconds, so that the workers
+        never wait for the database. Use it as a context manager:
+        the remaining operations are flushed on exit.
+
+        :param collection: The collection to write to.
+        :param max_buffer: The number of buffered operations that triggers a flush.
+        :param flush_interval: The maximum seconds operations stay buffered.
+        :param on_flush: A callback called after each flush with the list of
+            the operations written and the list of the failed operations.
+        """
+        self.collection = collection
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.failed = []
+        self.flush_count = 0
+        self.flush_seconds = 0.0
+        self.written_count = 0
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, operation):
+        """Buffers a write operation such as InsertOne or ReplaceOne.
+
+        :param operation: A pymongo write operation.
+        """
+        with self._buffer_lock:
+            self._buffer.append(operation)
+            full = len(self._buffer) >= self.max_buffer
+        if full:
+            self._wake.set()
+
+    def insert(self, document: dict):
+        """Buffers a document to insert.
+
+        :param document: A document.
+        """
+        self.add(InsertOne(document))
+
+    def flush(self):
+        """Writes the buffered operations to the collection."""
+        with self._flush_lock:
+            with self._buffer_lock:
+                operations, self._buffer = self._buffer, []
+            if not operations:
+                return
+            failed = []
+            started = monotonic()
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as err:
+                for e in err.details["writeErrors"]:
+                    failed.append(operations[e["index"]])
+                    logger.error(f"Bulk write error: {e['errmsg']}")
+            except PyMongoError as err:
+                failed = operations
+                logger.exception(err)
+            self.flush_count += 1
+            self.flush_seconds += monotonic() - started
+            self.written_count += len(operations) - len(failed)
+            self.failed.extend(failed)
+            if self.on_flush is not None:
+                failed_ids = {id(op) for op in failed}
+                written = [op for op in operations if id(op) not in failed_ids]
+                self.on_flush(written, failed)
+
+    def summary(self) -> dict:
+        """Statistics of the writes so far.
+
+        :return: The statistics.
+        """
+        return {
+            "flushes": self.flush_count,
+            "flushSec": round(self.flush_seconds, 3),
+            "written": self.written_count,
+            "failed": len(self.failed),
+        }
+
+    def close(self):
+        """Stops the background thread and flushes the remaining operations."""
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as err:
+                logger.exception(err)
@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    HOUR = 60 * 60
+    DAY = 24 * HOUR
+    DEFAULT_TTLS = {
+        "stock/list": 6 * HOUR,
+        "income-statement": 3 * DAY,
+        "historical-price-full": 12 * HOUR,
+    }
+    DEFAULT_TTL = HOUR
+    MAX_BYTES = 1024**3
+
+    def __init__(
+        self,
+        directory: str | Path,
+        ttls: dict[str, float] | None = None,
+        max_bytes: int = MAX_BYTES,
+        replay_only: bool = False,
+    ):
+        """A persistent on-disk cache of API responses.
+        Responses are content-addressed by the endpoint and the query parameters,
+        expire after a per-endpoint TTL, and the oldest ones are evicted
+        once the cache grows beyond max_bytes.
+
+        :param directory: The cache directory. Created if it does not exist.
+        :param ttls: Seconds to keep responses, by endpoint prefix
+            such as "income-statement". Defaults to DEFAULT_TTLS.
+        :param max_bytes: The maximum total size of the cached responses.
+        :param replay_only: Serves cached responses regardless of their age
+            and never lets a request go to the network.
+            A lookup that misses raises CacheMissError.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttls = ResponseCache.DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self._lock = threading.Lock()
+        self._size = sum(p.stat().st_size for p in self._files())
+
+    def _files(self):
+        return self.directory.glob("*/*.json")
+
+    def _path(self, endpoint: str, params: dict) -> Path:
+        key = json.dumps([endpoint, params], sort_keys=True, default=str)
+        digest = sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def ttl(self, endpoint: str) -> float:
+        """The TTL of an endpoint, matched by the longest configured prefix.
+
+        :param endpoint: The API endpoint path.
+        :return: Seconds to keep the responses of the endpoint.
+        """
+        prefixes = [p for p in self.ttls if endpoint.startswith(p)]
+        if not prefixes:
+            return ResponseCache.DEFAULT_TTL
+        return self.ttls[max(prefixes, key=len)]
+
+    def get(self, endpoint: str, params: dict):
+        """Looks up a cached response.
+
+        :param endpoint: The API endpoint path.
+        :param params: Query parameters, excluding credentials.
+        :return: A tuple of whether it is a hit, and the cached data.
+        """
+        path = self._path(endpoint, params)
+        try:
+            stat = path.stat()
+            if not self.replay_only and time() - stat.st_mtime > self.ttl(endpoint):
+                return False, None
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            if self.replay_only:
+                raise CacheMissError(f"Not cached: {endpoint} {params}")
+            return False, None
+        return True, data
+
+    def put(self, endpoint: str, params: dict, data):
+        """Saves a response and evicts old ones if the cache is full.
+
+        :param endpoint: The API endpoint path.
+        :param params: Query parameters, excluding credentials.
+        :param data: The response data.
+        """
+        path = self._path(endpoint, params)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        size = tmp_path.stat().st_size
+        with self._lock:
+            if path.exists():
+                self._size -= path.stat().st_size
+            os.replace(tmp_path, path)
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda p: p.stat().st_mtime)
+        for p in files:
+            if self._size <= self.max_bytes:
+                break
+            self._size -= p.stat().st_size
+            p.unlink()
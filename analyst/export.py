@@ -0,0 +1,187 @@
+import json
+import logging.config
+from pathlib import Path
+
+from pymongo import MongoClient
+from pandas import DataFrame, concat
+
+from .task_base import AnalystTaskBase
+from .helpers import mongo_uri
+from .layout import prices_frame, statements_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logging.config.fileConfig("logging.ini")
+logger = logging.getLogger("analyst")
+
+TABLES = ("prices", "statements")
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def require_pyarrow():
+    """Raises ImportError with a hint if pyarrow is not installed."""
+    if pq is None:
+        raise ImportError(
+            "Parquet snapshots require pyarrow. "
+            "Install it with: poetry install -E parquet"
+        )
+
+
+class ExportTask(AnalystTaskBase):
+    TASK_TYPE = "export"
+    PARTITION_SIZE = 500
+    CURSOR_BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        description: str,
+        source_task_id: str,
+        directory: str | Path,
+        db_client: MongoClient,
+    ):
+        """A task exports the stock data of a completed GetStockDataTask
+        to a local snapshot of Parquet files, so that it can be screened
+        without accessing the database.
+        Prices and quarterly financial statements are written
+        as long-format tables with a symbol column, partitioned into files
+        of PARTITION_SIZE symbols:
+        <directory>/<source_task_id>/{prices,statements}/part-00000.parquet
+
+        :param description: A description of the task.
+        :param source_task_id: The task id of a completed GetStockDataTask.
+        :param directory: The root directory of the snapshots.
+        :param db_client: A MongoClient instance.
+        """
+        require_pyarrow()
+        super().__init__(description, db_client)
+        self.source_task_id = source_task_id
+        self.snapshot_dir = Path(directory) / source_task_id
+        self.symbols = []
+        self.files = {t: [] for t in TABLES}
+
+    @property
+    def task_type(self):
+        return ExportTask.TASK_TYPE
+
+    def check_source_task(self):
+        """Checks that the source task is a completed GetStockDataTask."""
+        doc = self.task_collection.find_one(
+            {"taskId": self.source_task_id, "taskType": "get_stock_data"}
+        )
+        if doc is None:
+            raise ValueError(f"Task not found: {self.source_task_id}")
+        if not doc["complete"]:
+            raise ValueError(f"Task not complete: {self.source_task_id}")
+
+    def write_partition(self, table_name: str, frames: list[DataFrame]):
+        """Writes a partition of a table.
+
+        :param table_name: One of TABLES.
+        :param frames: The DataFrames of the symbols in the partition.
+        """
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return
+        file_name = f"part-{len(self.files[table_name]):05d}.parquet"
+        path = self.snapshot_dir / table_name / file_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(
+            concat(frames, ignore_index=True), preserve_index=False
+        )
+        pq.write_table(table, path)
+        self.files[table_name].append(f"{table_name}/{file_name}")
+
+    def write_manifest(self):
+        """Writes the list of the symbols and the files of the snapshot."""
+        manifest = {
+            "taskId": self.source_task_id,
+            "exportTaskId": self.task_id,
+            "symbols": self.symbols,
+            "files": self.files,
+        }
+        with open(self.snapshot_dir / MANIFEST_FILE_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    def run(self):
+        """Exports the stock data of the source task."""
+        self.check_source_task()
+        self.mark_start()
+        logger.info(f"Exporting stock data to {self.snapshot_dir}")
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        cursor = self.stock_data_collection.find(
+            {"taskId": self.source_task_id},
+            {"symbol.symbol": 1, "data": 1},
+            batch_size=ExportTask.CURSOR_BATCH_SIZE,
+        )
+        partition = {t: [] for t in TABLES}
+        num_symbols = 0
+        for doc in cursor:
+            symbol_name = doc["symbol"]["symbol"]
+            self.symbols.append(symbol_name)
+            for table_name, frame in (
+                ("prices", prices_frame(doc)),
+                ("statements", statements_frame(doc)),
+            ):
+                frame = frame.drop(columns="symbol", errors="ignore")
+                frame.insert(0, "symbol", symbol_name)
+                partition[table_name].append(frame)
+            num_symbols += 1
+            if num_symbols % ExportTask.PARTITION_SIZE == 0:
+                for table_name in TABLES:
+                    self.write_partition(table_name, partition[table_name])
+                partition = {t: [] for t in TABLES}
+        for table_name in TABLES:
+            self.write_partition(table_name, partition[table_name])
+        self.write_manifest()
+        logger.info(f"Exported {num_symbols} symbols.")
+        self.mark_complete()
+
+
+def read_manifest(snapshot_dir: str | Path) -> dict:
+    """Reads the manifest of a snapshot.
+
+    :param snapshot_dir: The snapshot directory: <directory>/<task_id>.
+    :return: The manifest.
+    """
+    with open(Path(snapshot_dir) / MANIFEST_FILE_NAME, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_snapshot_table(
+    snapshot_dir: str | Path, table_name: str, columns: list[str]
+) -> DataFrame:
+    """Reads some columns of a table of a snapshot.
+    The files are memory-mapped and only the requested columns are read.
+    A column missing in a partition is filled with nulls.
+
+    :param snapshot_dir: The snapshot directory: <directory>/<task_id>.
+    :param table_name: One of TABLES.
+    :param columns: The columns to read.
+    :return: The long-format DataFrame.
+    """
+    require_pyarrow()
+    manifest = read_manifest(snapshot_dir)
+    frames = []
+    for file_name in manifest["files"][table_name]:
+        path = Path(snapshot_dir) / file_name
+        available = set(pq.read_schema(path).names)
+        table = pq.read_table(
+            path, columns=[c for c in columns if c in available], memory_map=True
+        )
+        frames.append(table.to_pandas().reindex(columns=columns))
+    if not frames:
+        return DataFrame(columns=columns)
+    return concat(frames, ignore_index=True)
+
+
+def run_export_task(args):
+    """Runs an export task"""
+    with MongoClient(mongo_uri()) as mongo_client:
+        task = ExportTask("Export", args.task_id, args.directory, mongo_client)
+        task.run()
+        logger.info(f"Complete. Task ID: {task.task_id}")
@@ -1,5 +1,7 @@
 import os
+import json
 from datetime import date, timedelta
+from typing import Iterable, Iterator
 
 from dotenv import load_dotenv
 
@@ -30,3 +32,64 @@ def date_window(close_date_iso: str, n_days: int) -> tuple[str, str]:
     close_date = date.fromisoformat(close_date_iso)
     open_date = close_date - timedelta(days=n_days)
     return open_date.isoformat(), close_date.isoformat()
+
+
+def merge_by_date(
+    old: list[dict], new: list[dict], since: str = "", limit: int | None = None
+) -> list[dict]:
+    """Merges two lists of dated records, such as daily prices
+    or financial statements. Records in new replace records in old
+    that have the same date.
+
+    :param old: Records already stored.
+    :param new: Newly fetched records.
+    :param since: Records older than this ISO formatted date are dropped.
+    :param limit: The maximum number of records to keep, latest first.
+    :return: Merged records sorted by date, latest first.
+    """
+    merged = {r["date"]: r for r in old}
+    merged.update({r["date"]: r for r in new})
+    records = [r for d, r in merged.items() if d >= since]
+    records.sort(key=lambda r: r["date"], reverse=True)
+    return records[:limit]
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator:
+    """Parses a JSON array incrementally from chunks of text,
+    yielding each element as soon as it is complete.
+    Only the current incomplete element is kept in memory.
+
+    :param chunks: Chunks of the JSON text, e.g. from a streamed response.
+    :return: An iterator over the elements of the array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Not a JSON array.")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is incomplete.
+                break
+            if end >= len(buffer):
+                # A number may continue in the next chunk.
+                break
+            yield element
+            pos = end
+        buffer = buffer[pos:]
+    raise ValueError("Unexpected end of a JSON array.")
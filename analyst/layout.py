@@ -0,0 +1,109 @@
+import numpy as np
+from bson import Binary
+from pandas import DataFrame
+
+# "rows" stores an array of records, "columns" an array per field,
+# and "packed" also packs the OHLCV arrays into float64 binary.
+LAYOUTS = ("rows", "columns", "packed")
+PACKED_FIELDS = ("open", "high", "low", "close", "volume")
+PACKED_DTYPE = np.dtype("<f8")
+
+
+def is_columnar(stored) -> bool:
+    """Whether a stored table is in the columnar layout.
+    The layout is told by the type: a dict of columns instead of a list of records.
+
+    :param stored: A stored table such as data.prices.historical.
+    :return: True if columnar.
+    """
+    return isinstance(stored, dict)
+
+
+def to_layout(records: list[dict], layout: str):
+    """Converts records to a storage layout.
+
+    :param records: A list of records.
+    :param layout: One of LAYOUTS.
+    :return: The table to store.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    if layout == "rows":
+        return records
+    columns = {}
+    for i, record in enumerate(records):
+        for key, value in record.items():
+            if key not in columns:
+                columns[key] = [None] * len(records)
+            columns[key][i] = value
+    if layout == "packed":
+        for key in PACKED_FIELDS:
+            if key in columns:
+                array = np.asarray(columns[key], dtype=PACKED_DTYPE)
+                columns[key] = Binary(array.tobytes())
+    return columns
+
+
+def to_frame(stored) -> DataFrame:
+    """Builds a DataFrame from a stored table in any layout.
+    Columnar tables are built straight from the columns.
+
+    :param stored: A stored table such as data.prices.historical.
+    :return: The DataFrame, indexed by the position of each record.
+    """
+    if not is_columnar(stored):
+        return DataFrame.from_records(stored)
+    return DataFrame({key: unpack(value) for key, value in stored.items()})
+
+
+def to_records(stored) -> list[dict]:
+    """Converts a stored table in any layout to a list of records.
+
+    :param stored: A stored table such as data.prices.historical.
+    :return: The list of records.
+    """
+    if not is_columnar(stored):
+        return stored
+    columns = {}
+    for key, value in stored.items():
+        column = unpack(value)
+        if isinstance(column, np.ndarray):
+            # A missing value is packed as NaN.
+            column = [None if np.isnan(v) else v for v in column.tolist()]
+        columns[key] = column
+    num_rows = max((len(c) for c in columns.values()), default=0)
+    records = [{} for _ in range(num_rows)]
+    for key, column in columns.items():
+        for record, value in zip(records, column):
+            if value is not None:
+                record[key] = value
+    return records
+
+
+def unpack(column) -> list | np.ndarray:
+    """Unpacks a packed binary column. Other columns are returned as they are.
+
+    :param column: A stored column.
+    :return: The column values.
+    """
+    if isinstance(column, bytes):
+        return np.frombuffer(column, dtype=PACKED_DTYPE)
+    return column
+
+
+def statements_frame(doc: dict) -> DataFrame:
+    """Loads the quarterly financial statements of a stock data document.
+
+    :param doc: A stock data document.
+    :return: The DataFrame, indexed by the position of each record.
+    """
+    return to_frame(doc["data"]["financial_statements"]["quarter"])
+
+
+def prices_frame(doc: dict) -> DataFrame:
+    """Loads the daily prices of a stock data document.
+
+    :param doc: A stock data document.
+    :return: The DataFrame, indexed by the position of each record.
+    """
+    return to_frame(doc["data"]["prices"]["historical"])
@@ -0,0 +1,224 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from pandas import DataFrame
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.collection import Collection
+
+from .bulk_writer import BulkWriter
+from .layout import is_columnar
+
+
+def uses_metrics(fn: Callable) -> Callable:
+    """Declares that a filter function takes a MetricStore
+    as the keyword argument metrics, to read precomputed metrics from.
+
+    :param fn: A filter function.
+    :return: The filter function.
+    """
+    fn.uses_metrics = True
+    return fn
+
+
+def call_filter(
+    filter_fn: Callable, data: dict, metrics=None, params: dict | None = None
+) -> tuple[bool, dict]:
+    """Calls a filter function, passing the metric store if it takes one.
+
+    :param filter_fn: A filter function.
+    :param data: A stock data document.
+    :param metrics: A MetricStore, or None.
+    :param params: Keyword arguments of the filter function, or None.
+    :return: The filter result and the patch.
+    """
+    params = params or {}
+    if getattr(filter_fn, "uses_metrics", False):
+        return filter_fn(data, metrics=metrics, **params)
+    return filter_fn(data, **params)
+
+
+def statements_version(data: dict) -> str:
+    """The version of the quarterly financial statements of a stock data document:
+    the task that stored them and the date of the latest statement.
+    It is read from the document as it is, without building a DataFrame.
+
+    :param data: A stock data document, with at least taskId
+        and data.financial_statements.quarter.
+    :return: The version.
+    """
+    stored = data["data"]["financial_statements"]["quarter"]
+    if is_columnar(stored):
+        dates = stored.get("date", [])
+    else:
+        dates = [r.get("date") for r in stored]
+    latest = max((d for d in dates if d), default="")
+    return f"{data['taskId']}/{latest}"
+
+
+class MetricStore:
+    MAX_ENTRIES = 10000
+    MAX_AGE = timedelta(days=30)
+
+    def __init__(self, collection: Collection, max_entries: int = MAX_ENTRIES):
+        """A store of derived metrics such as year-over-year changes,
+        keyed by the symbol, the version of the input data,
+        the metric name and its parameters.
+        A metric is computed again only when its input data changes.
+        Recently used metrics are also kept in memory,
+        and the metrics of many symbols can be loaded at once with prefetch.
+
+        :param collection: The collection to store the metrics in.
+        :param max_entries: The maximum number of metrics kept in memory.
+        """
+        self.collection = collection
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Writes the metrics in bulk if set, instead of one by one.
+        self.writer: BulkWriter | None = None
+        self._memory = OrderedDict()
+        # The symbols whose stored metrics are all in memory.
+        self._prefetched = OrderedDict()
+        self._lock = threading.Lock()
+        self.collection.create_index(
+            [
+                ("symbol", ASCENDING),
+                ("name", ASCENDING),
+                ("params", ASCENDING),
+                ("version", ASCENDING),
+            ]
+        )
+
+    def get(self, symbol: str, version: str, name: str, params: dict):
+        """Looks up a metric.
+
+        :param symbol: A ticker symbol.
+        :param version: The version of the input data.
+        :param name: The metric name.
+        :param params: The metric parameters.
+        :return: The metric value as a DataFrame, or None if not stored.
+        """
+        key = (symbol, version, name, params_key(params))
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if symbol in self._prefetched:
+                return None
+        doc = self.collection.find_one(
+            {"symbol": key[0], "version": key[1], "name": key[2], "params": key[3]}
+        )
+        if doc is None:
+            return None
+        value = DataFrame(doc["value"]["data"], index=doc["value"]["index"])
+        self._remember(key, value)
+        return value
+
+    def prefetch(self, symbols: Iterable[str]):
+        """Loads the stored metrics of symbols into memory with a single query,
+        so that looking them up afterwards needs no query, even if not stored.
+
+        :param symbols: Ticker symbols, such as those of a cursor batch.
+        """
+        symbols = list(symbols)
+        for doc in self.collection.find({"symbol": {"$in": symbols}}):
+            key = (doc["symbol"], doc["version"], doc["name"], doc["params"])
+            value = DataFrame(doc["value"]["data"], index=doc["value"]["index"])
+            self._remember(key, value)
+        with self._lock:
+            for symbol in symbols:
+                self._prefetched[symbol] = True
+                self._prefetched.move_to_end(symbol)
+            while len(self._prefetched) > self.max_entries:
+                self._prefetched.popitem(last=False)
+
+    def put(self, symbol: str, version: str, name: str, params: dict, value):
+        """Stores a metric, replacing the older version of it.
+        It is written with the writer if set.
+
+        :param symbol: A ticker symbol.
+        :param version: The version of the input data.
+        :param name: The metric name.
+        :param params: The metric parameters.
+        :param value: The metric value as a DataFrame.
+        """
+        key = (symbol, version, name, params_key(params))
+        filter_ = {"symbol": key[0], "name": key[2], "params": key[3]}
+        # Only the latest version is kept, so it is not part of the filter.
+        operation = ReplaceOne(
+            filter_,
+            {
+                **filter_,
+                "version": version,
+                "value": {
+                    "index": value.index.tolist(),
+                    "data": value.to_dict("list"),
+                },
+                "updated": datetime.now(),
+            },
+            upsert=True,
+        )
+        if self.writer is None:
+            self.collection.bulk_write([operation])
+        else:
+            self.writer.add(operation)
+        self._remember(key, value)
+
+    def get_or_compute(
+        self,
+        symbol: str,
+        version: str,
+        name: str,
+        params: dict,
+        compute: Callable[[], DataFrame],
+    ) -> DataFrame:
+        """Gets a metric, computing and storing it if not stored
+        for the current version of the input data.
+
+        :param symbol: A ticker symbol.
+        :param version: The version of the input data, such as statements_version.
+            It should be cheap to get, as it is needed even if the metric is stored.
+        :param name: The metric name.
+        :param params: The metric parameters.
+        :param compute: A function that loads the input data
+            and computes the metric. It is called only if the metric is not stored.
+        :return: The metric value. It may be shared, so do not modify it.
+        """
+        value = self.get(symbol, version, name, params)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = compute()
+            self.put(symbol, version, name, params, value)
+        return value
+
+    def evict_older_than(self, max_age: timedelta = MAX_AGE) -> int:
+        """Deletes the metrics not updated for max_age.
+
+        :param max_age: The maximum age.
+        :return: The number of the deleted metrics.
+        """
+        deleted = self.collection.delete_many(
+            {"updated": {"$lt": datetime.now() - max_age}}
+        )
+        return deleted.deleted_count
+
+    def summary(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _remember(self, key: tuple, value: DataFrame):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+def params_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True)
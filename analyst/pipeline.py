@@ -0,0 +1,205 @@
+import threading
+from time import perf_counter
+from typing import Callable
+
+from .metrics import call_filter
+
+
+class FilterStage:
+    def __init__(self, name: str, filter_fn: Callable):
+        """A stage of FilterPipeline, with the statistics of its evaluations.
+
+        :param name: The name of the stage.
+        :param filter_fn: A filtering function of ScreenerTask.
+        """
+        self.name = name
+        self.filter_fn = filter_fn
+        self.evaluated = 0
+        self.passed = 0
+        self.seconds = 0.0
+
+    @property
+    def fields(self) -> tuple[str] | None:
+        return getattr(self.filter_fn, "fields", None)
+
+    @property
+    def cost(self) -> float | None:
+        """The mean seconds per evaluation. None if never evaluated."""
+        if not self.evaluated:
+            return None
+        return self.seconds / self.evaluated
+
+    @property
+    def pass_rate(self) -> float | None:
+        """The ratio of the passed evaluations. None if never evaluated."""
+        if not self.evaluated:
+            return None
+        return self.passed / self.evaluated
+
+    @property
+    def rank(self) -> float:
+        """The expected cost of the stage per rejected symbol.
+        Stages with a lower rank should run first.
+        """
+        if self.pass_rate == 1:
+            return float("inf")
+        return self.cost / (1 - self.pass_rate)
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "evaluated": self.evaluated,
+            "passed": self.passed,
+            "seconds": round(self.seconds, 6),
+            "passRate": self.pass_rate,
+            "costSec": self.cost,
+        }
+
+
+class FilterPipeline:
+    MIN_SAMPLES = 100
+    # Passes the metric store to the stages that take one.
+    uses_metrics = True
+
+    def __init__(self, stages: list[FilterStage], adaptive: bool = True):
+        """An ordered list of filter stages applied in a single pass per symbol.
+        A symbol is rejected as soon as a stage rejects it,
+        and the patches of the evaluated stages are merged.
+        It is a filtering function of ScreenerTask itself.
+
+        :param stages: The stages, in the initial order.
+        :param adaptive: Reorders the stages by their rank every MIN_SAMPLES
+            evaluations, so that cheap and selective stages run first.
+        """
+        names = [s.name for s in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names: {names}")
+        self.stages = stages
+        self.adaptive = adaptive
+        self._evaluated = 0
+        self._lock = threading.Lock()
+
+    @property
+    def fields(self) -> tuple[str] | None:
+        """The union of the fields the stages declare.
+        None (the whole document) if any stage does not declare them.
+        """
+        fields = []
+        for stage in self.stages:
+            if stage.fields is None:
+                return None
+            fields.extend(f for f in stage.fields if f not in fields)
+        return tuple(fields)
+
+    @property
+    def stage_names(self) -> list[str]:
+        """The names of the stages in the current order."""
+        return [s.name for s in self.stages]
+
+    def copy(
+        self, order: list[str] | None = None, adaptive: bool | None = None
+    ) -> "FilterPipeline":
+        """Makes a new pipeline of the same filter functions, without statistics.
+        The name and the module of a registered pipeline are kept.
+
+        :param order: The names of the stages in the new order.
+            The current order if omitted.
+        :param adaptive: Whether the new pipeline reorders the stages.
+            The same as this pipeline if omitted.
+        :return: The new pipeline.
+        """
+        filter_fns = {s.name: s.filter_fn for s in self.stages}
+        order = self.stage_names if order is None else order
+        pipeline = FilterPipeline(
+            [FilterStage(name, filter_fns[name]) for name in order],
+            adaptive=self.adaptive if adaptive is None else adaptive,
+        )
+        for attr in ("filter_name", "filter_module"):
+            if hasattr(self, attr):
+                setattr(pipeline, attr, getattr(self, attr))
+        return pipeline
+
+    def __call__(self, data: dict, metrics=None, **params: dict) -> tuple[bool, dict]:
+        """Applies the stages to a stock data document.
+
+        :param data: A stock data document.
+        :param metrics: A MetricStore, or None.
+        :param params: The keyword arguments of the filter functions by stage name.
+        :return: The filter result and the merged patch.
+        """
+        patch = {}
+        filter_result = True
+        for stage in self.stages:
+            started = perf_counter()
+            filter_result, stage_patch = call_filter(
+                stage.filter_fn, data, metrics, params.get(stage.name)
+            )
+            elapsed = perf_counter() - started
+            with self._lock:
+                stage.evaluated += 1
+                stage.passed += bool(filter_result)
+                stage.seconds += elapsed
+            patch.update(stage_patch)
+            if not filter_result:
+                break
+        if self.adaptive:
+            self._count_and_reorder()
+        return filter_result, patch
+
+    def _count_and_reorder(self):
+        with self._lock:
+            self._evaluated += 1
+            if self._evaluated % FilterPipeline.MIN_SAMPLES == 0:
+                self.reorder()
+
+    def reorder(self):
+        """Sorts the stages by their rank: the mean cost divided by
+        the rejection rate. Only the stages evaluated MIN_SAMPLES times or more
+        are sorted, among their positions. The others keep their positions,
+        so that a stage rarely reached does not hold back the rest.
+        """
+        positions = [
+            i
+            for i, s in enumerate(self.stages)
+            if s.evaluated >= FilterPipeline.MIN_SAMPLES
+        ]
+        ranked = sorted((self.stages[i] for i in positions), key=lambda s: s.rank)
+        stages = list(self.stages)
+        for i, stage in zip(positions, ranked):
+            stages[i] = stage
+        self.stages = stages
+
+    def take_stats(self) -> dict[str, tuple[int, int, float]]:
+        """Takes the statistics of the stages and resets them,
+        to be merged into another copy of the pipeline with merge_stats.
+
+        :return: The evaluated count, the passed count and the seconds by stage.
+        """
+        with self._lock:
+            stats = {s.name: (s.evaluated, s.passed, s.seconds) for s in self.stages}
+            for stage in self.stages:
+                stage.evaluated, stage.passed, stage.seconds = 0, 0, 0.0
+        return stats
+
+    def merge_stats(self, stats: dict[str, tuple[int, int, float]]):
+        """Adds the statistics taken from another copy of the pipeline,
+        such as the one in a process pool worker.
+
+        :param stats: The statistics returned by take_stats.
+        """
+        with self._lock:
+            for stage in self.stages:
+                evaluated, passed, seconds = stats.get(stage.name, (0, 0, 0.0))
+                stage.evaluated += evaluated
+                stage.passed += passed
+                stage.seconds += seconds
+            if self.adaptive:
+                self.reorder()
+
+    def summary(self) -> list[dict]:
+        """The statistics of the stages in the current order.
+
+        :return: The statistics.
+        """
+        with self._lock:
+            return [s.summary() for s in self.stages]
@@ -0,0 +1,156 @@
+import threading
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = 1.0):
+        """A thread-safe token bucket that refills smoothly over time.
+        Callers reserve tokens in advance and wait until the reservation matures,
+        so concurrent callers are spaced out evenly instead of bursting.
+
+        :param rate_per_minute: The refill rate, tokens per minute.
+        :param capacity: The maximum number of tokens that can be accumulated
+            while idle, i.e. the largest burst allowed.
+        """
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate_per_second(self) -> float:
+        return self.rate_per_minute / 60
+
+    def set_rate(self, rate_per_minute: float):
+        """Changes the refill rate. Tokens accrued so far are kept.
+
+        :param rate_per_minute: The new refill rate, tokens per minute.
+        """
+        with self._lock:
+            self._refill()
+            self.rate_per_minute = rate_per_minute
+
+    def _refill(self):
+        now = monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+
+    def reserve(self, n: float = 1.0) -> float:
+        """Takes n tokens from the bucket, going into debt if necessary.
+
+        :param n: The number of tokens to take.
+        :return: Seconds the caller has to wait before using the tokens.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= n
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_second
+
+    def acquire(self, n: float = 1.0):
+        """Blocks the current thread until n tokens are available.
+
+        :param n: The number of tokens to take.
+        """
+        delay = self.reserve(n)
+        if delay > 0:
+            sleep(delay)
+
+
+class AdaptiveRateController:
+    INCREASE_RPM = 30
+    DECREASE_FACTOR = 0.5
+    LATENCY_TOLERANCE = 2.0
+    LATENCY_SMOOTHING = 0.1
+    DECREASE_COOLDOWN = 1.0
+
+    def __init__(
+        self,
+        initial_rpm: float,
+        min_rpm: float = 1.0,
+        max_rpm: float | None = None,
+        increase_rpm: float = INCREASE_RPM,
+        decrease_factor: float = DECREASE_FACTOR,
+    ):
+        """An AIMD (additive increase, multiplicative decrease) request rate
+        controller shared by all the threads issuing requests.
+        The rate grows by increase_rpm per minute of unthrottled traffic,
+        and is cut by decrease_factor when the server responds with 429.
+        Growth is held while the observed latency is well above its baseline,
+        and a Retry-After header pauses every caller until it has elapsed.
+
+        :param initial_rpm: The starting rate, requests per minute.
+        :param min_rpm: The lower bound of the rate.
+        :param max_rpm: The upper bound of the rate. Unbounded if None.
+        :param increase_rpm: The additive increase per minute of clean traffic.
+        :param decrease_factor: The multiplier applied on throttling.
+        """
+        self.min_rpm = min_rpm
+        self.max_rpm = max_rpm
+        self.increase_rpm = increase_rpm
+        self.decrease_factor = decrease_factor
+        self.bucket = TokenBucket(initial_rpm)
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._latency = None
+        self._latency_baseline = None
+
+    @property
+    def rate_per_minute(self) -> float:
+        return self.bucket.rate_per_minute
+
+    def _pause_remaining(self) -> float:
+        with self._lock:
+            return self._paused_until - monotonic()
+
+    def acquire(self):
+        """Blocks the current thread until a request may be sent."""
+        pause = self._pause_remaining()
+        if pause > 0:
+            sleep(pause)
+        self.bucket.acquire()
+
+    def on_success(self, latency: float):
+        """Records a successful (not throttled) request and grows the rate.
+
+        :param latency: The request latency, seconds.
+        """
+        with self._lock:
+            if self._latency is None:
+                self._latency = latency
+            else:
+                a = AdaptiveRateController.LATENCY_SMOOTHING
+                self._latency = a * latency + (1 - a) * self._latency
+            if self._latency_baseline is None:
+                self._latency_baseline = self._latency
+            self._latency_baseline = min(self._latency_baseline, self._latency)
+            tolerance = AdaptiveRateController.LATENCY_TOLERANCE
+            if self._latency > self._latency_baseline * tolerance:
+                return
+            rate = self.bucket.rate_per_minute
+            rate += self.increase_rpm / rate
+            if self.max_rpm is not None:
+                rate = min(rate, self.max_rpm)
+            self.bucket.set_rate(rate)
+
+    def on_throttle(self, retry_after: float | None = None):
+        """Records a throttled (429) request and backs the rate off.
+        Throttled responses arriving together are treated as a single event.
+
+        :param retry_after: Seconds the server asked to wait, if specified.
+        """
+        with self._lock:
+            self.throttled_count += 1
+            now = monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease < AdaptiveRateController.DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+            rate = self.bucket.rate_per_minute * self.decrease_factor
+            self.bucket.set_rate(max(rate, self.min_rpm))
@@ -1,25 +1,104 @@
+import os
+import atexit
+import importlib
+import inspect
+import threading
+from pathlib import Path
+import multiprocessing
 import logging.config
 from typing import Callable
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from queue import Queue
-from copy import deepcopy
+from time import monotonic
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 from pandas import DataFrame
+import numpy as np
 
 from .task_base import AnalystTaskBase
 from .helpers import mongo_uri
-from .algo.filter import latest_yoy_growth_ratio
+from .bulk_writer import BulkWriter
+from .pipeline import FilterPipeline, FilterStage
+from .metrics import MetricStore, call_filter, statements_version, uses_metrics
+from .layout import is_columnar, prices_frame, statements_frame, unpack
+from .symbols import id_array
+from .export import read_manifest, read_snapshot_table, require_pyarrow
+from .algo.filter import (
+    latest_yoy_growth_ratio,
+    latest_yoy_growth_ratio_panel,
+    up_x_times_from_lowest,
+    yoy_change,
+)
+from .algo.preprocess import find_peak_and_trough
 
 load_dotenv()
 
 logging.config.fileConfig("logging.ini")
 logger = logging.getLogger("analyst")
 
+# Filter functions by name, so that process pool workers can look them up.
+FILTERS: dict[str, Callable] = {}
+# The metric store of a process pool worker.
+_worker_metric_store: MetricStore | None = None
+# The default threshold of the year-over-year growth of the diluted EPS.
+EPS_YOY_GROWTH_THRESHOLD = 0.2
+# Returned by get_path for a path that does not exist.
+MISSING = object()
+
+
+def uses_fields(*fields: str) -> Callable:
+    """Declares the stock data fields a filter function reads,
+    so that ScreenerTask only loads those fields.
+    A filter function without the declaration gets the whole document.
+
+    :param fields: Dotted paths such as "data.financial_statements.quarter".
+    :return: A decorator.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        fn.fields = fields
+        return fn
+
+    return decorator
+
+
+def register_filter(name: str) -> Callable:
+    """Registers a module-level filter function by name,
+    so that it can be run in the process pool mode of ScreenerTask.
+    Process pool workers import the module that registers it
+    to look it up, so it must be registered at the module level.
+
+    :param name: The name of the filter.
+    :return: A decorator.
+    """
+    module_name = inspect.currentframe().f_back.f_globals["__name__"]
+
+    def decorator(fn: Callable) -> Callable:
+        if name in FILTERS:
+            raise ValueError(f"Filter already registered: {name}")
+        fn.filter_name = name
+        fn.filter_module = module_name
+        FILTERS[name] = fn
+        return fn
+
+    return decorator
+
 
 class ScreenerTask(AnalystTaskBase):
     TASK_TYPE = "screener"
+    CURSOR_BATCH_SIZE = 500
+    NUM_WORKERS = 8
+    QUEUE_SIZE = 1000
+    RESULT_BATCH_SIZE = 100
+    RESULT_FLUSH_INTERVAL = 2.0
+    EXECUTORS = ("thread", "process")
+    PROCESS_CHUNK_SIZE = 50
 
     def __init__(
         self,
@@ -27,17 +106,50 @@ class ScreenerTask(AnalystTaskBase):
         target_task_id: str,
         filter_fn: Callable,
         db_client: MongoClient,
+        executor: str = "thread",
+        metric_store: MetricStore | None = None,
+        filter_params: dict | None = None,
     ):
         """A task filters the stock data saved in the database.
         [Side Effect] It will update the source stock data on running.
 
         :param description: A description of the task.
         :param target_task_id: The task id of a ScreenerTask.
-        :param filter_fn: A filtering function.
+        :param filter_fn: A filtering function. It takes a stock data document
+            and returns whether it matches, and a patch: a dict of the dotted
+            paths of the fields it derived and their values, to be $set
+            on the document. For example,
+            {"data.financial_statements.quarter.0.epsdilutedPrevYear": 1.2}.
         :param db_client: A MongoClient instance.
+        :param executor: "thread" applies filter_fn in a thread pool.
+            "process" applies it in a process pool, for CPU-bound filters.
+            filter_fn must be registered with register_filter in that case.
+        :param metric_store: A MetricStore passed to the filter functions
+            that take one, to reuse the metrics computed by previous runs.
+        :param filter_params: Keyword arguments passed to filter_fn,
+            such as {"threshold_pct": 0.3}. For a FilterPipeline,
+            the keyword arguments of each stage by the stage name.
         """
+        if executor not in ScreenerTask.EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+        if executor == "process" and not hasattr(filter_fn, "filter_name"):
+            raise ValueError("The process executor requires a registered filter.")
+        if isinstance(filter_fn, FilterPipeline):
+            # The statistics of a registered pipeline are not shared by tasks.
+            filter_fn = filter_fn.copy()
         super().__init__(description, db_client)
         self.source_symbols = []
+        self.source_symbol_ids: list[int] | None = None
+        self.stock_data_writer: BulkWriter | None = None
+        self._executor = executor
+        self.metric_store = metric_store
+        self.filter_params = filter_params
+        self._result_started = False
+        self._pending_matches = []
+        self._num_screened = 0
+        self._num_matched = 0
+        self._result_flushed = 0.0
+        self._result_lock = threading.Lock()
         self._q_filtered_symbols = Queue()
         self._filter_fn = filter_fn
         self._target_task_id = target_task_id
@@ -50,6 +162,21 @@ class ScreenerTask(AnalystTaskBase):
     def filtered_symbols(self):
         return list(self._q_filtered_symbols.queue)
 
+    @property
+    def filtered_symbol_ids(self) -> np.ndarray:
+        """The ids of self.filtered_symbols as a sorted integer array."""
+        return id_array(self.symbol_dictionary.ids(self.filtered_symbols).values())
+
+    @property
+    def projection(self) -> dict | None:
+        """The projection of the fields filter_fn declares with uses_fields.
+        None (the whole document) if it does not declare them.
+        """
+        fields = getattr(self._filter_fn, "fields", None)
+        if fields is None:
+            return None
+        return {"symbol.symbol": 1, **{f: 1 for f in fields}}
+
     def single_get_and_filter(self, symbol_name: str):
         """Gets a single stock data from the database
         and applies filter_fn.
@@ -58,25 +185,74 @@ class ScreenerTask(AnalystTaskBase):
 
         :param symbol_name: A ticker symbol.
         """
-        data = self.get_stock_data_from_db(symbol_name)
-        try:
-            filter_result, updated = self._filter_fn(data)
-        except Exception as err:
-            logger.error(
-                f"Exception while applying the filter function to {symbol_name}"
-            )
-            logger.exception(err)
-            return
-        filter_ = {
-            "taskId": self._target_task_id,
-            "symbol.symbol": symbol_name,
-        }
-        self.stock_data_collection.update_one(
-            filter_, {"$set": {"data": updated["data"]}}
+        self.filter_and_update(self.get_stock_data_from_db(symbol_name))
+
+    def filter_and_update(self, data: dict):
+        """Applies filter_fn to a stock data document
+        and writes the patch it returns back to the database.
+        Then saves the symbol name to self.filtered_symbols list
+        if it matches the given criteria.
+
+        :param data: A stock data document, with at least the fields
+            filter_fn declares.
+        """
+        self.record_result(
+            apply_filter(self._filter_fn, data, self.metric_store, self.filter_params)
         )
+
+    def record_result(self, result: tuple | None):
+        """Saves the result of apply_filter. While the task is running,
+        the matched symbols are also appended to the filter result
+        in the database in batches, along with the progress.
+
+        :param result: The result of apply_filter. None if it failed.
+        """
+        if result is not None:
+            self.save_result(*result)
+        if not self._result_started:
+            return
+        with self._result_lock:
+            self._num_screened += 1
+            if result is not None and result[2]:
+                self._num_matched += 1
+                self._pending_matches.append(result[0])
+            due = (
+                len(self._pending_matches) >= ScreenerTask.RESULT_BATCH_SIZE
+                or monotonic() - self._result_flushed
+                >= ScreenerTask.RESULT_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush_filter_result()
+
+    def save_result(
+        self, symbol_name: str, document_id, filter_result: bool, patch: dict
+    ):
+        """Writes the patch of a filtered stock data
+        and saves the symbol name if it matches.
+
+        :param symbol_name: A ticker symbol.
+        :param document_id: The _id of the stock data document.
+        :param filter_result: Whether it matches the given criteria.
+        :param patch: A dict of dotted paths and values to $set.
+        """
+        if patch:
+            self.save_patch(document_id, patch)
         if filter_result:
             self._q_filtered_symbols.put(symbol_name)
 
+    def save_patch(self, document_id, patch: dict):
+        """Writes a patch with the bulk writer while the task is running,
+        or immediately otherwise.
+
+        :param document_id: The _id of the stock data document.
+        :param patch: A dict of dotted paths and values to $set.
+        """
+        operation = UpdateOne({"_id": document_id}, {"$set": patch})
+        if self.stock_data_writer is None:
+            self.stock_data_collection.bulk_write([operation])
+        else:
+            self.stock_data_writer.add(operation)
+
     def get_stock_data_from_db(self, symbol_name: str) -> dict:
         """Gets a single stock data from the database.
 
@@ -86,7 +262,134 @@ class ScreenerTask(AnalystTaskBase):
             "taskId": self._target_task_id,
             "symbol.symbol": symbol_name,
         }
-        return self.stock_data_collection.find_one(filter_)
+        return self.stock_data_collection.find_one(filter_, self.projection)
+
+    def iter_stock_data_from_db(self):
+        """Streams the stock data of the source symbols
+        with a single cursor, in batches of CURSOR_BATCH_SIZE documents.
+
+        :return: An iterator of the stock data documents.
+        """
+        filter_ = self.source_filter()
+        return self.stock_data_collection.find(
+            filter_, self.projection, batch_size=ScreenerTask.CURSOR_BATCH_SIZE
+        )
+
+    def _filter_worker(self, q: Queue):
+        while True:
+            data = q.get()
+            if data is None:
+                return
+            # A failure must not stop the worker, or the producer could block
+            # on the bounded queue once all the workers are gone.
+            try:
+                self.filter_and_update(data)
+            except Exception as err:
+                logger.error(f"Exception while screening {data.get('_id')}")
+                logger.exception(err)
+
+    def screen_in_threads(self):
+        """Applies filter_fn to the source stock data in a thread pool.
+        The derived metrics are read and written in bulk if there is a metric store.
+        """
+        store = self.metric_store
+        if store is None:
+            self._screen_in_threads()
+            return
+        store.writer = BulkWriter(store.collection)
+        try:
+            self._screen_in_threads()
+        finally:
+            store.writer.close()
+            store.writer = None
+
+    def _screen_in_threads(self):
+        # The cursor feeds the workers through a bounded queue,
+        # so at most QUEUE_SIZE documents are held in memory.
+        q = Queue(maxsize=ScreenerTask.QUEUE_SIZE)
+        num_workers = ScreenerTask.NUM_WORKERS
+        with ThreadPoolExecutor(num_workers) as e:
+            futures = [e.submit(self._filter_worker, q) for _ in range(num_workers)]
+            try:
+                for batch in iter_chunks(
+                    self.iter_stock_data_from_db(), ScreenerTask.CURSOR_BATCH_SIZE
+                ):
+                    # The metrics of a batch are read with a single query.
+                    if self.metric_store is not None:
+                        self.metric_store.prefetch(d["symbol"]["symbol"] for d in batch)
+                    for data in batch:
+                        q.put(data)
+            finally:
+                for _ in range(num_workers):
+                    q.put(None)
+            e.shutdown(wait=True)
+            for f in futures:
+                error = f.exception()
+                if error:
+                    logger.error(error)
+
+    def screen_in_processes(self):
+        """Applies filter_fn to the source stock data in a process pool.
+        The documents are sent to the workers in chunks of PROCESS_CHUNK_SIZE,
+        and only the results come back to be written by this process.
+        """
+        filter_name = self._filter_fn.filter_name
+        num_workers = os.cpu_count() or 1
+        # Two chunks per worker keep the workers busy
+        # without reading the whole cursor into memory.
+        max_pending = 2 * num_workers
+        # Forking is unsafe here since the bulk writer thread is running.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._filter_fn.filter_module, self.metric_store is not None),
+        ) as e:
+            pending = set()
+            for chunk in iter_chunks(
+                self.iter_stock_data_from_db(), ScreenerTask.PROCESS_CHUNK_SIZE
+            ):
+                # The stages of a pipeline are reordered here as the statistics
+                # of the workers are merged, and the workers follow the order.
+                stage_order = getattr(self._filter_fn, "stage_names", None)
+                pending.add(
+                    e.submit(
+                        _apply_filter_chunk,
+                        filter_name,
+                        chunk,
+                        stage_order,
+                        self.filter_params,
+                    )
+                )
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._save_chunk_results(done)
+            done, _ = wait(pending)
+            self._save_chunk_results(done)
+
+    def _save_chunk_results(self, futures):
+        for f in futures:
+            error = f.exception()
+            if error:
+                logger.error(error)
+                continue
+            results, stats = f.result()
+            if stats is not None:
+                self._filter_fn.merge_stats(stats)
+            for result in results:
+                self.record_result(result)
+
+    def save_filter_stats(self):
+        """Saves the statistics of the stages of a FilterPipeline
+        to the task document.
+        """
+        if not isinstance(self._filter_fn, FilterPipeline):
+            return
+        self.task_collection.update_one(
+            {"_id": self.document_id},
+            {"$set": {"filterStats": self._filter_fn.summary()}},
+        )
 
     def get_symbols_list_from_db(self) -> list[str]:
         """Gets a ticker symbols lisf of a preceding
@@ -96,14 +399,89 @@ class ScreenerTask(AnalystTaskBase):
         symbols = self.screener_collection.find_one(filter_)
         return symbols["tickerSymbols"]
 
-    def save_filter_result(self):
-        """Saves the filter result (self.filtered_symbols) to the database."""
-        self.screener_collection.insert_one(
+    def get_symbol_ids_from_db(self) -> list[int] | None:
+        """Gets the symbol ids of a preceding screener task (target_task_id).
+
+        :return: The sorted symbol ids. None if the task did not save them.
+        """
+        filter_ = {"taskId": self._target_task_id}
+        symbols = self.screener_collection.find_one(filter_, {"symbolIds": 1})
+        return symbols.get("symbolIds")
+
+    def source_filter(self) -> dict:
+        """The query of the stock data of the source symbols.
+        It matches the integer symbol ids when they are available,
+        instead of the nested symbol names.
+        """
+        if self.source_symbol_ids is not None:
+            symbols = {"symbolId": {"$in": self.source_symbol_ids}}
+        else:
+            symbols = {"symbol.symbol": {"$in": self.source_symbols}}
+        return {"taskId": self._target_task_id, **symbols}
+
+    def start_filter_result(self):
+        """Saves an empty filter result and the progress to the database,
+        so that the matched symbols can be appended while the task is running.
+        """
+        result = {"taskId": self.task_id, "tickerSymbols": []}
+        if self.source_symbol_ids is not None:
+            result["symbolIds"] = []
+        self.screener_collection.insert_one(result)
+        self.task_collection.update_one(
+            {"_id": self.document_id},
             {
-                "taskId": self.task_id,
-                "tickerSymbols": self.filtered_symbols,
-            }
+                "$set": {
+                    "progress": {
+                        "total": len(self.source_symbols),
+                        "screened": 0,
+                        "matched": 0,
+                    }
+                }
+            },
         )
+        self._result_flushed = monotonic()
+        self._result_started = True
+
+    def flush_filter_result(self):
+        """Appends the matched symbols not saved yet to the filter result
+        and updates the progress in the database.
+        """
+        with self._result_lock:
+            matches, self._pending_matches = self._pending_matches, []
+            if matches:
+                push = {"tickerSymbols": {"$each": matches}}
+                if self.source_symbol_ids is not None:
+                    symbol_ids = self.symbol_dictionary.ids(matches).values()
+                    push["symbolIds"] = {
+                        "$each": id_array(symbol_ids).tolist(),
+                        "$sort": 1,
+                    }
+                self.screener_collection.update_one(
+                    {"taskId": self.task_id}, {"$push": push}
+                )
+            self.task_collection.update_one(
+                {"_id": self.document_id},
+                {
+                    "$set": {
+                        "progress.screened": self._num_screened,
+                        "progress.matched": self._num_matched,
+                    }
+                },
+            )
+            self._result_flushed = monotonic()
+
+    def save_filter_result(self):
+        """Saves the filter result (self.filtered_symbols) to the database.
+        If it was started with start_filter_result, saves the rest of it.
+        The symbol ids are saved as well if the source stock data has them.
+        """
+        if self._result_started:
+            self.flush_filter_result()
+            return
+        result = {"taskId": self.task_id, "tickerSymbols": self.filtered_symbols}
+        if self.source_symbol_ids is not None:
+            result["symbolIds"] = self.filtered_symbol_ids.tolist()
+        self.screener_collection.insert_one(result)
 
     def run(self):
         """Gets a target ticker symbols list from a preceding screener task
@@ -113,36 +491,457 @@ class ScreenerTask(AnalystTaskBase):
         self.mark_start()
         logger.info("Getting ticker symbols.")
         self.source_symbols = self.get_symbols_list_from_db()
+        self.source_symbol_ids = self.get_symbol_ids_from_db()
         logger.info(f"Screening tickers. Total: {len(self.source_symbols)}")
-        with ThreadPoolExecutor() as e:
-            futures = []
-            for s in self.source_symbols:
-                futures.append(e.submit(self.single_get_and_filter, s))
-            e.shutdown(wait=True)
-            for f in futures:
-                error = f.exception()
-                if error:
-                    logger.error(error)
+        self.start_filter_result()
+        self.stock_data_writer = BulkWriter(self.stock_data_collection)
+        with self.stock_data_writer:
+            if self._executor == "process":
+                self.screen_in_processes()
+            else:
+                self.screen_in_threads()
+        logger.info(f"Stock data updates: {self.stock_data_writer.summary()}")
+        self.stock_data_writer = None
+        self.save_filter_stats()
+        if self.metric_store is not None:
+            logger.info(f"Derived metrics: {self.metric_store.summary()}")
+        logger.info("Saving the filter result.")
+        self.save_filter_result()
+        logger.info("Done.")
+        self.mark_complete()
+
+
+class PanelScreenerTask(ScreenerTask):
+    STATEMENTS_PATH = "data.financial_statements.quarter"
+
+    def __init__(
+        self,
+        description: str,
+        target_task_id: str,
+        panel_fn: Callable[[DataFrame], tuple[set[str], DataFrame]],
+        columns: list[str],
+        db_client: MongoClient,
+    ):
+        """A screener task that evaluates all the symbols at once
+        over a single long-format DataFrame of quarterly financials,
+        instead of applying a filter function symbol by symbol.
+        [Side Effect] It will update the source stock data on running.
+
+        :param description: A description of the task.
+        :param target_task_id: The task id of a ScreenerTask.
+        :param panel_fn: A function that takes the long-format DataFrame
+            keyed by symbol and date, and returns the set of the matched symbols
+            and the DataFrame with new columns.
+        :param columns: The financial statement columns panel_fn needs.
+        :param db_client: A MongoClient instance.
+        """
+        super().__init__(description, target_task_id, None, db_client)
+        self._panel_fn = panel_fn
+        self._columns = columns
+        self._columnar_ids = set()
+
+    def load_statements_panel(self) -> DataFrame:
+        """Loads the quarterly financials of the source symbols
+        into a single long-format DataFrame.
+        The columns _id and _row keep where each row is stored.
+
+        :return: The DataFrame.
+        """
+        path = PanelScreenerTask.STATEMENTS_PATH
+        columns = ["date", *self._columns]
+        filter_ = self.source_filter()
+        projection = {"symbol.symbol": 1, **{f"{path}.{c}": 1 for c in columns}}
+        cursor = self.stock_data_collection.find(
+            filter_, projection, batch_size=ScreenerTask.CURSOR_BATCH_SIZE
+        )
+        symbols, document_ids, positions = [], [], []
+        values = {c: [] for c in columns}
+        for doc in cursor:
+            stored = doc["data"]["financial_statements"]["quarter"]
+            if is_columnar(stored):
+                self._columnar_ids.add(doc["_id"])
+                stored = {c: unpack(v) for c, v in stored.items()}
+                n = max(map(len, stored.values()), default=0)
+                for c in columns:
+                    values[c].extend(stored.get(c, [None] * n))
+            else:
+                n = len(stored)
+                for c in columns:
+                    values[c].extend(r.get(c) for r in stored)
+            symbols.extend([doc["symbol"]["symbol"]] * n)
+            document_ids.extend([doc["_id"]] * n)
+            positions.extend(range(n))
+        return DataFrame(
+            {"symbol": symbols, "_id": document_ids, "_row": positions, **values}
+        )
+
+    def save_new_columns(self, df: DataFrame, new_columns: list[str]):
+        """Writes the new columns back to the source stock data.
+
+        :param df: The DataFrame returned by panel_fn.
+        :param new_columns: The columns to write.
+        """
+        path = PanelScreenerTask.STATEMENTS_PATH
+        values = {c: df[c].to_numpy().tolist() for c in new_columns}
+        patches, columnar_rows = {}, {}
+        for k, (document_id, i) in enumerate(
+            zip(df["_id"].to_numpy().tolist(), df["_row"].to_numpy().tolist())
+        ):
+            if document_id in self._columnar_ids:
+                columnar_rows.setdefault(document_id, []).append((i, k))
+                continue
+            patch = patches.setdefault(document_id, {})
+            for c in new_columns:
+                patch[f"{path}.{i}.{c}"] = values[c][k]
+        # A columnar document gets each new column as a whole, in stored order.
+        for document_id, rows in columnar_rows.items():
+            rows.sort()
+            patches[document_id] = {
+                f"{path}.{c}": [values[c][k] for _, k in rows] for c in new_columns
+            }
+        with BulkWriter(self.stock_data_collection) as writer:
+            for document_id, patch in patches.items():
+                writer.add(UpdateOne({"_id": document_id}, {"$set": patch}))
+
+    def run(self):
+        """Gets a target ticker symbols list from a preceding screener task
+        then apply panel_fn to the stock data stored in the database.
+        Requires the GetStockDataTask result saved in the database.
+        """
+        self.mark_start()
+        logger.info("Getting ticker symbols.")
+        self.source_symbols = self.get_symbols_list_from_db()
+        self.source_symbol_ids = self.get_symbol_ids_from_db()
+        logger.info(f"Loading stock data. Total: {len(self.source_symbols)}")
+        df = self.load_statements_panel()
+        logger.info("Screening tickers.")
+        matched, updated_df = self._panel_fn(df)
+        new_columns = [c for c in updated_df.columns if c not in df.columns]
+        logger.info("Saving the new columns.")
+        self.save_new_columns(updated_df, new_columns)
+        for s in sorted(matched):
+            self._q_filtered_symbols.put(s)
         logger.info("Saving the filter result.")
         self.save_filter_result()
         logger.info("Done.")
         self.mark_complete()
 
 
+class ParquetScreenerTask(PanelScreenerTask):
+    def __init__(
+        self,
+        description: str,
+        snapshot_dir: str | Path,
+        panel_fn: Callable[[DataFrame], tuple[set[str], DataFrame]],
+        columns: list[str],
+        db_client: MongoClient,
+    ):
+        """A panel screener task that reads a Parquet snapshot
+        written by ExportTask instead of the stock data in the database.
+        The snapshot files are memory-mapped and only the needed columns
+        are read. The database only records the task and the filter result.
+
+        :param description: A description of the task.
+        :param snapshot_dir: The snapshot directory: <directory>/<task_id>.
+        :param panel_fn: A function that takes the long-format DataFrame
+            keyed by symbol and date, and returns the set of the matched symbols
+            and the DataFrame with new columns.
+        :param columns: The financial statement columns panel_fn needs.
+        :param db_client: A MongoClient instance.
+        """
+        require_pyarrow()
+        snapshot_dir = Path(snapshot_dir)
+        super().__init__(description, snapshot_dir.name, panel_fn, columns, db_client)
+        self.snapshot_dir = snapshot_dir
+
+    def get_symbols_list_from_db(self) -> list[str]:
+        """Gets the ticker symbols list of the snapshot."""
+        return read_manifest(self.snapshot_dir)["symbols"]
+
+    def get_symbol_ids_from_db(self) -> None:
+        """The snapshot is filtered by the symbol names."""
+        return None
+
+    def load_statements_panel(self) -> DataFrame:
+        """Loads the quarterly financials of the source symbols
+        from the snapshot into a single long-format DataFrame.
+
+        :return: The DataFrame.
+        """
+        columns = ["symbol", "date", *self._columns]
+        df = read_snapshot_table(self.snapshot_dir, "statements", columns)
+        return df[df["symbol"].isin(self.source_symbols)]
+
+    def save_new_columns(self, df: DataFrame, new_columns: list[str]):
+        """Does nothing: the snapshot is read-only."""
+
+
+def apply_filter(
+    filter_fn: Callable,
+    data: dict,
+    metrics: MetricStore | None = None,
+    params: dict | None = None,
+) -> tuple | None:
+    """Applies a filter function to a stock data document.
+
+    :param filter_fn: A filtering function.
+    :param data: A stock data document.
+    :param metrics: A MetricStore, or None.
+    :param params: Keyword arguments of the filter function, or None.
+    :return: A tuple of the symbol name, the document _id, the filter result
+        and the patch. None if the filter function raised an exception.
+    """
+    symbol_name = data["symbol"]["symbol"]
+    try:
+        filter_result, patch = call_filter(filter_fn, data, metrics, params)
+    except Exception as err:
+        logger.error(f"Exception while applying the filter function to {symbol_name}")
+        logger.exception(err)
+        return None
+    return symbol_name, data["_id"], filter_result, patch
+
+
+def _init_worker(filter_module: str, use_metric_store: bool):
+    # Runs in a process pool worker. Importing the module registers the filter,
+    # as the worker has only imported this module.
+    # A MongoClient cannot be shared with the parent process,
+    # so each worker opens its own metric store.
+    global _worker_metric_store
+    importlib.import_module(filter_module)
+    if use_metric_store:
+        client = MongoClient(mongo_uri())
+        # Closed when the worker exits on the shutdown of the pool.
+        atexit.register(client.close)
+        db = client[AnalystTaskBase.DB_NAME]
+        _worker_metric_store = MetricStore(db[AnalystTaskBase.METRICS_COLLECTION_NAME])
+
+
+def _apply_filter_chunk(
+    filter_name: str,
+    chunk: list[dict],
+    stage_order: list[str] | None = None,
+    params: dict | None = None,
+) -> tuple[list, dict]:
+    # Runs in a process pool worker. A pipeline runs its stages
+    # in the order of the parent, and its statistics are sent back
+    # to be merged there.
+    filter_fn = FILTERS[filter_name]
+    if isinstance(filter_fn, FilterPipeline):
+        filter_fn = filter_fn.copy(stage_order, adaptive=False)
+    store = _worker_metric_store
+    if store is None:
+        results = [apply_filter(filter_fn, data, params=params) for data in chunk]
+    else:
+        # The metrics of a chunk are read with a single query
+        # and written with a single bulk write.
+        store.prefetch(data["symbol"]["symbol"] for data in chunk)
+        store.writer = BulkWriter(store.collection)
+        try:
+            results = [apply_filter(filter_fn, data, store, params) for data in chunk]
+        finally:
+            store.writer.close()
+            store.writer = None
+    stats = None
+    if isinstance(filter_fn, FilterPipeline):
+        stats = filter_fn.take_stats()
+    return results, stats
+
+
+def iter_chunks(iterable, size: int):
+    """Splits an iterable into lists of up to size items.
+
+    :param iterable: An iterable.
+    :param size: The chunk size.
+    :return: An iterator of the chunks.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rows_patch(
+    path: str, df: DataFrame, cols: list[str], columnar: bool = False
+) -> dict:
+    """Makes a $set document that updates some columns of an array of records,
+    without rewriting the whole array.
+    In the columnar layout, it sets the whole arrays of the columns instead.
+
+    :param path: The path to the array of records in the document.
+    :param df: A DataFrame indexed by the position of each record in the array.
+        In the columnar layout, it must have all the records.
+    :param cols: The columns to update.
+    :param columnar: Whether the records are stored in the columnar layout.
+    :return: The $set document.
+    """
+    positions = df.index.to_numpy()
+    if columnar:
+        order = np.argsort(positions, kind="stable")
+        return {f"{path}.{col}": df[col].to_numpy()[order].tolist() for col in cols}
+    positions = positions.tolist()
+    patch = {}
+    for col in cols:
+        for i, value in zip(positions, df[col].to_numpy().tolist()):
+            patch[f"{path}.{i}.{col}"] = value
+    return patch
+
+
+def unstored_patch(data: dict, patch: dict) -> dict:
+    """Leaves out the fields of a patch whose values are already stored,
+    so that a document screened again is not rewritten.
+
+    :param data: The stock data document the patch is for.
+    :param patch: A dict of dotted paths and values to $set.
+    :return: The patch of the values not stored yet.
+    """
+    return {
+        path: value
+        for path, value in patch.items()
+        if not same_value(get_path(data, path), value)
+    }
+
+
+def get_path(data: dict, path: str):
+    """Gets the value at a dotted path such as "data.quarter.0.eps".
+
+    :param data: A document.
+    :param path: The dotted path. Array elements are given by their positions.
+    :return: The value, or MISSING if the path does not exist.
+    """
+    value = data
+    for key in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(key, MISSING)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def same_value(a, b) -> bool:
+    """Compares stored values, taking NaN as equal to NaN.
+
+    :param a: A value.
+    :param b: A value.
+    :return: Whether they are the same.
+    """
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_value(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b):
+        return True
+    return a is not MISSING and a == b
+
+
+@register_filter("eps_yoy_growth")
+@uses_fields("taskId", "data.financial_statements.quarter")
+@uses_metrics
+def eps_yoy_growth_filter(
+    data: dict,
+    metrics: MetricStore | None = None,
+    threshold_pct: float = EPS_YOY_GROWTH_THRESHOLD,
+) -> tuple[bool, dict]:
+    """Matches the stock data whose latest year-over-year growth of
+    the diluted EPS is more than or equal to the threshold.
+    With a metric store, the year-over-year changes of unchanged statements
+    are reused without loading them, so trying thresholds costs little.
+
+    :param data: A stock data document.
+    :param metrics: A MetricStore to reuse the year-over-year changes from.
+    :param threshold_pct: The threshold percent in float.
+        For example, 0.2 for 20%.
+    :return: The filter result and the patch of the values not stored yet.
+    """
+    col = "epsdiluted"
+    new_columns = [f"{col}PrevYear", f"{col}YoYChangePct"]
+    if metrics is None:
+        filter_result, updated_df = latest_yoy_growth_ratio(
+            statements_frame(data), col, threshold_pct
+        )
+    else:
+        updated_df = metrics.get_or_compute(
+            data["symbol"]["symbol"],
+            statements_version(data),
+            "yoy_change",
+            {"col": col},
+            lambda: yoy_change(statements_frame(data)[["date", col]], col)[new_columns],
+        )
+        filter_result = bool(updated_df[new_columns[1]].iloc[-1] >= threshold_pct)
+    columnar = is_columnar(data["data"]["financial_statements"]["quarter"])
+    patch = rows_patch(
+        PanelScreenerTask.STATEMENTS_PATH, updated_df, new_columns, columnar
+    )
+    return filter_result, unstored_patch(data, patch)
+
+
+@register_filter("price_up_2x")
+@uses_fields("data.prices.historical")
+def price_up_2x_filter(data: dict) -> tuple[bool, dict]:
+    """Matches the stock data that has a 2x+ up price move
+    from a trough to a later peak.
+
+    :param data: A stock data document.
+    :return: The filter result and an empty patch.
+    """
+    df = prices_frame(data).sort_values(by="date", ascending=True)
+    df = find_peak_and_trough(df.reset_index(drop=True))
+    filter_result, _ = up_x_times_from_lowest(df, 2.0)
+    return filter_result, {}
+
+
+register_filter("eps_yoy_growth_and_price_up_2x")(
+    FilterPipeline(
+        [
+            FilterStage("eps_yoy_growth", eps_yoy_growth_filter),
+            FilterStage("price_up_2x", price_up_2x_filter),
+        ]
+    )
+)
+
+
 def run_screener_task(args):
     """Runs a screener task"""
 
-    def fn(data):
-        q_financials = data["data"]["financial_statements"]["quarter"]
-        df = DataFrame.from_records(q_financials)
-        filter_result, updated_df = latest_yoy_growth_ratio(df, "epsdiluted", 0.2)
-        updated = deepcopy(data)
-        updated["data"]["financial_statements"]["quarter"] = updated_df.to_dict(
-            "records"
-        )
-        return filter_result, updated
+    filter_params = args.filter_params or {}
+    threshold_pct = filter_params.get("threshold_pct", EPS_YOY_GROWTH_THRESHOLD)
+
+    def panel_fn(df):
+        return latest_yoy_growth_ratio_panel(df, "epsdiluted", threshold_pct)
 
     with MongoClient(mongo_uri()) as mongo_client:
-        task = ScreenerTask("Screener", args.target_task_id, fn, mongo_client)
+        metric_store = None
+        if args.metric_cache:
+            db = mongo_client[AnalystTaskBase.DB_NAME]
+            metric_store = MetricStore(db[AnalystTaskBase.METRICS_COLLECTION_NAME])
+            evicted = metric_store.evict_older_than()
+            logger.info(f"Evicted {evicted} old derived metrics.")
+        if args.parquet:
+            task = ParquetScreenerTask(
+                "Screener",
+                Path(args.parquet) / args.target_task_id,
+                panel_fn,
+                ["epsdiluted"],
+                mongo_client,
+            )
+        elif args.panel:
+            task = PanelScreenerTask(
+                "Screener", args.target_task_id, panel_fn, ["epsdiluted"], mongo_client
+            )
+        else:
+            task = ScreenerTask(
+                "Screener",
+                args.target_task_id,
+                FILTERS[args.filter],
+                mongo_client,
+                executor=args.executor,
+                metric_store=metric_store,
+                filter_params=args.filter_params,
+            )
         task.run()
         logger.info(f"Complete. Task ID: {task.task_id}")
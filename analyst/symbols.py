@@ -0,0 +1,128 @@
+import threading
+from typing import Iterable
+
+import numpy as np
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+ID_DTYPE = np.int32
+DUPLICATE_KEY_ERROR = 11000
+
+
+class SymbolDictionary:
+    COUNTER_ID = "symbolId"
+
+    def __init__(self, collection: Collection, counters_collection: Collection):
+        """A dictionary that assigns stable integer ids to ticker symbols.
+        An id never changes once assigned, so it can be stored in place of
+        the symbol name. Known ids are cached in memory.
+
+        :param collection: The collection of {_id: id, symbol: name} documents.
+        :param counters_collection: The collection of the id sequence.
+        """
+        self.collection = collection
+        self.counters_collection = counters_collection
+        self._ids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.collection.create_index("symbol", unique=True)
+
+    def _remember(self, symbol_name: str, symbol_id: int):
+        with self._lock:
+            self._ids[symbol_name] = symbol_id
+            self._names[symbol_id] = symbol_name
+
+    def load(self):
+        """Loads all the assigned ids into memory."""
+        for doc in self.collection.find({}):
+            self._remember(doc["symbol"], doc["_id"])
+
+    def _reserve_ids(self, n: int) -> range:
+        counter = self.counters_collection.find_one_and_update(
+            {"_id": SymbolDictionary.COUNTER_ID},
+            {"$inc": {"seq": n}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return range(counter["seq"] - n + 1, counter["seq"] + 1)
+
+    def _assign(self, symbol_names: list[str]):
+        """Assigns new ids to symbols with one counter update and one insert.
+
+        :param symbol_names: Ticker symbols with no id, without duplicates.
+        """
+        docs = [
+            {"_id": i, "symbol": s}
+            for i, s in zip(self._reserve_ids(len(symbol_names)), symbol_names)
+        ]
+        assigned_elsewhere = []
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as err:
+            for e in err.details["writeErrors"]:
+                if e["code"] != DUPLICATE_KEY_ERROR:
+                    raise
+                # Assigned by another process in the meantime.
+                assigned_elsewhere.append(docs[e["index"]]["symbol"])
+        for doc in docs:
+            if doc["symbol"] not in assigned_elsewhere:
+                self._remember(doc["symbol"], doc["_id"])
+        if assigned_elsewhere:
+            for doc in self.collection.find({"symbol": {"$in": assigned_elsewhere}}):
+                self._remember(doc["symbol"], doc["_id"])
+
+    def id(self, symbol_name: str) -> int:
+        """Gets the id of a symbol, assigning a new one if it has none.
+
+        :param symbol_name: A ticker symbol.
+        :return: The id.
+        """
+        return self.ids([symbol_name])[symbol_name]
+
+    def ids(self, symbol_names: Iterable[str]) -> dict[str, int]:
+        """Gets the ids of symbols, assigning new ones to those with none.
+        New ids are assigned in bulk, so pass all the symbols at once
+        rather than calling it for each symbol.
+
+        :param symbol_names: Ticker symbols.
+        :return: The ids by symbol.
+        """
+        symbol_names = list(symbol_names)
+        with self._lock:
+            missing = list(dict.fromkeys(s for s in symbol_names if s not in self._ids))
+        if missing:
+            for doc in self.collection.find({"symbol": {"$in": missing}}):
+                self._remember(doc["symbol"], doc["_id"])
+            with self._lock:
+                missing = [s for s in missing if s not in self._ids]
+            if missing:
+                self._assign(missing)
+        with self._lock:
+            return {s: self._ids[s] for s in symbol_names}
+
+    def names(self, symbol_ids: Iterable[int]) -> dict[int, str]:
+        """Gets the symbols of ids.
+
+        :param symbol_ids: Symbol ids.
+        :return: The symbols by id. Unknown ids are left out.
+        """
+        symbol_ids = [int(i) for i in symbol_ids]
+        with self._lock:
+            missing = [i for i in symbol_ids if i not in self._names]
+        if missing:
+            for doc in self.collection.find({"_id": {"$in": missing}}):
+                self._remember(doc["symbol"], doc["_id"])
+        with self._lock:
+            return {i: self._names[i] for i in symbol_ids if i in self._names}
+
+
+def id_array(symbol_ids: Iterable[int]) -> np.ndarray:
+    """Makes a set of symbol ids: a sorted array of unique integers.
+    Set operations on them are vectorized,
+    e.g. np.intersect1d(a, b, assume_unique=True).
+
+    :param symbol_ids: Symbol ids.
+    :return: The sorted array.
+    """
+    return np.unique(np.fromiter(symbol_ids, dtype=ID_DTYPE))
@@ -6,6 +6,8 @@ from pymongo import MongoClient
 from bson import ObjectId
 from dotenv import load_dotenv
 
+from .symbols import SymbolDictionary
+
 load_dotenv()
 
 
@@ -15,6 +17,9 @@ class AnalystTaskBase:
     TASK_COLLECTION_NAME = "tasks"
     STOCK_DATA_COLLECTION_NAME = "stock_data"
     SCREENER_COLLECTION_NAME = "screener_results"
+    METRICS_COLLECTION_NAME = "derived_metrics"
+    SYMBOLS_COLLECTION_NAME = "symbols"
+    COUNTERS_COLLECTION_NAME = "counters"
 
     def __init__(self, description: str, db_client: MongoClient):
         """Represents a time-consuming task.
@@ -26,6 +31,7 @@ class AnalystTaskBase:
         self._db_client = db_client
         self.description = description
         self.document_id: None | ObjectId = None
+        self._symbol_dictionary: None | SymbolDictionary = None
 
     @property
     def task_type(self):
@@ -46,6 +52,16 @@ class AnalystTaskBase:
         collection_name = AnalystTaskBase.SCREENER_COLLECTION_NAME
         return self._get_collection(collection_name)
 
+    @property
+    def symbol_dictionary(self) -> SymbolDictionary:
+        """The dictionary of the integer ids of ticker symbols."""
+        if self._symbol_dictionary is None:
+            self._symbol_dictionary = SymbolDictionary(
+                self._get_collection(AnalystTaskBase.SYMBOLS_COLLECTION_NAME),
+                self._get_collection(AnalystTaskBase.COUNTERS_COLLECTION_NAME),
+            )
+        return self._symbol_dictionary
+
     def _get_collection(self, collection_name: str):
         db_name = AnalystTaskBase.DB_NAME
         return self._db_client[db_name][collection_name]
@@ -64,6 +80,24 @@ class AnalystTaskBase:
         )
         self.document_id = inserted.inserted_id
 
+    def restore(self, task_id: str) -> dict:
+        """Restores the state of a task saved in the DB,
+        so that an interrupted task can be resumed.
+
+        :param task_id: The task id.
+        :return: The task document.
+        """
+        doc = self.task_collection.find_one(
+            {"taskId": task_id, "taskType": self.task_type}
+        )
+        if doc is None:
+            raise ValueError(f"Task not found: {task_id}")
+        self.task_id = task_id
+        self.timestamp = doc["started"]
+        self.description = doc["description"]
+        self.document_id = doc["_id"]
+        return doc
+
     def mark_complete(self):
         """Updates the task status in the DB, setting the complete field to True."""
         self.task_collection.update_one(
@@ -0,0 +1,173 @@
+import threading
+from bisect import bisect_left
+from time import monotonic
+
+
+class LatencyHistogram:
+    # Upper bounds of the buckets, milliseconds. The last bucket is unbounded.
+    BUCKETS_MS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+    def __init__(self):
+        """A fixed-bucket latency histogram.
+        Memory does not grow with the number of samples.
+        Percentiles are estimated with the upper bound of the bucket.
+        """
+        self.counts = [0] * (len(LatencyHistogram.BUCKETS_MS) + 1)
+        self.max_ms = 0.0
+
+    def add(self, latency: float):
+        """Adds a sample.
+
+        :param latency: The latency, seconds.
+        """
+        latency_ms = latency * 1000
+        self.counts[bisect_left(LatencyHistogram.BUCKETS_MS, latency_ms)] += 1
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, p: float) -> float | None:
+        """Estimates a percentile.
+
+        :param p: The percentile in float. For example, 0.9 for p90.
+        :return: The estimated latency, milliseconds. None if no samples.
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= total * p:
+                if i < len(LatencyHistogram.BUCKETS_MS):
+                    return float(min(LatencyHistogram.BUCKETS_MS[i], self.max_ms))
+                return self.max_ms
+        return self.max_ms
+
+    def summary(self) -> dict:
+        buckets = [str(b) for b in LatencyHistogram.BUCKETS_MS] + ["inf"]
+        return {
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max_ms,
+            "histogram": dict(zip(buckets, self.counts)),
+        }
+
+
+class EndpointStats:
+    def __init__(self):
+        """Counters of the requests to a single API endpoint."""
+        self.requests = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.throttled = 0
+        self.no_data = 0
+        self.http_errors = 0
+        self.bytes_received = 0
+        self.latency = LatencyHistogram()
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "cacheHits": self.cache_hits,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "noData": self.no_data,
+            "httpErrors": self.http_errors,
+            "bytesReceived": self.bytes_received,
+            "latencyMs": self.latency.summary(),
+        }
+
+
+class FetchTelemetry:
+    def __init__(self):
+        """Thread-safe statistics of the fetch layer:
+        per-endpoint latency histograms, retries, throttling, errors,
+        bytes received, and the throughput in symbols per minute.
+        """
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.symbols = 0
+        self.started = monotonic()
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str) -> EndpointStats:
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    def record_response(self, endpoint: str, latency: float, num_bytes: int):
+        """Records a response that was not throttled.
+
+        :param endpoint: The endpoint name.
+        :param latency: The request latency, seconds.
+        :param num_bytes: The size of the response body.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            stats.bytes_received += num_bytes
+            stats.latency.add(latency)
+
+    def record_throttled(self, endpoint: str, retried: bool):
+        """Records a throttled (429) response.
+
+        :param endpoint: The endpoint name.
+        :param retried: Whether the request will be retried.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            stats.throttled += 1
+            if retried:
+                stats.retries += 1
+
+    def record_retries(self, endpoint: str, num_retries: int):
+        """Records retries done by the HTTP adapter before a response,
+        e.g. after connection or read errors.
+
+        :param endpoint: The endpoint name.
+        :param num_retries: The number of retries.
+        """
+        with self._lock:
+            self._endpoint(endpoint).retries += num_retries
+
+    def record_bytes(self, endpoint: str, num_bytes: int):
+        """Records bytes of a streamed response body as it is read.
+
+        :param endpoint: The endpoint name.
+        :param num_bytes: The size of the chunk.
+        """
+        with self._lock:
+            self._endpoint(endpoint).bytes_received += num_bytes
+
+    def record_cache_hit(self, endpoint: str):
+        with self._lock:
+            self._endpoint(endpoint).cache_hits += 1
+
+    def record_no_data(self, endpoint: str):
+        with self._lock:
+            self._endpoint(endpoint).no_data += 1
+
+    def record_http_error(self, endpoint: str):
+        with self._lock:
+            self._endpoint(endpoint).http_errors += 1
+
+    def record_symbol(self):
+        """Records a symbol processed by the fetch stage."""
+        with self._lock:
+            self.symbols += 1
+
+    def summary(self) -> dict:
+        """Aggregates the statistics so far, to be saved in a task document.
+
+        :return: The aggregated statistics.
+        """
+        with self._lock:
+            elapsed = monotonic() - self.started
+            return {
+                "elapsedSec": round(elapsed, 3),
+                "symbols": self.symbols,
+                "symbolsPerMinute": (
+                    round(self.symbols / elapsed * 60, 3) if elapsed else None
+                ),
+                "endpoints": {k: v.summary() for k, v in self.endpoints.items()},
+            }
@@ -1,23 +1,39 @@
+from __future__ import annotations
+
 import os
+import codecs
+import threading
 from datetime import date
 from logging import getLogger
-from concurrent.futures import ThreadPoolExecutor
-from time import sleep
+from typing import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
 
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne
 import requests
 from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import HTTPError
 import dotenv
 
 from analyst.task_base import AnalystTaskBase
-from analyst.helpers import date_window, mongo_uri
+from analyst.helpers import date_window, merge_by_date, mongo_uri, iter_json_array
+from analyst.rate_limit import AdaptiveRateController
+from analyst.cache import ResponseCache, CacheMissError
+from analyst.bulk_writer import BulkWriter
+from analyst.telemetry import FetchTelemetry
+from analyst.layout import LAYOUTS, to_layout, to_records
+from analyst.symbols import id_array
+from analyst.algo.filter import yoy_growth_prefilter
 
 dotenv.load_dotenv()
 
 API_KEY = os.getenv("API_KEY")
 BASE_URL = "https://financialmodelingprep.com/api/v3/"
+# The starting rate of the adaptive rate controller.
+# It will grow until the API starts throttling.
 REQUEST_PER_MINUTE = 300
+# Endpoints are aggregated by these names in the telemetry.
+ENDPOINT_NAMES = ("income-statement", "historical-price-full", "stock/list")
 
 logger = getLogger("analyst")
 
@@ -25,107 +41,576 @@ logger = getLogger("analyst")
 class GetStockDataTask(AnalystTaskBase):
     TASK_TYPE = "get_stock_data"
     REQUESTS_PER_SYMBOL = 2
-    RATE_LIMIT_BUFFER = 10
-    DELAY_PER_SYMBOL = 0.2
-    DELAY_PER_BATCH = 60
-
-    def __init__(self, description: str, db_client: MongoClient):
+    NUM_QUARTERS = 8
+    PRICE_WINDOW_DAYS = 365
+    DAYS_PER_QUARTER = 91
+    MAX_IN_FLIGHT = 10
+    PROGRESS_LOG_INTERVAL = 100
+    TELEMETRY_INTERVAL = 30
+    CHECKPOINT_BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        description: str,
+        db_client: MongoClient,
+        fmp_client: FmpClient | None = None,
+        incremental: bool = False,
+        prefilter: Callable[[list[dict]], bool] | None = None,
+        layout: str = "rows",
+    ):
         """A task gets all available stock data from the web API.
 
         :param description: A description of the task.
         :param db_client: A MongoClient instance.
+        :param fmp_client: An FmpClient instance shared by all the requests.
+            A new client is created if omitted.
+        :param incremental: Refreshes the stock data already stored
+            instead of fetching everything from scratch.
+        :param prefilter: A fundamental pre-filter for the staged fetch mode.
+            If given, financial statements are fetched for all the symbols first,
+            and prices are fetched only for the symbols whose quarterly
+            financial statements pass the pre-filter.
+        :param layout: How the prices and financial statements are stored.
+            One of LAYOUTS: rows, columns or packed. Defaults to rows.
         """
+        if incremental and prefilter is not None:
+            raise ValueError("The staged fetch mode does not support incremental.")
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout: {layout}")
         super().__init__(description, db_client)
         self.symbols = []
+        self.fmp_client = fmp_client or FmpClient()
+        self.incremental = incremental
+        self.prefilter = prefilter
+        self.layout = layout
+        self.stock_data_writer: BulkWriter | None = None
+        self._checkpoint_lock = threading.Lock()
+        self._pending_writes = {}
+        self._failed_symbols = []
+        self._rejected_symbols = []
+        self._prefetched_financials = {}
+        self._prefilter_passed = []
+        self._prefilter_saved = monotonic()
+        self._telemetry_saved = monotonic()
 
     @property
     def task_type(self):
         return GetStockDataTask.TASK_TYPE
 
-    def get_single_stock_data_and_save(self, symbol: dict):
+    def get_single_stock_data_and_save(
+        self, symbol: dict, financials_quarter: list[dict] | None = None
+    ):
         """Get a single stock data and save it to the database.
         Quarterly financial statements and daily OHLC(+V) prices.
+        In the incremental mode, the stored data of the symbol is
+        refreshed instead if any.
 
         :param symbol: A ticker symbol information.
+        :param financials_quarter: Quarterly financial statements already fetched.
+            They are fetched if omitted.
+        :return: Whether the data was saved.
         """
-        num_quarters = 4
+        if self.incremental:
+            stored = self.stock_data_collection.find_one(
+                {"symbol.symbol": symbol["symbol"]}
+            )
+            if stored is not None:
+                return self.refresh_single_stock_data_and_save(symbol, stored)
+
         symbol_name = symbol["symbol"]
-        financials_quarter = get_financial_statements(
-            symbol_name, limit=num_quarters * 2, period="quarter"
-        )
         if financials_quarter is None:
-            return
-        from_, to = date_window(date.today().isoformat(), 365)
-        prices = get_daily_prices(symbol_name, from_, to)
+            financials_quarter = self.fmp_client.get_financial_statements(
+                symbol_name, limit=GetStockDataTask.NUM_QUARTERS, period="quarter"
+            )
+        if financials_quarter is None:
+            return False
+        from_, to = date_window(
+            date.today().isoformat(), GetStockDataTask.PRICE_WINDOW_DAYS
+        )
+        prices = self.fmp_client.get_daily_prices(symbol_name, from_, to)
         if prices is None:
-            return
+            return False
+        data = {
+            "financial_statements": {
+                "quarter": to_layout(financials_quarter, self.layout)
+            },
+            "prices": {
+                **prices,
+                "historical": to_layout(prices["historical"], self.layout),
+            },
+        }
+        # An upsert, so that a symbol stored but not checkpointed
+        # before an interruption is overwritten on resume, not duplicated.
+        self.save(
+            symbol_name,
+            ReplaceOne(
+                {"taskId": self.task_id, "symbol.symbol": symbol_name},
+                {
+                    "taskId": self.task_id,
+                    "symbol": symbol,
+                    "symbolId": self.symbol_dictionary.id(symbol_name),
+                    "data": data,
+                },
+                upsert=True,
+            ),
+        )
+        return True
+
+    def save(self, symbol_name: str, operation: InsertOne | ReplaceOne):
+        """Writes stock data with the bulk writer while the task is running,
+        or immediately otherwise.
+
+        :param symbol_name: The ticker symbol of the stock data.
+        :param operation: A write operation on the stock data collection.
+        """
+        if self.stock_data_writer is None:
+            self.stock_data_collection.bulk_write([operation])
+        else:
+            with self._checkpoint_lock:
+                self._pending_writes[id(operation)] = symbol_name
+            self.stock_data_writer.add(operation)
+
+    def refresh_single_stock_data_and_save(self, symbol: dict, stored: dict):
+        """Fetches only the data newer than the stored stock data
+        and merges it into the stored document.
+        Prices are fetched from the last stored date onward.
+        Financial statements are fetched only when a new fiscal quarter
+        could have been reported since the latest stored one.
+
+        :param symbol: A ticker symbol information.
+        :param stored: The stored stock data document of the symbol.
+        :return: Whether the data was saved.
+        """
+        symbol_name = symbol["symbol"]
+        today = date.today()
+        data = stored["data"]
+
+        financials_quarter = to_records(data["financial_statements"]["quarter"])
+        latest_quarter = max(r["date"] for r in financials_quarter)
+        days_since = (today - date.fromisoformat(latest_quarter)).days
+        missed_quarters = days_since // GetStockDataTask.DAYS_PER_QUARTER
+        if missed_quarters > 0:
+            new_financials = self.fmp_client.get_financial_statements(
+                symbol_name,
+                limit=min(missed_quarters + 1, GetStockDataTask.NUM_QUARTERS),
+                period="quarter",
+            )
+            if new_financials is not None:
+                financials_quarter = merge_by_date(
+                    financials_quarter,
+                    new_financials,
+                    limit=GetStockDataTask.NUM_QUARTERS,
+                )
+
+        prices = data["prices"]
+        from_, to = date_window(today.isoformat(), GetStockDataTask.PRICE_WINDOW_DAYS)
+        historical = to_records(prices["historical"])
+        last_price_date = max((r["date"] for r in historical), default=from_)
+        new_prices = None
+        if last_price_date < to:
+            # The last bar is fetched again in case it was stored intraday.
+            new_prices = self.fmp_client.get_daily_prices(
+                symbol_name, max(last_price_date, from_), to
+            )
+        new_historical = new_prices["historical"] if new_prices else []
+        historical = merge_by_date(historical, new_historical, since=from_)
+        prices = {**prices, "historical": to_layout(historical, self.layout)}
+
         data = {
-            "financial_statements": {"quarter": financials_quarter},
+            **data,
+            "financial_statements": {
+                **data["financial_statements"],
+                "quarter": to_layout(financials_quarter, self.layout),
+            },
             "prices": prices,
         }
-        self.stock_data_collection.insert_one(
-            {"taskId": self.task_id, "symbol": symbol, "data": data}
+        self.save(
+            symbol_name,
+            ReplaceOne(
+                {"_id": stored["_id"]},
+                {
+                    "taskId": self.task_id,
+                    "symbol": symbol,
+                    "symbolId": self.symbol_dictionary.id(symbol_name),
+                    "data": data,
+                },
+            ),
+        )
+        return True
+
+    def remove_stale_stock_data(self):
+        """Removes stock data of the symbols not in the symbols list of this task,
+        e.g. symbols delisted or below the minimum price threshold.
+        The stored data of a listed symbol whose refresh failed is kept.
+        """
+        doc = self.task_collection.find_one(
+            {"_id": self.document_id}, {"checkpoint.symbols.symbol": 1}
         )
+        symbol_names = [s["symbol"] for s in doc["checkpoint"]["symbols"]]
+        result = self.stock_data_collection.delete_many(
+            {"taskId": {"$ne": self.task_id}, "symbol.symbol": {"$nin": symbol_names}}
+        )
+        logger.info(f"Removed {result.deleted_count} stale stock data.")
+
+    def fetch_and_checkpoint(self, symbol: dict):
+        """Gets and saves a single stock data,
+        recording the symbol as failed if no data was saved.
+        Succeeded symbols are recorded once their data is written.
+
+        :param symbol: A ticker symbol information.
+        """
+        financials_quarter = self._prefetched_financials.pop(symbol["symbol"], None)
+        saved = False
+        try:
+            saved = self.get_single_stock_data_and_save(symbol, financials_quarter)
+        finally:
+            self.fmp_client.telemetry.record_symbol()
+            if not saved:
+                with self._checkpoint_lock:
+                    self._failed_symbols.append(symbol["symbol"])
+
+    def fetch_financials_and_prefilter(self, symbol: dict) -> bool:
+        """The first stage of the staged fetch mode.
+        Gets the quarterly financial statements of a single stock
+        and keeps them for the second stage if they pass the pre-filter.
+
+        :param symbol: A ticker symbol information.
+        :return: Whether the symbol passed the pre-filter.
+        """
+        symbol_name = symbol["symbol"]
+        financials_quarter = self.fmp_client.get_financial_statements(
+            symbol_name, limit=GetStockDataTask.NUM_QUARTERS, period="quarter"
+        )
+        if financials_quarter is None:
+            with self._checkpoint_lock:
+                self._failed_symbols.append(symbol_name)
+            self.checkpoint_prefilter()
+            return False
+        try:
+            passed = self.prefilter(financials_quarter)
+        except Exception as err:
+            logger.error(f"Exception while applying the pre-filter to {symbol_name}")
+            logger.exception(err)
+            passed = False
+        with self._checkpoint_lock:
+            if passed:
+                self._prefetched_financials[symbol_name] = financials_quarter
+                self._prefilter_passed.append(symbol)
+            else:
+                self._rejected_symbols.append(symbol_name)
+        self.checkpoint_prefilter()
+        return passed
+
+    def checkpoint_prefilter(self):
+        """Records the rejected and failed symbols of the first stage
+        once CHECKPOINT_BATCH_SIZE of them are pending or
+        BulkWriter.FLUSH_INTERVAL seconds have passed,
+        so that a resume does not fetch them again.
+        """
+        with self._checkpoint_lock:
+            num_pending = len(self._failed_symbols) + len(self._rejected_symbols)
+            due = (
+                num_pending >= GetStockDataTask.CHECKPOINT_BATCH_SIZE
+                or monotonic() - self._prefilter_saved >= BulkWriter.FLUSH_INTERVAL
+            )
+            if due:
+                self._prefilter_saved = monotonic()
+        if due:
+            self.save_checkpoint([], [])
+
+    def init_checkpoint(self):
+        """Saves the task options and an empty checkpoint to the task document.
+        The symbols are appended by checkpoint_symbols as they arrive.
+        """
+        self.task_collection.update_one(
+            {"_id": self.document_id},
+            {
+                "$set": {
+                    "incremental": self.incremental,
+                    "layout": self.layout,
+                    "prefilter": self.prefilter_args(),
+                    "checkpoint": {
+                        "symbols": [],
+                        "symbolsComplete": False,
+                        "succeeded": [],
+                        "failed": [],
+                        "rejected": [],
+                    },
+                }
+            },
+        )
+
+    def prefilter_args(self) -> list | None:
+        """The arguments of yoy_growth_prefilter the pre-filter was made with.
+
+        :return: The arguments. Empty if the pre-filter was not made by it,
+            or None if there is no pre-filter.
+        """
+        if self.prefilter is None:
+            return None
+        return list(getattr(self.prefilter, "args", []))
+
+    def restore_options(self, doc: dict):
+        """Restores the task options saved in the task document,
+        so that a resumed task fetches and stores the data in the same way.
+        Options missing in the document are left as given to the constructor.
+
+        :param doc: The task document.
+        """
+        self.incremental = doc["incremental"]
+        self.layout = doc.get("layout", self.layout)
+        if "prefilter" in doc:
+            args = doc["prefilter"]
+            if args is None:
+                self.prefilter = None
+            elif args:
+                self.prefilter = yoy_growth_prefilter(*args)
+            elif self.prefilter is None:
+                raise ValueError(f"The pre-filter cannot be restored: {self.task_id}")
+        if self.incremental and self.prefilter is not None:
+            raise ValueError("The staged fetch mode does not support incremental.")
+
+    def checkpoint_symbols(self, symbols: Iterable[dict]) -> Iterator[dict]:
+        """Passes symbols through to the fetch stage in batches as they arrive.
+        Each batch is appended to the checkpoint and its symbols get their ids
+        before it is passed, so the fetch workers do not assign them one by one.
+        The checkpoint is marked complete once the symbols are read to the end.
+
+        :param symbols: Ticker symbols information.
+        :return: An iterator over the same symbols.
+        """
+        batch = []
+
+        def push(update: dict | None = None):
+            self.symbol_dictionary.ids(s["symbol"] for s in batch)
+            self.task_collection.update_one(
+                {"_id": self.document_id},
+                {"$push": {"checkpoint.symbols": {"$each": batch}}, **(update or {})},
+            )
+
+        for s in symbols:
+            self.symbols.append(s)
+            batch.append(s)
+            if len(batch) >= GetStockDataTask.CHECKPOINT_BATCH_SIZE:
+                push()
+                yield from batch
+                batch = []
+        push({"$set": {"checkpoint.symbolsComplete": True}})
+        yield from batch
+        logger.info(f"{len(self.symbols)} symbols.")
+
+    def save_checkpoint(
+        self,
+        written: list[InsertOne | ReplaceOne],
+        failed: list[InsertOne | ReplaceOne],
+    ):
+        """Records the progress of the task in the task document.
+        It is called by the bulk writer on every flush.
+
+        :param written: The write operations that succeeded.
+        :param failed: The write operations that failed.
+        """
+        with self._checkpoint_lock:
+            succeeded_names = [self._pending_writes.pop(id(op)) for op in written]
+            failed_names = [self._pending_writes.pop(id(op)) for op in failed]
+            failed_names += self._failed_symbols
+            self._failed_symbols = []
+            rejected_names = self._rejected_symbols
+            self._rejected_symbols = []
+        add_to_set = {}
+        if succeeded_names:
+            add_to_set["checkpoint.succeeded"] = {"$each": succeeded_names}
+        if failed_names:
+            add_to_set["checkpoint.failed"] = {"$each": failed_names}
+        if rejected_names:
+            add_to_set["checkpoint.rejected"] = {"$each": rejected_names}
+        if add_to_set:
+            self.task_collection.update_one(
+                {"_id": self.document_id}, {"$addToSet": add_to_set}
+            )
+        if monotonic() - self._telemetry_saved >= GetStockDataTask.TELEMETRY_INTERVAL:
+            self.save_telemetry(self.stock_data_writer)
+
+    def save_telemetry(self, writer: BulkWriter | None = None):
+        """Saves the statistics of the fetch layer to the task document.
+
+        :param writer: The bulk writer of the stock data, if any.
+        """
+        telemetry = self.fmp_client.telemetry.summary()
+        rate = self.fmp_client.rate_controller.rate_per_minute
+        telemetry["ratePerMinute"] = round(rate, 3)
+        if writer is not None:
+            telemetry["writes"] = writer.summary()
+        self.task_collection.update_one(
+            {"_id": self.document_id}, {"$set": {"telemetry": telemetry}}
+        )
+        self._telemetry_saved = monotonic()
+
+    def pending_symbols(self, doc: dict) -> list[dict]:
+        """Symbols not succeeded yet according to the checkpoint.
+        Symbols rejected by the pre-filter are not fetched again.
+
+        :param doc: The task document.
+        :return: Ticker symbols information, pending or failed.
+        """
+        checkpoint = doc["checkpoint"]
+        done = set(checkpoint["succeeded"]) | set(checkpoint.get("rejected", []))
+        return [s for s in checkpoint["symbols"] if s["symbol"] not in done]
 
     def save_to_screener_collection(self):
+        """Saves the symbols of the stock data of this task as a screener result.
+        The symbol ids are saved only when every document has one, since
+        a screener matches its source by the ids when they are present.
+        """
         filter_ = {"taskId": self.task_id}
-        project = {"symbol": 1}
+        project = {"symbol": 1, "symbolId": 1}
         cursor = self.stock_data_collection.find(filter_, project)
         symbol_names = []
+        symbol_ids = []
         for s in cursor:
             symbol_names.append(s["symbol"]["symbol"])
-        self.screener_collection.insert_one(
-            {
-                "taskId": self.task_id,
-                "tickerSymbols": symbol_names,
-            }
+            symbol_ids.append(s.get("symbolId"))
+        result = {"taskId": self.task_id, "tickerSymbols": symbol_names}
+        if None in symbol_ids:
+            logger.warning(f"Stock data without symbol ids: {self.task_id}")
+        else:
+            result["symbolIds"] = id_array(symbol_ids).tolist()
+        self.screener_collection.insert_one(result)
+
+    def backfill_symbol_ids(self):
+        """Sets the symbol ids of the stock data of this task saved without them,
+        e.g. by a version before the symbol dictionary.
+        """
+        filter_ = {"taskId": self.task_id, "symbolId": {"$exists": False}}
+        docs = list(self.stock_data_collection.find(filter_, {"symbol.symbol": 1}))
+        if not docs:
+            return
+        symbol_ids = self.symbol_dictionary.ids(d["symbol"]["symbol"] for d in docs)
+        self.stock_data_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": d["_id"]},
+                    {"$set": {"symbolId": symbol_ids[d["symbol"]["symbol"]]}},
+                )
+                for d in docs
+            ]
         )
-
-    def run(self, min_price: float):  # noqa
+        logger.info(f"Symbol ids set on {len(docs)} documents.")
+
+    def fetch_threaded(
+        self, fn: Callable[[dict], None], symbols: Iterable[dict], max_in_flight: int
+    ):
+        """Applies a fetch function to the symbols with a thread pool.
+        The requests are paced by the rate controller of the FmpClient.
+        Symbols are submitted as soon as the iterable yields them.
+
+        :param fn: A function that gets the data of a single symbol.
+        :param symbols: Ticker symbols information.
+        :param max_in_flight: The maximum number of symbols fetched at once.
+        """
+        with ThreadPoolExecutor(max_workers=max_in_flight) as e:
+            futures = [e.submit(fn, s) for s in symbols]
+            for i, f in enumerate(as_completed(futures), start=1):
+                error = f.exception()
+                if error:
+                    logger.error(error)
+                if i % GetStockDataTask.PROGRESS_LOG_INTERVAL == 0:
+                    logger.info(f"{i} / {len(futures)} symbols.")
+
+    def run(
+        self,
+        min_price: float,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
         """Get US stock ticker symbols and data
         And save it to the database.
         Also saves the list of the ticker symbols
         as a screener result (without filtering)
         so following ScreenerTask can refer to it.
+        The progress is checkpointed in the task document
+        so that the task can be resumed if interrupted.
 
         :param min_price: The minimum price threshold.
+        :param max_in_flight: The maximum number of symbols fetched at once.
         """
         logger.info("A GetStockDataTask started.")
         self.mark_start()
 
         logger.info("Getting a list of stock ticker symbols.")
-        symbols = get_ticker_symbols(min_price)
-        logger.info(f"{len(symbols)} symbols.")
+        self.init_checkpoint()
+        symbols = self.checkpoint_symbols(
+            self.fmp_client.iter_ticker_symbols(min_price)
+        )
 
-        requests_per_symbol = GetStockDataTask.REQUESTS_PER_SYMBOL
-        buffer = GetStockDataTask.RATE_LIMIT_BUFFER
-        batch_size = (REQUEST_PER_MINUTE - buffer) // requests_per_symbol
-        logger.info("Getting stock data.")
-        batch_count = 0
-        while True:
-            batch_count += 1
-            symbol_count_from = (batch_count - 1) * batch_size + 1
-            symbol_count_to = batch_count * batch_size
-            logger.info(
-                f"Batch #{batch_count}: {symbol_count_from} - {symbol_count_to}"
+        self.fetch_and_finish(symbols, max_in_flight)
+
+    def resume(
+        self,
+        task_id: str,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        """Resumes an interrupted task from its checkpoint.
+        Only the symbols not succeeded yet are fetched,
+        with the options the task was started with.
+
+        :param task_id: The task id to resume.
+        :param max_in_flight: The maximum number of symbols fetched at once.
+        """
+        logger.info(f"Resuming a GetStockDataTask: {task_id}")
+        doc = self.restore(task_id)
+        if doc["complete"]:
+            raise ValueError(f"Task already complete: {task_id}")
+        if not doc["checkpoint"].get("symbolsComplete"):
+            raise ValueError(f"The symbols list was not read to the end: {task_id}")
+        self.restore_options(doc)
+        symbols = self.pending_symbols(doc)
+        logger.info(f"{len(symbols)} symbols pending.")
+        self.symbol_dictionary.ids(s["symbol"] for s in symbols)
+        self.task_collection.update_one(
+            {"_id": self.document_id}, {"$set": {"checkpoint.failed": []}}
+        )
+        self.backfill_symbol_ids()
+
+        self.fetch_and_finish(symbols, max_in_flight)
+
+    def fetch_and_finish(self, symbols: Iterable[dict], max_in_flight: int):
+        """Gets and saves stock data of the symbols, then completes the task.
+
+        :param symbols: Ticker symbols information.
+        :param max_in_flight: The maximum number of symbols fetched at once.
+        """
+        self.symbol_dictionary.load()
+        self.stock_data_collection.create_index([("taskId", 1), ("symbolId", 1)])
+        self.stock_data_collection.create_index([("taskId", 1), ("symbol.symbol", 1)])
+        if self.incremental:
+            # The stored data of each symbol is looked up by its name alone.
+            self.stock_data_collection.create_index("symbol.symbol")
+
+        if self.prefilter is not None:
+            logger.info("Getting financial statements.")
+            self.fetch_threaded(
+                self.fetch_financials_and_prefilter, symbols, max_in_flight
             )
-            with ThreadPoolExecutor() as e:
-                futures = []
-                for _ in range(batch_size):
-                    try:
-                        s = symbols.pop()
-                        futures.append(e.submit(self.get_single_stock_data_and_save, s))
-                        # It seems the FMP API has an undocumented burst limit.
-                        # Added slight delay to avoid the 429 error
-                        sleep(GetStockDataTask.DELAY_PER_SYMBOL)
-                    except IndexError:
-                        # synbols is empty.
-                        break
-                e.shutdown(wait=True)
-            if len(symbols):
-                sleep(GetStockDataTask.DELAY_PER_BATCH)
-            else:
-                break
+            self.save_checkpoint([], [])
+            symbols = self._prefilter_passed
+            logger.info(f"{len(symbols)} symbols passed the pre-filter.")
+
+        logger.info("Getting stock data.")
+        with BulkWriter(
+            self.stock_data_collection, on_flush=self.save_checkpoint
+        ) as writer:
+            self.stock_data_writer = writer
+            try:
+                self.fetch_threaded(self.fetch_and_checkpoint, symbols, max_in_flight)
+            finally:
+                self.stock_data_writer = None
+        self.save_checkpoint([], [])
+        self.save_telemetry(writer)
+        if writer.failed:
+            logger.error(f"Failed to save {len(writer.failed)} stock data.")
+
+        if self.incremental:
+            self.remove_stale_stock_data()
 
         logger.info("Saving symbol names that returned valid data.")
         self.save_to_screener_collection()
@@ -134,111 +619,296 @@ class GetStockDataTask(AnalystTaskBase):
         self.mark_complete()
 
 
-def get(url: str, params: dict = {}):  # noqa
-    """Get data from the Financial Modeling Prep API.
-    https://site.financialmodelingprep.com/developer/docs/
+class FmpClient:
+    RETRY_TOTAL = 3
+    RETRY_BACKOFF_FACTOR = 1
+    THROTTLE_RETRY_TOTAL = 5
+    POOL_MAXSIZE = 32
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(
+        self,
+        api_key: str | None = API_KEY,
+        base_url: str = BASE_URL,
+        pool_maxsize: int = POOL_MAXSIZE,
+        rate_controller: AdaptiveRateController | None = None,
+        cache: ResponseCache | None = None,
+        telemetry: FetchTelemetry | None = None,
+    ):
+        """A client for the Financial Modeling Prep API.
+        https://site.financialmodelingprep.com/developer/docs/
+        It keeps a single keep-alive session so that requests reuse
+        pooled connections instead of paying a new TCP/TLS handshake each time.
+        The underlying urllib3 connection pool is thread-safe,
+        so one client can be shared by all the worker threads.
+        Requests are paced by an adaptive rate controller
+        which backs off on 429 responses, so the client runs
+        at the real ceiling of the subscription plan.
+
+        :param api_key: The FMP API key.
+        :param base_url: The API base URL.
+        :param pool_maxsize: The maximum number of pooled connections.
+        :param rate_controller: A rate controller shared by all the requests.
+            A new controller starting at REQUEST_PER_MINUTE is created if omitted.
+        :param cache: A response cache. Responses are not cached if omitted.
+        :param telemetry: Statistics of the requests.
+            A new one is created if omitted.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        self.telemetry = telemetry or FetchTelemetry()
+        self.rate_controller = rate_controller or AdaptiveRateController(
+            REQUEST_PER_MINUTE
+        )
+        # 429 is not retried here: the rate controller needs to see it.
+        # urllib3 would retry it on its own if it has a Retry-After header.
+        retries = Retry(
+            total=FmpClient.RETRY_TOTAL,
+            backoff_factor=FmpClient.RETRY_BACKOFF_FACTOR,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retries,
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    :param url: The API endpoint URL.
-    :param params: Query parameters as a dict.
-    :return: The response data as a Dataframe.
-    """
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429])
-    with requests.session() as session:
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+    def close(self):
+        """Closes the session and its pooled connections."""
+        self.session.close()
+
+    def get(self, endpoint: str, params: dict = {}):  # noqa
+        """Get data from the Financial Modeling Prep API.
+
+        :param endpoint: The API endpoint path relative to the base URL.
+        :param params: Query parameters as a dict.
+        :return: The response data.
+        """
+        data = self._get(endpoint, params)
+        if not data:
+            # The FMP API returns [] with status code 200 if no data.
+            self.telemetry.record_no_data(endpoint_name(endpoint))
+            raise NoDataError(f"No data returned: {self.base_url}{endpoint}")
+        return data
+
+    def _get(self, endpoint: str, params: dict = {}):  # noqa
+        url = f"{self.base_url}{endpoint}"
+        name = endpoint_name(endpoint)
+        hit = False
+        if self.cache is not None:
+            try:
+                hit, data = self.cache.get(endpoint, params)
+            except CacheMissError as err:
+                self.telemetry.record_no_data(name)
+                raise NoDataError(f"Not cached: {url}") from err
+        if hit:
+            self.telemetry.record_cache_hit(name)
+        else:
+            try:
+                data = self._request(url, params, name)
+            except HTTPError:
+                self.telemetry.record_http_error(name)
+                raise
+            if self.cache is not None:
+                self.cache.put(endpoint, params, data)
+        return data
+
+    def _request(self, url: str, params: dict, name: str):
+        return self._send(url, params, name).json()
+
+    def _send(self, url: str, params: dict, name: str, stream: bool = False):
         params = {
-            "apikey": API_KEY,
+            "apikey": self.api_key,
             **params,
         }
-        response = session.get(url, params=params)
-    response.raise_for_status()
-    data = response.json()
-    if not data:
-        # The FMP API returns [] with status code 200 if no data.
-        raise NoDataError(f"No data returned: {url}")
-    return data
-
-
-def get_financial_statements(symbol: str, limit: int = 10, period: str = "quarter"):
-    """https://site.financialmodelingprep.com/developer/docs/#Company-Financial-Statements
-
-    :param symbol: The ticker symbol.
-    :param limit: The number of records to request. Defaults to 10.
-    :param period: quarter or annual. Defaults to quarter.
-    :return: The financial statements as a DataFrame.
+        attempts = FmpClient.THROTTLE_RETRY_TOTAL + 1
+        for attempt in range(attempts):
+            self.rate_controller.acquire()
+            started = monotonic()
+            response = self.session.get(url, params=params, stream=stream)
+            latency = monotonic() - started
+            num_retries = adapter_retries(response)
+            if num_retries:
+                self.telemetry.record_retries(name, num_retries)
+            if response.status_code != 429:
+                self.rate_controller.on_success(latency)
+                # A streamed body is counted while it is read.
+                num_bytes = 0 if stream else len(response.content)
+                self.telemetry.record_response(name, latency, num_bytes)
+                break
+            logger.debug(f"Throttled: {url}")
+            self.telemetry.record_throttled(name, retried=attempt + 1 < attempts)
+            self.rate_controller.on_throttle(retry_after(response))
+        response.raise_for_status()
+        return response
+
+    def get_financial_statements(
+        self, symbol: str, limit: int = 10, period: str = "quarter"
+    ):
+        """https://site.financialmodelingprep.com/developer/docs/#Company-Financial-Statements
+
+        :param symbol: The ticker symbol.
+        :param limit: The number of records to request. Defaults to 10.
+        :param period: quarter or annual. Defaults to quarter.
+        :return: The financial statements.
+        """
+        endpoint = f"income-statement/{symbol}"
+        params = {
+            "limit": limit,
+            "period": period,
+        }
+        try:
+            return self.get(endpoint, params)
+        except HTTPError as err:
+            logger.error(f"Error while getting income statements: {symbol}")
+            logger.exception(err)
+            return None
+        except NoDataError:
+            logger.debug(f"No income statement data: {symbol}")
+            return None
+
+    def get_daily_prices(self, symbol: str, from_: str = "", to: str = ""):
+        """https://site.financialmodelingprep.com/developer/docs/#Stock-Historical-Price
+
+        :param symbol:  The ticker symbol.
+        :param from_: An ISO formatted date (YYYY-MM-DD) where the data starts from.
+        :param to: An ISO formatted date (YYYY-MM-DD) where the data ends.
+        :return: Historical daily stock prices.
+        """
+        endpoint = f"historical-price-full/{symbol}"
+        params = {}
+        if from_:
+            params["from"] = from_
+        if to:
+            params["to"] = to
+        try:
+            return self.get(endpoint, params)
+        except HTTPError as err:
+            logger.error(f"Error while getting historical daily stock prices: {symbol}")
+            logger.exception(err)
+            return None
+        except NoDataError:
+            logger.debug(f"No historical daily stock data: {symbol}")
+            return None
+
+    def get_ticker_symbols(self, min_price: float) -> list[dict]:
+        """https://site.financialmodelingprep.com/developer/docs/#Symbols-List
+
+        :param min_price: The minimum price threshold.
+
+        :return: Get US stock ticker symbols.
+        """
+        return list(self.iter_ticker_symbols(min_price))
+
+    def iter_ticker_symbols(self, min_price: float) -> Iterator[dict]:
+        """Streams the symbols list and yields US stock ticker symbols
+        as soon as they are parsed, without loading the whole list in memory.
+        The cached list is filtered instead if the client has a cache.
+
+        :param min_price: The minimum price threshold.
+
+        :return: An iterator over US stock ticker symbols.
+            It is empty if the API returns no symbols.
+        """
+        endpoint = "stock/list"
+        if self.cache is not None:
+            symbols = self._get(endpoint)
+        else:
+            symbols = self._stream_json_array(endpoint)
+        for s in symbols:
+            if is_us_stock(s, min_price):
+                yield s
+
+    def _stream_json_array(self, endpoint: str, params: dict = {}):  # noqa
+        url = f"{self.base_url}{endpoint}"
+        name = endpoint_name(endpoint)
+        try:
+            response = self._send(url, params, name, stream=True)
+        except HTTPError:
+            self.telemetry.record_http_error(name)
+            raise
+        decoder = codecs.getincrementaldecoder("utf-8")()
+
+        def chunks():
+            for chunk in response.iter_content(FmpClient.STREAM_CHUNK_SIZE):
+                self.telemetry.record_bytes(name, len(chunk))
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+
+        try:
+            yield from iter_json_array(chunks())
+        finally:
+            response.close()
+
+
+def is_us_stock(symbol: dict, min_price: float) -> bool:
+    """Checks if a symbol is a US stock whose price is more than
+    or equal to the minimum price.
+
+    :param symbol: A ticker symbol information from the symbols list.
+    :param min_price: The minimum price threshold.
+    :return: Whether it is a US stock to fetch.
     """
-    url = f"{BASE_URL}income-statement/{symbol}"
-    params = {
-        "limit": limit,
-        "period": period,
-    }
-    try:
-        return get(url, params)
-    except HTTPError as err:
-        logger.error(f"Error while getting income statements: {symbol}")
-        logger.exception(err)
-        return None
-    except NoDataError:
-        logger.debug(f"No income statement data: {symbol}")
-        return None
+    if not symbol["type"] == "stock":
+        return False
+    if symbol["price"] is None:
+        return False
+    if symbol["price"] < min_price:
+        return False
+    exchange_name = symbol["exchange"].lower()
+    is_us_stock_ = (
+        exchange_name.startswith("american stock exchange")
+        or exchange_name.startswith("nasdaq")
+        or exchange_name.startswith("new york stock exchange")
+    )
+    return is_us_stock_
+
+
+def endpoint_name(endpoint: str) -> str:
+    """The name of an endpoint without the ticker symbol in its path.
+
+    :param endpoint: The API endpoint path.
+    :return: The endpoint name.
+    """
+    for name in ENDPOINT_NAMES:
+        if endpoint.startswith(name):
+            return name
+    return endpoint
 
 
-def get_daily_prices(symbol: str, from_: str = "", to: str = ""):
-    """https://site.financialmodelingprep.com/developer/docs/#Stock-Historical-Price
+def retry_after(response: requests.Response) -> float | None:
+    """Parses the Retry-After header of a response.
 
-    :param symbol:  The ticker symbol.
-    :param from_: An ISO formatted date (YYYY-MM-DD) where the data starts from.
-    :param to: An ISO formatted date (YYYY-MM-DD) where the data ends.
-    :return: Historical daily stock prices in a Dataframe.
+    :param response: A response.
+    :return: Seconds to wait, or None if the header is missing or is not in seconds.
     """
-    url = f"{BASE_URL}historical-price-full/{symbol}"
-    params = {}
-    if from_:
-        params["from"] = from_
-    if to:
-        params["to"] = to
+    value = response.headers.get("Retry-After")
     try:
-        return get(url, params)
-    except HTTPError as err:
-        logger.error(f"Error while getting historical daily stock prices: {symbol}")
-        logger.exception(err)
-        return None
-    except NoDataError:
-        logger.debug(f"No historical daily stock data: {symbol}")
+        return float(value)
+    except (TypeError, ValueError):
         return None
 
 
-def get_ticker_symbols(min_price: float) -> list[dict]:
-    """https://site.financialmodelingprep.com/developer/docs/#Symbols-List
+def adapter_retries(response: requests.Response) -> int:
+    """Counts the retries urllib3 did before a response, excluding redirects.
 
-    :param min_price: The minimum price threshold.
-
-    :return: Get US stock ticker symbols.
+    :param response: A response.
+    :return: The number of retries.
     """
-    url = f"{BASE_URL}stock/list"
-    params = {
-        "apikey": API_KEY,
-    }
-    response = requests.get(url, params)
-    response.raise_for_status()
-    symbols = response.json()
-
-    def filter_stocks(s: dict):
-        if not s["type"] == "stock":
-            return False
-        if s["price"] is None:
-            return False
-        if s["price"] < min_price:
-            return False
-        exchange_name = s["exchange"].lower()
-        is_us_stock = (
-            exchange_name.startswith("american stock exchange")
-            or exchange_name.startswith("nasdaq")
-            or exchange_name.startswith("new york stock exchange")
-        )
-        return is_us_stock
-
-    us_stocks = filter(filter_stocks, symbols)
-    return list(us_stocks)
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    if retries is None:
+        return 0
+    return sum(1 for h in retries.history if h.redirect_location is None)
 
 
 def run_get_stock_data_task(args):
@@ -246,11 +916,40 @@ def run_get_stock_data_task(args):
 
     :params args: Command line arguments.
     """
-    with MongoClient(mongo_uri()) as mongo_client:
-        task = GetStockDataTask("Get Stock Data", mongo_client)
-        logger.info("Dropping existing stock data.")
-        task.stock_data_collection.drop()
-        task.run(args.minimum_price)
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, replay_only=args.replay)
+    elif args.replay:
+        raise ValueError("--replay requires --cache-dir.")
+    prefilter = None
+    if args.prefilter_yoy_growth is not None:
+        prefilter = yoy_growth_prefilter(args.prefilter_col, args.prefilter_yoy_growth)
+    fmp_client = FmpClient(cache=cache)
+    with MongoClient(mongo_uri()) as mongo_client, fmp_client:
+        task = GetStockDataTask(
+            "Get Stock Data",
+            mongo_client,
+            fmp_client,
+            incremental=args.incremental,
+            prefilter=prefilter,
+            layout=args.layout,
+        )
+        if args.resume:
+            task.resume(
+                args.resume,
+                max_in_flight=args.max_in_flight,
+            )
+            logger.info(f"Complete. Task ID: {task.task_id}")
+            return
+        if args.minimum_price is None:
+            raise ValueError("minimum_price is required unless --resume is given.")
+        if not args.incremental:
+            logger.info("Dropping existing stock data.")
+            task.stock_data_collection.drop()
+        task.run(
+            args.minimum_price,
+            max_in_flight=args.max_in_flight,
+        )
         logger.info(f"Complete. Task ID: {task.task_id}")
 
 
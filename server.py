@@ -1,9 +1,9 @@
 from flask import Flask, render_template, Response, request, send_from_directory
 from flask_pymongo import PyMongo, ASCENDING, DESCENDING
-from pandas import DataFrame
 from operator import itemgetter
 
 from analyst.helpers import mongo_uri
+from analyst.layout import prices_frame, to_records
 from analyst.algo.plot import simple_plot
 from jinja2.exceptions import UndefinedError
 
@@ -53,9 +53,14 @@ def screener_result_list(task_id, page):
 
     screener_filter = {"taskId": task_id}
     screener_result = mongo.db.screener_results.find_one(screener_filter)
-    symbols = screener_result["tickerSymbols"]
+    # A running task appends the matched symbols as it goes.
+    stock_data_filter = {"symbol.symbol": {"$in": []}}
+    if screener_result is not None and "symbolIds" in screener_result:
+        stock_data_filter = {"symbolId": {"$in": screener_result["symbolIds"]}}
+    elif screener_result is not None:
+        stock_data_filter = {"symbol.symbol": {"$in": screener_result["tickerSymbols"]}}
+    task = mongo.db.tasks.find_one(screener_filter)
 
-    stock_data_filter = {"symbol.symbol": {"$in": symbols}}
     sort_condition = [("symbol.symbol", ASCENDING)]
     stock_data_cursor = mongo.db.stock_data.find(stock_data_filter).sort(sort_condition)
     num_total = mongo.db.stock_data.count_documents(stock_data_filter)
@@ -76,7 +81,7 @@ def screener_result_list(task_id, page):
     data = []
     num_quarters = 4
     for s in stock_data_cursor.skip(num_displayed).limit(num_per_page):
-        q_financials = s["data"]["financial_statements"]["quarter"]
+        q_financials = to_records(s["data"]["financial_statements"]["quarter"])
         q_financials = sorted(q_financials, key=itemgetter("date"), reverse=True)
         q_financials = q_financials[0:num_quarters]
         data.append(
@@ -91,6 +96,7 @@ def screener_result_list(task_id, page):
         data=data,
         pagination=pagination,
         task_id=task_id,
+        task=task,
     )
 
 
@@ -104,8 +110,7 @@ def simple_candlestick_chart(symbol):
     h = request.args.get("h", default_h)
 
     ticker = mongo.db.stock_data.find_one({"symbol.symbol": symbol})
-    prices = ticker["data"]["prices"]["historical"]
-    df_prices = DataFrame.from_dict(prices)
+    df_prices = prices_frame(ticker)
     chart_image = simple_plot(df_prices, days, w, h)
 
     return Response(chart_image, content_type="image/jpeg")
@@ -0,0 +1,54 @@
+from time import sleep
+
+from mongomock import MongoClient
+from pymongo import InsertOne
+
+from analyst.bulk_writer import BulkWriter
+
+
+class TestBulkWriter:
+    def setup_method(self):
+        self.mock_db_client = MongoClient()
+        self.collection = self.mock_db_client["db"]["collection"]
+
+    def teardown_method(self):
+        self.mock_db_client.close()
+
+    def test_flush_on_close(self):
+        with BulkWriter(self.collection, flush_interval=60) as writer:
+            for i in range(3):
+                writer.insert({"i": i})
+            assert self.collection.count_documents({}) == 0
+        assert self.collection.count_documents({}) == 3
+
+    def test_flush_on_max_buffer(self):
+        with BulkWriter(self.collection, max_buffer=2, flush_interval=60) as writer:
+            writer.insert({"i": 0})
+            writer.insert({"i": 1})
+            sleep(0.1)
+            assert self.collection.count_documents({}) == 2
+
+    def test_flush_on_interval(self):
+        with BulkWriter(self.collection, flush_interval=0.05) as writer:
+            writer.insert({"i": 0})
+            sleep(0.2)
+            assert self.collection.count_documents({}) == 1
+
+    def test_failed(self):
+        self.collection.create_index("i", unique=True)
+        flushed = []
+        writer = BulkWriter(
+            self.collection,
+            flush_interval=60,
+            on_flush=lambda written, failed: flushed.append((written, failed)),
+        )
+        duplicate = InsertOne({"i": 0})
+        writer.insert({"i": 0})
+        writer.add(duplicate)
+        writer.insert({"i": 1})
+        writer.close()
+        assert self.collection.count_documents({}) == 2
+        assert writer.failed == [duplicate]
+        written, failed = flushed[0]
+        assert len(written) == 2
+        assert failed == [duplicate]
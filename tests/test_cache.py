@@ -0,0 +1,50 @@
+import os
+from time import time
+
+import pytest
+
+from analyst.cache import ResponseCache, CacheMissError
+
+
+class TestResponseCache:
+    def test_put_and_get(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        cache.put("income-statement/TEST", {"limit": 8}, [{"date": "2023-01-01"}])
+        assert cache.get("income-statement/TEST", {"limit": 8}) == (
+            True,
+            [{"date": "2023-01-01"}],
+        )
+        assert cache.get("income-statement/TEST", {"limit": 4}) == (False, None)
+        assert cache.get("income-statement/OTHER", {"limit": 8}) == (False, None)
+
+    def test_persistent(self, tmp_path):
+        ResponseCache(tmp_path).put("stock/list", {}, [1])
+        assert ResponseCache(tmp_path).get("stock/list", {}) == (True, [1])
+
+    def test_ttl(self, tmp_path):
+        cache = ResponseCache(tmp_path, ttls={"stock": 10, "stock/list": 100})
+        assert cache.ttl("stock/list") == 100
+        assert cache.ttl("stock/other") == 10
+        assert cache.ttl("income-statement/TEST") == ResponseCache.DEFAULT_TTL
+        cache.put("stock/list", {}, [1])
+        path = cache._path("stock/list", {})
+        expired = time() - 101
+        os.utime(path, (expired, expired))
+        assert cache.get("stock/list", {}) == (False, None)
+
+    def test_replay_only(self, tmp_path):
+        ResponseCache(tmp_path, ttls={"stock/list": 0}).put("stock/list", {}, [1])
+        cache = ResponseCache(tmp_path, ttls={"stock/list": 0}, replay_only=True)
+        assert cache.get("stock/list", {}) == (True, [1])
+        with pytest.raises(CacheMissError):
+            cache.get("income-statement/TEST", {})
+
+    def test_eviction(self, tmp_path):
+        cache = ResponseCache(tmp_path, max_bytes=100)
+        for i in range(5):
+            cache.put(f"income-statement/{i}", {}, ["x" * 20])
+            path = cache._path(f"income-statement/{i}", {})
+            os.utime(path, (i, time() - 10 + i))
+        assert cache._size <= 100
+        assert cache.get("income-statement/0", {}) == (False, None)
+        assert cache.get("income-statement/4", {}) == (True, ["x" * 20])
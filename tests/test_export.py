@@ -0,0 +1,98 @@
+import json
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+from mongomock import MongoClient
+
+from analyst.algo.filter import latest_yoy_growth_ratio_panel
+from analyst.export import ExportTask, read_manifest, read_snapshot_table
+from analyst.layout import to_layout
+from analyst.screener import ParquetScreenerTask
+from analyst.task_base import AnalystTaskBase
+
+pytest.importorskip("pyarrow")
+
+snapshot_file_path = Path.cwd() / "tests/fixtures/stock_snapshot.json"
+with open(snapshot_file_path, "r", encoding="utf-8") as f:
+    stock_data_snapshot = json.load(f)
+
+
+def panel_fn(df):
+    return latest_yoy_growth_ratio_panel(df, "epsdiluted", 0.2)
+
+
+class TestExportTask:
+    def setup_method(self):
+        db_name = AnalystTaskBase.DB_NAME
+        client = MongoClient()
+        self.mock_db_client = client
+        self.stock_data_collection = client[db_name]["stock_data"]
+        self.task_collection = client[db_name]["tasks"]
+        self.screener_collection = client[db_name]["screener_results"]
+        self.dummy_task_id = "dummyTaskId"
+        self.task_collection.insert_one(
+            {
+                "taskId": self.dummy_task_id,
+                "taskType": "get_stock_data",
+                "complete": True,
+            }
+        )
+        for i, name in enumerate(["ONE", "TWO", "THREE"]):
+            data = deepcopy(stock_data_snapshot["data"])
+            if name == "ONE":
+                data["financial_statements"]["quarter"][0]["epsdiluted"] = 1.5
+            if name == "THREE":
+                data["prices"]["historical"] = to_layout(
+                    data["prices"]["historical"], "packed"
+                )
+            self.stock_data_collection.insert_one(
+                {
+                    "taskId": self.dummy_task_id,
+                    "symbol": {"symbol": name},
+                    "data": data,
+                }
+            )
+
+    def teardown_method(self):
+        self.mock_db_client.close()
+
+    def export(self, tmp_path, mocker):
+        mocker.patch.object(ExportTask, "PARTITION_SIZE", 2)
+        task = ExportTask("TEST", self.dummy_task_id, tmp_path, self.mock_db_client)
+        task.run()
+        return tmp_path / self.dummy_task_id
+
+    def test_run(self, tmp_path, mocker):
+        snapshot_dir = self.export(tmp_path, mocker)
+        manifest = read_manifest(snapshot_dir)
+        assert manifest["symbols"] == ["ONE", "TWO", "THREE"]
+        assert len(manifest["files"]["prices"]) == 2
+        prices = read_snapshot_table(snapshot_dir, "prices", ["symbol", "close"])
+        num_prices = len(stock_data_snapshot["data"]["prices"]["historical"])
+        assert len(prices) == 3 * num_prices
+        assert list(prices.columns) == ["symbol", "close"]
+        statements = read_snapshot_table(
+            snapshot_dir, "statements", ["symbol", "date", "missing"]
+        )
+        assert statements["missing"].isna().all()
+
+    def test_incomplete_source_task(self, tmp_path):
+        self.task_collection.update_one(
+            {"taskId": self.dummy_task_id}, {"$set": {"complete": False}}
+        )
+        task = ExportTask("TEST", self.dummy_task_id, tmp_path, self.mock_db_client)
+        with pytest.raises(ValueError):
+            task.run()
+
+    def test_parquet_screener(self, tmp_path, mocker):
+        snapshot_dir = self.export(tmp_path, mocker)
+        task = ParquetScreenerTask(
+            "TEST", snapshot_dir, panel_fn, ["epsdiluted"], self.mock_db_client
+        )
+        task.run()
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["ONE"]
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        latest = one["data"]["financial_statements"]["quarter"][0]
+        assert "epsdilutedYoYChangePct" not in latest
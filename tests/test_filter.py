@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from pandas import DataFrame
+from pandas.testing import assert_frame_equal
+
+from analyst.algo.filter import (
+    latest_yoy_growth_ratio,
+    latest_yoy_growth_ratio_panel,
+    max_up_multiple_from_lowest,
+    up_x_times_from_lowest,
+    yoy_growth_prefilter,
+)
+
+
+def test_yoy_growth_prefilter():
+    financials_quarter = [
+        {"date": f"2023-0{i + 1}-01", "epsdiluted": eps}
+        for i, eps in enumerate([1.0, 1.0, 1.0, 1.0, 1.3])
+    ]
+    assert yoy_growth_prefilter("epsdiluted", 0.2)(financials_quarter)
+    assert not yoy_growth_prefilter("epsdiluted", 0.4)(financials_quarter)
+    assert not yoy_growth_prefilter("epsdiluted", 0.2)(financials_quarter[:4])
+    assert yoy_growth_prefilter("epsdiluted", 0.2).args == ["epsdiluted", 0.2]
+
+
+def test_latest_yoy_growth_ratio_panel():
+    records = []
+    for symbol, eps_list in {
+        "UP": [1.0, 1.0, 1.0, 1.0, 1.3],
+        "FLAT": [1.0, 1.0, 1.0, 1.0, 1.0],
+        "SHORT": [1.0, 2.0],
+        "NEGATIVE": [-1.0, 1.0, 1.0, 1.0, -0.5],
+    }.items():
+        for i, eps in enumerate(eps_list):
+            records.append({"symbol": symbol, "date": f"2023-0{i + 1}-01", "eps": eps})
+    df = DataFrame.from_records(records).sample(frac=1, random_state=0)
+
+    passed, updated = latest_yoy_growth_ratio_panel(df, "eps", 0.2)
+    assert passed == {"UP", "NEGATIVE"}
+
+    for symbol, rows in df.groupby("symbol"):
+        expected_result, expected = latest_yoy_growth_ratio(rows, "eps", 0.2)
+        assert (symbol in passed) == expected_result
+        actual = updated[updated["symbol"] == symbol]
+        assert_frame_equal(actual, expected)
+
+
+def up_x_times_from_lowest_quadratic(df, x, min_=-1.0):
+    # The former implementation, kept as the reference of the parity test.
+    df = df.query("peak.notna() or trough.notna()").reset_index()
+    troughs = df["trough"]
+    peaks = df["peak"]
+    for i in range(0, len(df) - 1):
+        trough_price = troughs.iat[i]
+        if trough_price < min_ or np.isnan(trough_price):
+            continue
+        next_i = i + 1
+        if (peaks[next_i:] >= trough_price * x).any():
+            return True
+    return False
+
+
+def random_pivots(n, seed):
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.uniform(1, 10, n), 1)
+    kinds = rng.integers(0, 4, n)
+    return DataFrame(
+        {
+            "peak": np.where(kinds == 1, prices, np.nan),
+            "trough": np.where(kinds == 2, prices, np.nan),
+        },
+        index=np.arange(n) * 2,
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_up_x_times_from_lowest_parity(seed):
+    df = random_pivots(30, seed)
+    for x in (1.5, 2.0, 3.0, 5.0):
+        for min_ in (-1.0, 3.0):
+            expected = up_x_times_from_lowest_quadratic(df, x, min_)
+            filter_result, pivots = up_x_times_from_lowest(df, x, min_)
+            assert filter_result is expected
+            assert_frame_equal(
+                pivots, df.query("peak.notna() or trough.notna()").reset_index()
+            )
+            multiple, _ = max_up_multiple_from_lowest(df, min_)
+            assert (multiple >= x) is expected
+
+
+def test_max_up_multiple_from_lowest():
+    nan = np.nan
+    df = DataFrame(
+        {
+            "peak": [nan, 6, nan, nan, 9, 30],
+            "trough": [2, nan, 3, 20, nan, nan],
+        }
+    )
+    multiple, _ = max_up_multiple_from_lowest(df)
+    assert multiple == 15
+    # A peak before the trough does not count.
+    multiple, _ = max_up_multiple_from_lowest(df, min_=2.5)
+    assert multiple == 10
+    multiple, _ = max_up_multiple_from_lowest(df.iloc[2:4])
+    assert np.isnan(multiple)
+    assert up_x_times_from_lowest(df, 15)[0]
+    assert not up_x_times_from_lowest(df, 16)[0]
@@ -2,7 +2,7 @@ import re
 
 import pytest
 
-from analyst.helpers import mongo_uri, date_window
+from analyst.helpers import mongo_uri, date_window, merge_by_date, iter_json_array
 
 
 def test_uri():
@@ -21,3 +21,36 @@ def test_uri():
 )
 def test_date_window(args, expected):
     assert date_window(*args) == expected
+
+
+def test_merge_by_date():
+    old = [
+        {"date": "2023-01-03", "close": 1.0},
+        {"date": "2023-01-02", "close": 1.0},
+        {"date": "2023-01-01", "close": 1.0},
+    ]
+    new = [{"date": "2023-01-04", "close": 2.0}, {"date": "2023-01-03", "close": 2.0}]
+    merged = merge_by_date(old, new, since="2023-01-02")
+    assert [r["date"] for r in merged] == ["2023-01-04", "2023-01-03", "2023-01-02"]
+    assert merged[1]["close"] == 2.0
+    merged = merge_by_date(old, new, limit=2)
+    assert [r["date"] for r in merged] == ["2023-01-04", "2023-01-03"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_iter_json_array(chunk_size):
+    text = ' [ {"a": 1, "b": "x,]"}, 12345 , [1, 2],"s", null ] '
+    chunks = [text[i:][:chunk_size] for i in range(0, len(text), chunk_size)]
+    assert list(iter_json_array(chunks)) == [
+        {"a": 1, "b": "x,]"},
+        12345,
+        [1, 2],
+        "s",
+        None,
+    ]
+
+
+@pytest.mark.parametrize("text", ['{"a": 1}', "[1, 2"])
+def test_iter_json_array_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array([text]))
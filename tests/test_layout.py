@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+
+import pytest
+from mongomock import MongoClient
+from pandas.testing import assert_frame_equal
+
+from analyst.layout import (
+    is_columnar,
+    prices_frame,
+    statements_frame,
+    to_frame,
+    to_layout,
+    to_records,
+)
+
+snapshot_file_path = Path.cwd() / "tests/fixtures/stock_snapshot.json"
+with open(snapshot_file_path, "r", encoding="utf-8") as f:
+    stock_data_snapshot = json.load(f)
+
+historical = stock_data_snapshot["data"]["prices"]["historical"]
+quarter = stock_data_snapshot["data"]["financial_statements"]["quarter"]
+
+
+def stored_doc(layout):
+    doc = {
+        "data": {
+            "financial_statements": {"quarter": to_layout(quarter, layout)},
+            "prices": {"historical": to_layout(historical, layout)},
+        }
+    }
+    collection = MongoClient()["db"]["stock_data"]
+    collection.insert_one(doc)
+    return collection.find_one({})
+
+
+@pytest.mark.parametrize("layout", ["rows", "columns", "packed"])
+def test_frames(layout):
+    doc = stored_doc(layout)
+    assert is_columnar(doc["data"]["prices"]["historical"]) == (layout != "rows")
+    expected_prices = to_frame(historical)
+    assert_frame_equal(
+        prices_frame(doc), expected_prices, check_dtype=layout != "packed"
+    )
+    assert_frame_equal(statements_frame(doc), to_frame(quarter))
+
+
+@pytest.mark.parametrize("layout", ["rows", "columns", "packed"])
+def test_to_records(layout):
+    doc = stored_doc(layout)
+    assert to_records(doc["data"]["financial_statements"]["quarter"]) == quarter
+    records = to_records(doc["data"]["prices"]["historical"])
+    assert records == historical
+
+
+def test_packed():
+    packed = to_layout(historical, "packed")
+    assert isinstance(packed["close"], bytes)
+    assert len(packed["close"]) == 8 * len(historical)
+    assert packed["date"] == [r["date"] for r in historical]
+
+
+def test_missing_fields():
+    columns = to_layout([{"a": 1}, {"b": 2}], "columns")
+    assert columns == {"a": [1, None], "b": [None, 2]}
+    assert to_records(columns) == [{"a": 1}, {"b": 2}]
+
+
+def test_packed_missing_fields():
+    records = [dict(historical[0]), dict(historical[1])]
+    del records[1]["volume"]
+    packed = to_layout(records, "packed")
+    assert to_records(packed) == records
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        to_layout([], "unknown")
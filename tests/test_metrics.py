@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+from mongomock import MongoClient
+from pandas import DataFrame
+
+from analyst.bulk_writer import BulkWriter
+from analyst.metrics import MetricStore, call_filter, statements_version, uses_metrics
+
+
+def compute_double(inputs):
+    return DataFrame({"double": inputs["x"] * 2}, index=inputs.index)
+
+
+VERSION = "TASK/2023-01-01"
+
+
+class TestMetricStore:
+    def setup_method(self):
+        self.mock_db_client = MongoClient()
+        self.collection = self.mock_db_client["db"]["derived_metrics"]
+        self.inputs = DataFrame({"x": [1.0, 2.0, 3.0]}, index=[2, 0, 1])
+
+    def compute(self):
+        return compute_double(self.inputs)
+
+    def teardown_method(self):
+        self.mock_db_client.close()
+
+    def test_get_or_compute(self, mocker):
+        store = MetricStore(self.collection)
+        compute = mocker.Mock(side_effect=self.compute)
+        first = store.get_or_compute("ONE", VERSION, "double", {}, compute)
+        second = store.get_or_compute("ONE", VERSION, "double", {}, compute)
+        assert compute.call_count == 1
+        assert store.summary() == {"hits": 1, "misses": 1}
+        assert first.equals(second)
+
+    def test_get_from_collection(self):
+        store = MetricStore(self.collection)
+        store.get_or_compute("ONE", VERSION, "double", {"k": 1}, self.compute)
+        new_store = MetricStore(self.collection)
+        value = new_store.get("ONE", VERSION, "double", {"k": 1})
+        assert value.index.tolist() == [2, 0, 1]
+        assert value["double"].tolist() == [2.0, 4.0, 6.0]
+        assert new_store.get("ONE", VERSION, "double", {"k": 2}) is None
+
+    def test_prefetch(self, mocker):
+        MetricStore(self.collection).get_or_compute(
+            "ONE", VERSION, "double", {}, self.compute
+        )
+        store = MetricStore(self.collection)
+        spy = mocker.spy(self.collection, "find_one")
+        store.prefetch(["ONE", "TWO"])
+        assert store.get("ONE", VERSION, "double", {})["double"].tolist() == [
+            2.0,
+            4.0,
+            6.0,
+        ]
+        assert store.get("TWO", VERSION, "double", {}) is None
+        spy.assert_not_called()
+        assert store.get("THREE", VERSION, "double", {}) is None
+        assert spy.call_count == 1
+
+    def test_put_with_writer(self):
+        store = MetricStore(self.collection)
+        with BulkWriter(self.collection, flush_interval=60) as writer:
+            store.writer = writer
+            store.get_or_compute("ONE", VERSION, "double", {}, self.compute)
+            assert self.collection.count_documents({}) == 0
+        assert self.collection.count_documents({}) == 1
+
+    def test_new_version_replaces_old(self):
+        store = MetricStore(self.collection)
+        store.get_or_compute("ONE", VERSION, "double", {}, self.compute)
+        changed = self.inputs.assign(x=[1.0, 2.0, 4.0])
+        value = store.get_or_compute(
+            "ONE", "TASK/2023-04-01", "double", {}, lambda: compute_double(changed)
+        )
+        assert value["double"].tolist() == [2.0, 4.0, 8.0]
+        assert self.collection.count_documents({}) == 1
+        assert store.summary()["misses"] == 2
+
+    def test_memory_limit(self):
+        store = MetricStore(self.collection, max_entries=2)
+        for symbol in ["ONE", "TWO", "THREE"]:
+            store.get_or_compute(symbol, VERSION, "double", {}, self.compute)
+        assert len(store._memory) == 2
+        assert self.collection.count_documents({}) == 3
+
+    def test_evict_older_than(self):
+        store = MetricStore(self.collection)
+        store.get_or_compute("ONE", VERSION, "double", {}, self.compute)
+        store.get_or_compute("TWO", VERSION, "double", {}, self.compute)
+        self.collection.update_one(
+            {"symbol": "ONE"},
+            {"$set": {"updated": datetime.now() - timedelta(days=31)}},
+        )
+        assert store.evict_older_than(timedelta(days=30)) == 1
+        assert self.collection.count_documents({"symbol": "TWO"}) == 1
+
+
+def test_call_filter():
+    @uses_metrics
+    def with_metrics(data, metrics=None):
+        return metrics is not None, {}
+
+    def without_metrics(data, value=True):
+        return value, {}
+
+    assert call_filter(with_metrics, {}, object()) == (True, {})
+    assert call_filter(without_metrics, {}, object()) == (True, {})
+    assert call_filter(without_metrics, {}, None, {"value": False}) == (False, {})
+
+
+def test_statements_version():
+    rows = {
+        "taskId": "TASK",
+        "data": {
+            "financial_statements": {
+                "quarter": [{"date": "2023-06-30"}, {"date": "2023-03-31"}]
+            }
+        },
+    }
+    assert statements_version(rows) == "TASK/2023-06-30"
+    columns = {
+        "taskId": "TASK",
+        "data": {"financial_statements": {"quarter": {"date": ["2023-06-30"]}}},
+    }
+    assert statements_version(columns) == "TASK/2023-06-30"
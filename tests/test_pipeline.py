@@ -0,0 +1,112 @@
+import pytest
+
+from analyst.pipeline import FilterPipeline, FilterStage
+
+
+def is_even(data):
+    return data["i"] % 2 == 0, {"data.even": True}
+
+
+def is_small(data, limit=10):
+    return data["i"] < limit, {"data.small": True}
+
+
+is_even.fields = ("data.i",)
+is_small.fields = ("data.i", "data.size")
+
+
+class TestFilterPipeline:
+    def test_short_circuit(self):
+        pipeline = FilterPipeline(
+            [FilterStage("even", is_even), FilterStage("small", is_small)]
+        )
+        assert pipeline({"i": 2}) == (True, {"data.even": True, "data.small": True})
+        assert pipeline({"i": 3}) == (False, {"data.even": True})
+        even, small = pipeline.stages
+        assert (even.evaluated, even.passed) == (2, 1)
+        assert (small.evaluated, small.passed) == (1, 1)
+
+    def test_params_by_stage(self):
+        pipeline = FilterPipeline(
+            [FilterStage("even", is_even), FilterStage("small", is_small)]
+        )
+        assert pipeline({"i": 20})[0] is False
+        assert pipeline({"i": 20}, small={"limit": 30})[0] is True
+
+    def test_fields(self):
+        pipeline = FilterPipeline(
+            [FilterStage("even", is_even), FilterStage("small", is_small)]
+        )
+        assert pipeline.fields == ("data.i", "data.size")
+        pipeline.stages.append(FilterStage("any", lambda data: (True, {})))
+        assert pipeline.fields is None
+
+    def test_duplicate_names(self):
+        with pytest.raises(ValueError):
+            FilterPipeline([FilterStage("even", is_even), FilterStage("even", is_even)])
+
+    def test_reorder(self):
+        pipeline = FilterPipeline(
+            [FilterStage("small", is_small), FilterStage("even", is_even)],
+            adaptive=False,
+        )
+        small, even = pipeline.stages
+        small.evaluated, small.passed, small.seconds = 100, 90, 1.0
+        even.evaluated, even.passed, even.seconds = 100, 50, 1.0
+        pipeline.reorder()
+        assert [s.name for s in pipeline.stages] == ["even", "small"]
+
+    def test_reorder_needs_samples(self):
+        pipeline = FilterPipeline(
+            [FilterStage("small", is_small), FilterStage("even", is_even)]
+        )
+        for i in range(10):
+            pipeline({"i": i})
+        pipeline.reorder()
+        assert [s.name for s in pipeline.stages] == ["small", "even"]
+
+    def test_reorder_stages_with_samples(self):
+        pipeline = FilterPipeline(
+            [
+                FilterStage("small", is_small),
+                FilterStage("rare", is_small),
+                FilterStage("even", is_even),
+            ],
+            adaptive=False,
+        )
+        small, rare, even = pipeline.stages
+        small.evaluated, small.passed, small.seconds = 100, 90, 1.0
+        rare.evaluated, rare.passed, rare.seconds = 5, 0, 0.0
+        even.evaluated, even.passed, even.seconds = 100, 50, 1.0
+        pipeline.reorder()
+        assert pipeline.stage_names == ["even", "rare", "small"]
+
+    def test_copy(self):
+        pipeline = FilterPipeline(
+            [FilterStage("small", is_small), FilterStage("even", is_even)]
+        )
+        pipeline.filter_name = "test"
+        pipeline({"i": 2})
+        copied = pipeline.copy(["even", "small"], adaptive=False)
+        assert copied.stage_names == ["even", "small"]
+        assert all(s.evaluated == 0 for s in copied.stages)
+        assert not copied.adaptive
+        assert copied.filter_name == "test"
+        assert pipeline.copy().stage_names == ["small", "even"]
+
+    def test_adaptive(self, mocker):
+        pipeline = FilterPipeline([FilterStage("even", is_even)])
+        spy = mocker.spy(pipeline, "reorder")
+        for i in range(FilterPipeline.MIN_SAMPLES * 2 + 1):
+            pipeline({"i": i})
+        assert spy.call_count == 2
+
+    def test_take_and_merge_stats(self):
+        worker = FilterPipeline([FilterStage("even", is_even)])
+        parent = FilterPipeline([FilterStage("even", is_even)])
+        for i in range(3):
+            worker({"i": i})
+        parent.merge_stats(worker.take_stats())
+        assert worker.stages[0].evaluated == 0
+        assert (parent.stages[0].evaluated, parent.stages[0].passed) == (3, 2)
+        assert parent.summary()[0]["passRate"] == 2 / 3
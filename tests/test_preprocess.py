@@ -0,0 +1,196 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from pandas import DataFrame, concat
+from pandas.testing import assert_frame_equal
+
+from analyst.algo.preprocess import (
+    PIVOT_COLUMNS,
+    PivotState,
+    find_peak_and_trough,
+    find_peak_and_trough_matrix,
+    find_peak_and_trough_panel,
+    smoothen_peak_and_trough,
+    smoothen_peak_and_trough_matrix,
+    smoothen_peak_and_trough_panel,
+)
+
+snapshot_file_path = Path.cwd() / "tests/fixtures/stock_snapshot.json"
+with open(snapshot_file_path, "r", encoding="utf-8") as f:
+    stock_data_snapshot = json.load(f)
+
+
+def random_prices(n, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    # Rounding makes equal consecutive prices, i.e. zero differences, likely.
+    high = np.round(close * (1 + rng.uniform(0, 0.02, n)), 0)
+    low = np.round(close * (1 - rng.uniform(0, 0.02, n)), 0)
+    return DataFrame({"high": high, "low": low, "close": close})
+
+
+def random_panel(lengths):
+    frames = []
+    for seed, n in enumerate(lengths):
+        df = random_prices(n, seed)
+        df.insert(0, "date", [f"2020-01-{d:04d}" for d in range(n)])
+        df.insert(0, "symbol", f"S{seed}")
+        frames.append(df)
+    # Shuffled rows, as the panel is sorted by symbol and date.
+    return concat(frames, ignore_index=True).sample(frac=1, random_state=0)
+
+
+def smoothen_peak_and_trough_row_wise(df, threshold_pct):
+    # The former implementation, kept as the reference of the parity tests.
+    def is_valid(pivot_type, price, prev_type, prev_price):
+        if np.isnan(price):
+            return False
+        if prev_type == "":
+            return True
+        if pivot_type == "peak" == prev_type:
+            return price > prev_price
+        if pivot_type == "trough" == prev_type:
+            return price < prev_price
+        diff_pct = price / prev_price
+        return diff_pct > 1 + threshold_pct or diff_pct < 1 - threshold_pct
+
+    df = df.copy()
+    pivots = {"peak": df["peak"].copy(), "trough": df["trough"].copy()}
+    prev_type, prev_row, prev_price = "", np.nan, np.nan
+    for i in range(0, len(df)):
+        for pivot_type, prices in pivots.items():
+            price = prices.iat[i]
+            if is_valid(pivot_type, price, prev_type, prev_price):
+                if prev_type == pivot_type:
+                    prices.iloc[prev_row] = np.nan
+                prev_type, prev_row, prev_price = pivot_type, i, price
+            else:
+                prices.iloc[i] = np.nan
+    df["smooth_peak"] = pivots["peak"]
+    df["smooth_trough"] = pivots["trough"]
+    return df
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_peak_and_trough_parity(seed):
+    df = random_prices(250, seed)
+    df.loc[10, "high"] = np.nan
+    expected = find_peak_and_trough(df, vectorized=False)
+    actual = find_peak_and_trough(df)
+    assert_frame_equal(actual, expected)
+    assert actual["peak"].notna().any()
+
+
+def test_find_peak_and_trough_snapshot():
+    prices = stock_data_snapshot["data"]["prices"]["historical"]
+    df = DataFrame.from_records(prices).sort_values(by="date").reset_index(drop=True)
+    expected = find_peak_and_trough(df, vectorized=False)
+    assert_frame_equal(find_peak_and_trough(df), expected)
+    assert "peak" not in df.columns
+
+
+def test_find_peak_and_trough():
+    df = DataFrame({"high": [1, 3, 2, 2, 4], "low": [2, 1, 3, 0, 5]})
+    df = find_peak_and_trough(df)
+    assert df["peak"].tolist()[1] == 3
+    assert df["peak"].isna().sum() == 4
+    assert df["trough"].tolist()[1] == 1
+    assert df["trough"].tolist()[3] == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("threshold_pct", [0, 0.03, 0.1])
+def test_smoothen_peak_and_trough_parity(seed, threshold_pct):
+    df = find_peak_and_trough(random_prices(250, seed))
+    # A peak and a trough on the same row.
+    df.loc[20, ["peak", "trough"]] = [df.loc[20, "high"], df.loc[20, "low"]]
+    expected = smoothen_peak_and_trough_row_wise(df, threshold_pct)
+    actual = smoothen_peak_and_trough(df, threshold_pct)
+    assert_frame_equal(actual, expected)
+    assert actual["smooth_peak"].notna().any()
+
+
+def test_smoothen_peak_and_trough_snapshot():
+    prices = stock_data_snapshot["data"]["prices"]["historical"]
+    df = DataFrame.from_records(prices).sort_values(by="date").reset_index(drop=True)
+    df = find_peak_and_trough(df)
+    expected = smoothen_peak_and_trough_row_wise(df, 0.05)
+    assert_frame_equal(smoothen_peak_and_trough(df, 0.05), expected)
+
+
+def test_smoothen_peak_and_trough():
+    nan = np.nan
+    df = DataFrame(
+        {
+            "peak": [nan, 10, 12, nan, nan, nan, 7.1],
+            "trough": [nan, nan, nan, 11.9, 8, 7, nan],
+        }
+    )
+    df = smoothen_peak_and_trough(df, 0.05)
+    # 12 replaces the lower consecutive peak 10, and 7 the higher trough 8.
+    # 11.9 and 7.1 are within the threshold.
+    assert df["smooth_peak"].fillna(0).tolist() == [0, 0, 12, 0, 0, 0, 0]
+    assert df["smooth_trough"].fillna(0).tolist() == [0, 0, 0, 0, 0, 7, 0]
+
+
+def test_peak_and_trough_panel():
+    panel = random_panel([250, 1, 2, 100, 3])
+    actual = find_peak_and_trough_panel(panel)
+    actual = smoothen_peak_and_trough_panel(actual, 0.05)
+    assert actual["symbol"].is_monotonic_increasing
+    for symbol_name, group in actual.groupby("symbol"):
+        df = panel.loc[panel["symbol"] == symbol_name].sort_values(by="date")
+        df = find_peak_and_trough(df.reset_index(drop=True))
+        expected = smoothen_peak_and_trough(df, 0.05)
+        assert_frame_equal(group.reset_index(drop=True), expected)
+    assert actual["smooth_trough"].notna().any()
+
+
+def test_peak_and_trough_matrix():
+    lengths = [250, 120, 2]
+    high = np.full((len(lengths), max(lengths)), np.nan)
+    low = high.copy()
+    for row, n in enumerate(lengths):
+        df = random_prices(n, row)
+        # A shorter history is padded at the start.
+        high[row, -n:] = df["high"]
+        low[row, -n:] = df["low"]
+    peaks, troughs = find_peak_and_trough_matrix(high, low)
+    smooth_peaks, smooth_troughs = smoothen_peak_and_trough_matrix(peaks, troughs, 0.05)
+    for row, n in enumerate(lengths):
+        df = find_peak_and_trough(random_prices(n, row))
+        expected = smoothen_peak_and_trough(df, 0.05)
+        np.testing.assert_array_equal(peaks[row, -n:], expected["peak"])
+        np.testing.assert_array_equal(troughs[row, -n:], expected["trough"])
+        np.testing.assert_array_equal(smooth_peaks[row, -n:], expected["smooth_peak"])
+        np.testing.assert_array_equal(
+            smooth_troughs[row, -n:], expected["smooth_trough"]
+        )
+        assert np.isnan(peaks[row, :-n]).all()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 300])
+def test_pivot_state(seed, chunk_size):
+    df = random_prices(250, seed)
+    expected = smoothen_peak_and_trough(find_peak_and_trough(df), 0.03)
+    actual = DataFrame(np.nan, index=df.index, columns=list(PIVOT_COLUMNS))
+    state = PivotState(0.03)
+    num_dropped = 0
+    for start in range(0, len(df), chunk_size):
+        # Stored and restored between the updates.
+        state = PivotState.from_dict(json.loads(json.dumps(state.to_dict())))
+        pivot_row = state.pivot["row"] if state.pivot else None
+        rows = state.update(df[start:][:chunk_size])
+        # The previous last bar, the new bars and the dropped pivot if any.
+        earlier_rows = set(rows.index) - set(range(start - 1, start + chunk_size))
+        assert earlier_rows <= {pivot_row}
+        num_dropped += len(earlier_rows)
+        actual.loc[rows.index] = rows
+    assert_frame_equal(actual, expected.loc[:, list(PIVOT_COLUMNS)])
+    assert state.num_bars == len(df)
+    assert state.update(df[:0]).empty
+    if chunk_size == 1:
+        assert num_dropped > 0
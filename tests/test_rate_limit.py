@@ -0,0 +1,56 @@
+from time import monotonic
+
+from analyst.rate_limit import TokenBucket, AdaptiveRateController
+
+
+class TestTokenBucket:
+    def test_reserve_within_capacity(self):
+        bucket = TokenBucket(60, capacity=2)
+        assert bucket.reserve() == 0.0
+        assert bucket.reserve() == 0.0
+
+    def test_reserve_debt(self):
+        bucket = TokenBucket(60, capacity=1)
+        bucket.reserve()
+        delay = bucket.reserve()
+        assert 0.9 < delay <= 1.0
+        delay = bucket.reserve()
+        assert 1.9 < delay <= 2.0
+
+
+class TestAdaptiveRateController:
+    def test_additive_increase(self):
+        controller = AdaptiveRateController(60, increase_rpm=60)
+        for _ in range(60):
+            controller.on_success(0.1)
+        assert 100 < controller.rate_per_minute < 120
+
+    def test_max_rpm(self):
+        controller = AdaptiveRateController(60, max_rpm=61, increase_rpm=60)
+        for _ in range(60):
+            controller.on_success(0.1)
+        assert controller.rate_per_minute == 61
+
+    def test_latency_holds_increase(self):
+        controller = AdaptiveRateController(60)
+        controller.on_success(0.1)
+        rate = controller.rate_per_minute
+        for _ in range(20):
+            controller.on_success(10.0)
+        assert controller.rate_per_minute < rate + 1
+
+    def test_multiplicative_decrease(self):
+        controller = AdaptiveRateController(100, min_rpm=30)
+        controller.on_throttle()
+        assert controller.rate_per_minute == 50
+        # Concurrent 429s are a single throttling event.
+        controller.on_throttle()
+        assert controller.rate_per_minute == 50
+        assert controller.throttled_count == 2
+
+    def test_retry_after_pauses(self):
+        controller = AdaptiveRateController(6000)
+        controller.on_throttle(0.2)
+        started = monotonic()
+        controller.acquire()
+        assert monotonic() - started >= 0.19
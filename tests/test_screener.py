@@ -3,9 +3,26 @@ import json
 from copy import deepcopy
 
 from mongomock import MongoClient
+from pandas.testing import assert_frame_equal
 
-from analyst.screener import ScreenerTask
+import pytest
+
+import analyst.screener
+
+from analyst.screener import (
+    FILTERS,
+    ScreenerTask,
+    PanelScreenerTask,
+    _apply_filter_chunk,
+    iter_chunks,
+    register_filter,
+    unstored_patch,
+    uses_fields,
+)
+from analyst.algo.filter import latest_yoy_growth_ratio_panel
 from analyst.task_base import AnalystTaskBase
+from analyst.metrics import MetricStore
+from analyst.layout import to_layout
 
 snapshot_file_path = Path.cwd() / "tests/fixtures/stock_snapshot.json"
 with open(snapshot_file_path, "r", encoding="utf-8") as f:
@@ -13,12 +30,21 @@ with open(snapshot_file_path, "r", encoding="utf-8") as f:
 
 
 def pass_one(data):
-    updated = deepcopy(data)
-    updated["data"]["updated"] = True
     result = False
-    if updated["symbol"]["symbol"] == "ONE":
+    if data["symbol"]["symbol"] == "ONE":
         result = True
-    return result, updated
+    return result, {"data.updated": True}
+
+
+@register_filter("test_pass_two")
+def pass_two(data):
+    return data["symbol"]["symbol"] == "TWO", {}
+
+
+@uses_fields("data.financial_statements.quarter")
+def mark_latest_quarter(data):
+    patch = {"data.financial_statements.quarter.0.marked": True}
+    return data["symbol"]["symbol"] == "TWO", patch
 
 
 class TestScreenerTask:
@@ -92,9 +118,75 @@ class TestScreenerTask:
         assert one["data"]["updated"]
         assert two["data"]["updated"]
 
-    def test_run(self):
+    def test_iter_stock_data_from_db(self):
+        task = ScreenerTask(
+            "TEST", self.dummy_task_id, mark_latest_quarter, self.mock_db_client
+        )
+        task.source_symbols = ["ONE", "THREE"]
+        docs = list(task.iter_stock_data_from_db())
+        assert sorted(d["symbol"]["symbol"] for d in docs) == ["ONE", "THREE"]
+        assert list(docs[0]["data"]) == ["financial_statements"]
+        assert list(docs[0]["data"]["financial_statements"]) == ["quarter"]
+
+    def test_filter_and_update_patch(self):
+        task = ScreenerTask(
+            "TEST", self.dummy_task_id, mark_latest_quarter, self.mock_db_client
+        )
+        task.source_symbols = ["TWO"]
+        for data in task.iter_stock_data_from_db():
+            task.filter_and_update(data)
+        assert task.filtered_symbols == ["TWO"]
+        two = self.stock_data_collection.find_one({"symbol.symbol": "TWO"})
+        assert two["data"]["financial_statements"]["quarter"][0]["marked"]
+        assert "revenue" in two["data"]["financial_statements"]["quarter"][0]
+        assert two["data"]["prices"]
+
+    def test_save_filter_result_incrementally(self, mocker):
+        mocker.patch.object(ScreenerTask, "RESULT_BATCH_SIZE", 2)
+        mocker.patch.object(ScreenerTask, "RESULT_FLUSH_INTERVAL", 60)
+        task = ScreenerTask("TEST", self.dummy_task_id, pass_one, self.mock_db_client)
+        task.mark_start()
+        task.source_symbols = task.get_symbols_list_from_db()
+        task.start_filter_result()
+        task.record_result(("ONE", None, True, {}))
+        task.record_result(None)
+        task.record_result(("THREE", None, True, {}))
+        doc = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc["tickerSymbols"] == ["ONE", "THREE"]
+        task.record_result(("FOUR", None, False, {}))
+        task.save_filter_result()
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert doc_task["progress"] == {"total": 4, "screened": 4, "matched": 2}
+        assert self.screener_collection.count_documents({"taskId": task.task_id}) == 1
+
+    def test_run_with_symbol_ids(self):
+        task = ScreenerTask("TEST", self.dummy_task_id, pass_one, self.mock_db_client)
+        symbol_ids = task.symbol_dictionary.ids(["FOUR", "THREE", "TWO", "ONE"])
+        for name, symbol_id in symbol_ids.items():
+            self.stock_data_collection.update_one(
+                {"symbol.symbol": name}, {"$set": {"symbolId": symbol_id}}
+            )
+        self.screener_collection.update_one(
+            {"taskId": self.dummy_task_id},
+            {"$set": {"symbolIds": [symbol_ids["ONE"], symbol_ids["TWO"]]}},
+        )
+        task.run()
+        assert task.source_filter()["symbolId"] == {"$in": [4, 3]}
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["ONE"]
+        assert doc_screener["symbolIds"] == [symbol_ids["ONE"]]
+        two = self.stock_data_collection.find_one({"symbol.symbol": "TWO"})
+        three = self.stock_data_collection.find_one({"symbol.symbol": "THREE"})
+        assert two["data"]["updated"]
+        assert "updated" not in three["data"]
+
+    def test_run(self, mocker):
+        spy = mocker.spy(ScreenerTask, "get_stock_data_from_db")
         task = ScreenerTask("TEST", self.dummy_task_id, pass_one, self.mock_db_client)
         task.run()
+        spy.assert_not_called()
+        for doc in self.stock_data_collection.find({"taskId": self.dummy_task_id}):
+            assert doc["data"]["updated"]
         filter_ = {"taskId": task.task_id}
         count_screener = self.screener_collection.count_documents(filter_)
         doc_screener = self.screener_collection.find_one(filter_)
@@ -102,3 +194,280 @@ class TestScreenerTask:
         assert count_screener == 1
         assert len(doc_screener["tickerSymbols"]) == 1
         assert doc_task["taskType"] == "screener"
+        assert doc_task["progress"] == {"total": 4, "screened": 4, "matched": 1}
+
+    def test_run_worker_errors(self, mocker):
+        mocker.patch("analyst.screener.ScreenerTask.NUM_WORKERS", 1)
+        mocker.patch("analyst.screener.ScreenerTask.QUEUE_SIZE", 1)
+        mocker.patch(
+            "analyst.screener.ScreenerTask.save_patch", side_effect=RuntimeError
+        )
+        task = ScreenerTask("TEST", self.dummy_task_id, pass_one, self.mock_db_client)
+        task.run()
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert doc_task["complete"]
+        assert task.filtered_symbols == []
+
+    def test_unregistered_filter_in_process_pool(self):
+        with pytest.raises(ValueError):
+            ScreenerTask(
+                "TEST",
+                self.dummy_task_id,
+                pass_one,
+                self.mock_db_client,
+                executor="process",
+            )
+
+    def test_run_in_process_pool(self):
+        data = deepcopy(stock_data_snapshot["data"])
+        data["financial_statements"]["quarter"][0]["epsdiluted"] = 1.5
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "THREE"}, {"$set": {"data": data}}
+        )
+        task = ScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            FILTERS["eps_yoy_growth"],
+            self.mock_db_client,
+            executor="process",
+            filter_params={"threshold_pct": 0.24},
+        )
+        task.run()
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["THREE"]
+        three = self.stock_data_collection.find_one({"symbol.symbol": "THREE"})
+        latest = three["data"]["financial_statements"]["quarter"][0]
+        assert abs(latest["epsdilutedYoYChangePct"] - 0.25) < 1e-9
+        assert "revenue" in latest
+
+    def test_run_in_process_pool_filter_of_other_module(self):
+        assert pass_two.filter_module == __name__
+        task = ScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            pass_two,
+            self.mock_db_client,
+            executor="process",
+        )
+        task.run()
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["TWO"]
+
+    def test_run_pipeline(self):
+        pipeline = FILTERS["eps_yoy_growth_and_price_up_2x"]
+        task = ScreenerTask("TEST", self.dummy_task_id, pipeline, self.mock_db_client)
+        task.run()
+        # The task evaluated a copy of the registered pipeline.
+        assert all(s.evaluated == 0 for s in pipeline.stages)
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        stats = {s["name"]: s for s in doc_task["filterStats"]}
+        assert stats["eps_yoy_growth"]["evaluated"] == 4
+        assert stats["eps_yoy_growth"]["passed"] == 0
+        assert stats["price_up_2x"]["evaluated"] == 0
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        assert (
+            "epsdilutedYoYChangePct"
+            in one["data"]["financial_statements"]["quarter"][0]
+        )
+
+    def test_run_with_metric_store(self, mocker):
+        data = deepcopy(stock_data_snapshot["data"])
+        data["financial_statements"]["quarter"][0]["epsdiluted"] = 1.5
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "ONE"}, {"$set": {"data": data}}
+        )
+        store = MetricStore(self.mock_db_client["db"]["derived_metrics"])
+        spy = mocker.spy(store.collection, "find_one")
+        spy_frame = mocker.spy(analyst.screener, "statements_frame")
+        spy_write = mocker.spy(self.stock_data_collection, "bulk_write")
+        results = []
+        for threshold_pct in [0.2, 0.3]:
+            task = ScreenerTask(
+                "TEST",
+                self.dummy_task_id,
+                FILTERS["eps_yoy_growth"],
+                self.mock_db_client,
+                metric_store=store,
+                filter_params={"threshold_pct": threshold_pct},
+            )
+            task.run()
+            doc = self.screener_collection.find_one({"taskId": task.task_id})
+            results.append(doc["tickerSymbols"])
+            if threshold_pct == 0.2:
+                spy_frame.reset_mock()
+                spy_write.reset_mock()
+        assert results == [["ONE"], []]
+        assert store.summary() == {"hits": 4, "misses": 4}
+        # Read with a query per cursor batch instead of per symbol.
+        spy.assert_not_called()
+        # The statements are not loaded again, and the stored values not rewritten.
+        spy_frame.assert_not_called()
+        spy_write.assert_not_called()
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        latest = one["data"]["financial_statements"]["quarter"][0]
+        assert latest["epsdilutedPrevYear"] == 1.2
+
+    def test_run_columnar(self):
+        data = deepcopy(stock_data_snapshot["data"])
+        data["financial_statements"]["quarter"][0]["epsdiluted"] = 1.5
+        data["financial_statements"]["quarter"] = to_layout(
+            data["financial_statements"]["quarter"], "columns"
+        )
+        data["prices"]["historical"] = to_layout(data["prices"]["historical"], "packed")
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "ONE"}, {"$set": {"data": data}}
+        )
+        task = ScreenerTask(
+            "TEST", self.dummy_task_id, FILTERS["eps_yoy_growth"], self.mock_db_client
+        )
+        task.run()
+        assert task.filtered_symbols == ["ONE"]
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        quarter = one["data"]["financial_statements"]["quarter"]
+        assert quarter["epsdilutedPrevYear"][0] == 1.2
+        assert len(quarter["epsdilutedYoYChangePct"]) == len(quarter["date"])
+
+
+def test_price_up_2x_filter():
+    prices = [
+        {"date": "2023-01-0{}".format(i + 1), "high": h, "low": h - 1}
+        for i, h in enumerate([10, 5, 8, 12, 11])
+    ]
+    data = {"data": {"prices": {"historical": prices[::-1]}}}
+    assert FILTERS["price_up_2x"](data) == (True, {})
+    prices[2]["high"], prices[3]["high"] = 7.9, 7
+    assert FILTERS["price_up_2x"](data) == (False, {})
+
+
+def test_unstored_patch():
+    nan = float("nan")
+    data = {"q": [{"a": 1.0, "b": nan}, {"a": 2.0}], "c": {"d": [1.0, nan]}}
+    patch = {
+        "q.0.a": 1.0,
+        "q.0.b": nan,
+        "q.1.a": 3.0,
+        "q.1.b": nan,
+        "q.2.a": 1.0,
+        "c.d": [1.0, nan],
+    }
+    assert list(unstored_patch(data, patch)) == ["q.1.a", "q.1.b", "q.2.a"]
+
+
+def test_apply_filter_chunk_stage_order():
+    chunk = [
+        {"_id": i, "symbol": {"symbol": "ONE"}, **stock_data_snapshot} for i in range(3)
+    ]
+    stage_order = ["price_up_2x", "eps_yoy_growth"]
+    results, stats = _apply_filter_chunk(
+        "eps_yoy_growth_and_price_up_2x", chunk, stage_order
+    )
+    assert len(results) == 3
+    assert stats["price_up_2x"][0] == 3
+    pipeline = FILTERS["eps_yoy_growth_and_price_up_2x"]
+    assert pipeline.stage_names == ["eps_yoy_growth", "price_up_2x"]
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_chunks([], 2)) == []
+
+
+class TestPanelScreenerTask:
+    def setup_method(self):
+        TestScreenerTask.setup_method(self)
+        data = deepcopy(stock_data_snapshot["data"])
+        # The latest quarter (2023-07-01) grows 1.20 -> 1.50 year over year.
+        data["financial_statements"]["quarter"][0]["epsdiluted"] = 1.5
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "ONE"}, {"$set": {"data": data}}
+        )
+
+    def teardown_method(self):
+        self.mock_db_client.close()
+
+    @staticmethod
+    def panel_fn(df):
+        return latest_yoy_growth_ratio_panel(df, "epsdiluted", 0.2)
+
+    def test_load_statements_panel(self):
+        task = PanelScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            self.panel_fn,
+            ["epsdiluted"],
+            self.mock_db_client,
+        )
+        task.source_symbols = ["ONE", "TWO"]
+        df = task.load_statements_panel()
+        assert len(df) == 20
+        assert list(df.columns) == ["symbol", "_id", "_row", "date", "epsdiluted"]
+
+    def test_load_statements_panel_columnar(self):
+        task = PanelScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            self.panel_fn,
+            ["epsdiluted"],
+            self.mock_db_client,
+        )
+        task.source_symbols = ["ONE", "TWO"]
+        expected = task.load_statements_panel()
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        quarter = one["data"]["financial_statements"]["quarter"]
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "ONE"},
+            {
+                "$set": {
+                    "data.financial_statements.quarter": to_layout(quarter, "columns")
+                }
+            },
+        )
+        df = task.load_statements_panel()
+        assert task._columnar_ids == {one["_id"]}
+        assert_frame_equal(df, expected)
+
+    def test_run(self):
+        task = PanelScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            self.panel_fn,
+            ["epsdiluted"],
+            self.mock_db_client,
+        )
+        task.run()
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["ONE"]
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        latest = one["data"]["financial_statements"]["quarter"][0]
+        assert latest["epsdilutedPrevYear"] == 1.2
+        assert abs(latest["epsdilutedYoYChangePct"] - 0.25) < 1e-9
+        assert "revenue" in latest
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert doc_task["taskType"] == "screener"
+        assert doc_task["complete"]
+
+    def test_run_columnar(self):
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        quarter = one["data"]["financial_statements"]["quarter"]
+        self.stock_data_collection.update_one(
+            {"symbol.symbol": "ONE"},
+            {
+                "$set": {
+                    "data.financial_statements.quarter": to_layout(quarter, "columns")
+                }
+            },
+        )
+        task = PanelScreenerTask(
+            "TEST",
+            self.dummy_task_id,
+            self.panel_fn,
+            ["epsdiluted"],
+            self.mock_db_client,
+        )
+        task.run()
+        doc_screener = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc_screener["tickerSymbols"] == ["ONE"]
+        one = self.stock_data_collection.find_one({"symbol.symbol": "ONE"})
+        quarter = one["data"]["financial_statements"]["quarter"]
+        assert quarter["epsdilutedPrevYear"][0] == 1.2
+        assert "revenue" in quarter
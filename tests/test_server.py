@@ -68,6 +68,19 @@ class TestServer:
         assert resp.text.find("Test Screener Task (Complete.") > -1
         assert resp.text.find("Test Screener Task 2 (Incomplete.") > -1
         assert resp.text.find(f"Latest stock data: {get_stock_data_task.task_id}") > -1
+        assert resp.text.find(f"/screener/{screener_task_incomplete.task_id}/1") > -1
+
+    def test_screener_result_in_progress(self):
+        screener_task = ScreenerTask(
+            "Test Screener Task", "TEST_GET_DATA", pass_all, self.mock_db_client
+        )
+        screener_task.mark_start()
+        resp = self.app.get(f"/screener/{screener_task.task_id}/1")
+        assert resp.status == "200 OK"
+        assert resp.text.find("Screening in progress") > -1
+        screener_task.start_filter_result()
+        resp = self.app.get("/screener")
+        assert resp.text.find("Screened: 0 / 0, matched: 0") > -1
 
     def test_screener_result(self):
         num_per_page = 5
@@ -111,6 +124,24 @@ class TestServer:
         assert resp.text.find("prev") > -1
         assert resp.text.find("next") == -1
 
+    def test_screener_result_by_symbol_ids(self):
+        self.screener_collection.insert_one(
+            {"taskId": "TEST_SCREENER", "tickerSymbols": ["TEST"], "symbolIds": [7]}
+        )
+        for symbol_id, name in [(7, "TEST"), (8, "DUMMY")]:
+            stock = deepcopy(stock_data_snapshot)
+            stock["symbol"]["symbol"] = name
+            self.stock_data_collection.insert_one(
+                {
+                    "symbol": stock["symbol"],
+                    "symbolId": symbol_id,
+                    "data": stock["data"],
+                }
+            )
+        resp = self.app.get("/screener/TEST_SCREENER/1")
+        assert resp.text.count("<h2>") == 1
+        assert resp.text.find("<h2>TEST</h2>") > -1
+
     def test_simple_candlestick_chart(self):
         task_id = "dummyId"
         symbol = "TEST"
@@ -0,0 +1,74 @@
+import numpy as np
+from mongomock import MongoClient
+
+from analyst.symbols import SymbolDictionary, id_array
+
+
+class TestSymbolDictionary:
+    def setup_method(self):
+        self.mock_db_client = MongoClient()
+        db = self.mock_db_client["db"]
+        self.collection = db["symbols"]
+        self.counters_collection = db["counters"]
+
+    def teardown_method(self):
+        self.mock_db_client.close()
+
+    def new_dictionary(self):
+        return SymbolDictionary(self.collection, self.counters_collection)
+
+    def test_ids(self):
+        dictionary = self.new_dictionary()
+        assert dictionary.ids(["ONE", "TWO"]) == {"ONE": 1, "TWO": 2}
+        assert dictionary.ids(["TWO", "THREE"]) == {"TWO": 2, "THREE": 3}
+        assert dictionary.id("ONE") == 1
+        assert self.collection.count_documents({}) == 3
+
+    def test_ids_assigned_in_bulk(self, mocker):
+        dictionary = self.new_dictionary()
+        spy = mocker.spy(self.counters_collection, "find_one_and_update")
+        assert dictionary.ids(["ONE", "TWO", "ONE", "THREE"]) == {
+            "ONE": 1,
+            "TWO": 2,
+            "THREE": 3,
+        }
+        assert spy.call_count == 1
+
+    def test_ids_assigned_elsewhere(self, mocker):
+        dictionary = self.new_dictionary()
+        # Another process assigns an id after this one looked the symbols up.
+        find = self.collection.find
+
+        def find_then_assign(*args, **kwargs):
+            docs = list(find(*args, **kwargs))
+            m.side_effect = find
+            self.collection.insert_one({"_id": 100, "symbol": "TWO"})
+            return docs
+
+        m = mocker.patch.object(self.collection, "find", side_effect=find_then_assign)
+        assert dictionary.ids(["ONE", "TWO"]) == {"ONE": 1, "TWO": 100}
+
+    def test_stable_across_instances(self):
+        self.new_dictionary().ids(["ONE", "TWO"])
+        dictionary = self.new_dictionary()
+        assert dictionary.id("TWO") == 2
+        assert dictionary.id("FOUR") == 3
+
+    def test_names(self):
+        self.new_dictionary().ids(["ONE", "TWO"])
+        dictionary = self.new_dictionary()
+        assert dictionary.names(np.array([2, 1, 9])) == {2: "TWO", 1: "ONE"}
+
+    def test_load(self):
+        self.new_dictionary().ids(["ONE", "TWO"])
+        dictionary = self.new_dictionary()
+        dictionary.load()
+        self.collection.drop()
+        assert dictionary.ids(["ONE", "TWO"]) == {"ONE": 1, "TWO": 2}
+
+
+def test_id_array():
+    a = id_array([5, 1, 3, 1])
+    assert a.tolist() == [1, 3, 5]
+    b = id_array(iter([3, 4, 5]))
+    assert np.intersect1d(a, b, assume_unique=True).tolist() == [3, 5]
@@ -1,3 +1,4 @@
+import pytest
 from mongomock import MongoClient
 
 from analyst.task_base import AnalystTaskBase
@@ -33,3 +34,19 @@ class TestAnalystTaskBase:
         assert doc["taskType"] == task.task_type
         assert doc["started"] == task.timestamp
         assert isinstance(doc["ended"], str)
+
+    def test_restore(self):
+        task = AnalystTaskBase("Test Restore", self.mock_db_client)
+        task.mark_start()
+        restored = AnalystTaskBase("Other", self.mock_db_client)
+        doc = restored.restore(task.task_id)
+        assert doc["taskId"] == task.task_id
+        assert restored.task_id == task.task_id
+        assert restored.description == task.description
+        assert restored.timestamp == task.timestamp
+        assert restored.document_id == task.document_id
+
+    def test_restore_not_found(self):
+        task = AnalystTaskBase("Test Restore", self.mock_db_client)
+        with pytest.raises(ValueError):
+            task.restore("NOT_FOUND")
@@ -0,0 +1,35 @@
+from analyst.telemetry import LatencyHistogram, FetchTelemetry
+
+
+class TestLatencyHistogram:
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        assert histogram.percentile(0.5) is None
+        for latency in [0.005] * 50 + [0.15] * 40 + [3.0] * 10:
+            histogram.add(latency)
+        assert histogram.percentile(0.5) == 10
+        assert histogram.percentile(0.9) == 200
+        assert histogram.percentile(0.99) == 3000
+        assert histogram.summary()["max"] == 3000
+
+    def test_unbounded_bucket(self):
+        histogram = LatencyHistogram()
+        histogram.add(60.0)
+        assert histogram.percentile(0.5) == 60000
+        assert histogram.summary()["histogram"]["inf"] == 1
+
+
+def test_fetch_telemetry_summary():
+    telemetry = FetchTelemetry()
+    telemetry.record_response("stock/list", 0.1, 100)
+    telemetry.record_throttled("stock/list", retried=True)
+    telemetry.record_retries("stock/list", 2)
+    telemetry.record_symbol()
+    summary = telemetry.summary()
+    assert summary["symbols"] == 1
+    assert summary["symbolsPerMinute"] > 0
+    stats = summary["endpoints"]["stock/list"]
+    assert stats["requests"] == 2
+    assert stats["throttled"] == 1
+    assert stats["retries"] == 3
+    assert stats["bytesReceived"] == 100
@@ -1,20 +1,20 @@
 from pathlib import Path
 import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from copy import deepcopy
+from datetime import date, timedelta
 
 import pytest
 from mongomock import MongoClient
 from requests import HTTPError
 
-from analyst.web_api import (
-    GetStockDataTask,
-    get,
-    get_ticker_symbols,
-    get_daily_prices,
-    get_financial_statements,
-    NoDataError,
-)
+from analyst.layout import prices_frame, statements_frame
+from analyst.web_api import GetStockDataTask, FmpClient, NoDataError
 from analyst.task_base import AnalystTaskBase
+from analyst.rate_limit import AdaptiveRateController
+from analyst.cache import ResponseCache
 
 snapshot_file_path = Path.cwd() / "tests/fixtures/stock_snapshot.json"
 with open(snapshot_file_path, "r", encoding="utf-8") as f:
@@ -70,15 +70,24 @@ mock_filtered_ticker_symbols = [
 ]
 
 
-def mock_response(data: dict | list, status_code: int):
+def mock_response(data: dict | list, status_code: int, headers: dict = {}):  # noqa
     class MockResponse:
         def __init__(self, data_: dict | list, status_code_: int):
             self.data = data_
             self.status_code = status_code_
+            self.headers = headers
+            self.content = json.dumps(data_).encode("utf-8")
 
         def json(self):
             return self.data
 
+        def iter_content(self, chunk_size: int):
+            for i in range(0, len(self.content), chunk_size):
+                yield self.content[i:][:chunk_size]
+
+        def close(self):
+            pass
+
         def raise_for_status(self):
             if 200 <= self.status_code < 300:
                 return
@@ -87,6 +96,46 @@ def mock_response(data: dict | list, status_code: int):
     return MockResponse(data, status_code)
 
 
+@contextmanager
+def local_server(responses: list[tuple[int, dict, dict | list] | None]):
+    """Serves the responses in order on localhost.
+    None closes the connection without a response.
+
+    :param responses: Status codes, headers and bodies of the responses.
+    :return: The base URL and the list of the requested paths.
+    """
+    responses = iter(responses)
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            response = next(responses)
+            if response is None:
+                self.close_connection = True
+                return
+            status_code, headers, data = response
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status_code)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/", requested
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 class TestGetStockDataTask:
     def setup_method(self):
         client = MongoClient()
@@ -104,22 +153,43 @@ class TestGetStockDataTask:
 
     def test_get_single_stock_data_and_save_success(self, mocker):
         mocker.patch(
-            "analyst.web_api.get_financial_statements",
+            "analyst.web_api.FmpClient.get_financial_statements",
             return_value=mock_financials_quarter,
         )
-        mocker.patch("analyst.web_api.get_daily_prices", return_value=mock_daily_prices)
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices", return_value=mock_daily_prices
+        )
         task = GetStockDataTask("TEST", self.mock_db_client)
         task.get_single_stock_data_and_save({"symbol": "TEST"})
         filter_ = {"symbol.symbol": "TEST"}
         count = self.stock_data_collection.count_documents(filter_)
         assert count == 1
+        doc = self.stock_data_collection.find_one(filter_)
+        assert doc["symbolId"] == task.symbol_dictionary.id("TEST")
+
+    def test_get_single_stock_data_and_save_packed(self, mocker):
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            return_value=mock_financials_quarter,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices", return_value=mock_daily_prices
+        )
+        task = GetStockDataTask("TEST", self.mock_db_client, layout="packed")
+        task.get_single_stock_data_and_save({"symbol": "TEST"})
+        doc = self.stock_data_collection.find_one({"symbol.symbol": "TEST"})
+        assert isinstance(doc["data"]["prices"]["historical"]["close"], bytes)
+        assert len(prices_frame(doc)) == len(mock_daily_prices["historical"])
+        assert len(statements_frame(doc)) == len(mock_financials_quarter)
 
     def test_get_single_stock_data_and_save_no_financials(self, mocker):
         mocker.patch(
-            "analyst.web_api.get_financial_statements",
+            "analyst.web_api.FmpClient.get_financial_statements",
             return_value=None,
         )
-        mocker.patch("analyst.web_api.get_daily_prices", return_value=mock_daily_prices)
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices", return_value=mock_daily_prices
+        )
         task = GetStockDataTask("TEST", self.mock_db_client)
         task.get_single_stock_data_and_save({"symbol": "TEST"})
         filter_ = {"symbol.symbol": "TEST"}
@@ -128,16 +198,91 @@ class TestGetStockDataTask:
 
     def test_get_single_stock_data_and_save_no_prices(self, mocker):
         mocker.patch(
-            "analyst.web_api.get_financial_statements",
+            "analyst.web_api.FmpClient.get_financial_statements",
             return_value=mock_financials_quarter,
         )
-        mocker.patch("analyst.web_api.get_daily_prices", return_value=None)
+        mocker.patch("analyst.web_api.FmpClient.get_daily_prices", return_value=None)
         task = GetStockDataTask("TEST", self.mock_db_client)
         task.get_single_stock_data_and_save({"symbol": "TEST"})
         filter_ = {"symbol.symbol": "TEST"}
         count = self.stock_data_collection.count_documents(filter_)
         assert count == 0
 
+    def test_get_single_stock_data_and_save_incremental(self, mocker):
+        today = date.today()
+
+        def days_ago(n):
+            return (today - timedelta(days=n)).isoformat()
+
+        self.stock_data_collection.insert_one(
+            {
+                "taskId": "PREVIOUS",
+                "symbol": {"symbol": "TEST", "price": 1.0},
+                "data": {
+                    "financial_statements": {
+                        "quarter": [{"date": days_ago(100), "eps": 1.0}]
+                    },
+                    "prices": {
+                        "symbol": "TEST",
+                        "historical": [
+                            {"date": days_ago(2), "close": 1.0},
+                            {"date": days_ago(400), "close": 1.0},
+                        ],
+                    },
+                },
+            }
+        )
+        m_financials = mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            return_value=[{"date": days_ago(10), "eps": 2.0}],
+        )
+        m_prices = mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value={
+                "symbol": "TEST",
+                "historical": [
+                    {"date": days_ago(1), "close": 2.0},
+                    {"date": days_ago(2), "close": 2.0},
+                ],
+            },
+        )
+        task = GetStockDataTask("TEST", self.mock_db_client, incremental=True)
+        task.get_single_stock_data_and_save({"symbol": "TEST", "price": 2.0})
+        m_financials.assert_called_once_with("TEST", limit=2, period="quarter")
+        m_prices.assert_called_once_with("TEST", days_ago(2), today.isoformat())
+        assert self.stock_data_collection.count_documents({}) == 1
+        doc = self.stock_data_collection.find_one({"symbol.symbol": "TEST"})
+        assert doc["taskId"] == task.task_id
+        assert doc["symbol"]["price"] == 2.0
+        quarter = doc["data"]["financial_statements"]["quarter"]
+        assert [r["date"] for r in quarter] == [days_ago(10), days_ago(100)]
+        historical = doc["data"]["prices"]["historical"]
+        assert [r["date"] for r in historical] == [days_ago(1), days_ago(2)]
+        assert historical[1]["close"] == 2.0
+
+    def test_get_single_stock_data_and_save_incremental_up_to_date(self, mocker):
+        today = date.today().isoformat()
+        self.stock_data_collection.insert_one(
+            {
+                "taskId": "PREVIOUS",
+                "symbol": {"symbol": "TEST"},
+                "data": {
+                    "financial_statements": {"quarter": [{"date": today}]},
+                    "prices": {"historical": [{"date": today}]},
+                },
+            }
+        )
+        m_financials = mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements"
+        )
+        m_prices = mocker.patch("analyst.web_api.FmpClient.get_daily_prices")
+        task = GetStockDataTask("TEST", self.mock_db_client, incremental=True)
+        task.get_single_stock_data_and_save({"symbol": "TEST"})
+        m_financials.assert_not_called()
+        m_prices.assert_not_called()
+        doc = self.stock_data_collection.find_one({"symbol.symbol": "TEST"})
+        assert doc["taskId"] == task.task_id
+
     def test_save_to_screener_collection(self):
         task = GetStockDataTask("TEST", self.mock_db_client)
         symbol_names = ["A", "B"]
@@ -149,6 +294,7 @@ class TestGetStockDataTask:
                 {
                     "taskId": task.task_id,
                     "symbol": copy_symbol,
+                    "symbolId": task.symbol_dictionary.id(s),
                     "data": stock_snapshot["data"],
                 }
             )
@@ -159,19 +305,40 @@ class TestGetStockDataTask:
         doc = self.screener_collection.find_one(filter_)
         assert count == 1
         assert doc["tickerSymbols"] == symbol_names
+        assert doc["symbolIds"] == [1, 2]
+
+    def test_save_to_screener_collection_without_ids(self):
+        task = GetStockDataTask("TEST", self.mock_db_client)
+        self.stock_data_collection.insert_many(
+            [
+                {"taskId": task.task_id, "symbol": {"symbol": "A"}, "symbolId": 1},
+                {"taskId": task.task_id, "symbol": {"symbol": "B"}},
+            ]
+        )
+        task.save_to_screener_collection()
+        doc = self.screener_collection.find_one({"taskId": task.task_id})
+        assert doc["tickerSymbols"] == ["A", "B"]
+        assert "symbolIds" not in doc
 
     def test_run(self, mocker):
         mocker.patch(
-            "analyst.web_api.get_ticker_symbols",
+            "analyst.web_api.FmpClient.iter_ticker_symbols",
             return_value=mock_filtered_ticker_symbols,
         )
         mocker.patch(
-            "analyst.web_api.get_financial_statements",
+            "analyst.web_api.FmpClient.get_financial_statements",
             return_value=mock_financials_quarter,
         )
-        mocker.patch("analyst.web_api.get_daily_prices", return_value=mock_daily_prices)
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices", return_value=mock_daily_prices
+        )
         task = GetStockDataTask("TEST", self.mock_db_client)
+        spy = mocker.spy(
+            task.symbol_dictionary.counters_collection, "find_one_and_update"
+        )
         task.run(20.0)
+        # The ids of a checkpoint batch are assigned at once.
+        assert spy.call_count == 1
         filter_ = {"taskId": task.task_id}
         count_stock_data = self.stock_data_collection.count_documents(filter_)
         count_screener = self.screener_collection.count_documents(filter_)
@@ -181,17 +348,368 @@ class TestGetStockDataTask:
         assert len(screener_result["tickerSymbols"]) == 4
         assert count_screener == 1
         assert doc_task["taskType"] == "get_stock_data"
+        assert doc_task["layout"] == "rows"
+        assert doc_task["prefilter"] is None
+
+    def test_run_incremental(self, mocker):
+        today = date.today().isoformat()
+        up_to_date = {
+            "financial_statements": {"quarter": [{"date": today}]},
+            "prices": {"historical": [{"date": today}]},
+        }
+        outdated = deepcopy(up_to_date)
+        outdated["prices"]["historical"] = [{"date": "2000-01-01"}]
+        self.stock_data_collection.insert_many(
+            [
+                {"taskId": "PREVIOUS", "symbol": {"symbol": s}, "data": up_to_date}
+                for s in ["AMEX", "DELISTED"]
+            ]
+            + [{"taskId": "PREVIOUS", "symbol": {"symbol": "NYSE"}, "data": outdated}]
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.iter_ticker_symbols",
+            return_value=mock_filtered_ticker_symbols,
+        )
+        m_financials = mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            return_value=mock_financials_quarter,
+        )
 
+        def get_daily_prices(symbol, *args):
+            if symbol == "NYSE":
+                raise HTTPError("TEST")
+            return mock_daily_prices
 
-class TestGet:
-    def test_get_success(self, mocker):
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices", side_effect=get_daily_prices
+        )
+        task = GetStockDataTask("TEST", self.mock_db_client, incremental=True)
+        task.run(20.0)
+        assert "symbol.symbol_1" in self.stock_data_collection.index_information()
+        assert m_financials.call_count == 2
+        symbol_names = self.stock_data_collection.distinct("symbol.symbol")
+        assert sorted(symbol_names) == ["AMEX", "NASDAQ", "NASDAQ2", "NYSE"]
+        # The refresh of NYSE failed, but its stored data is kept.
+        doc = self.stock_data_collection.find_one({"taskId": "PREVIOUS"})
+        assert doc["symbol"]["symbol"] == "NYSE"
+
+    def test_run_checkpoint(self, mocker):
+        mocker.patch(
+            "analyst.web_api.FmpClient.iter_ticker_symbols",
+            return_value=mock_filtered_ticker_symbols,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            side_effect=lambda s, **_: None if s == "NYSE" else mock_financials_quarter,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask("TEST", self.mock_db_client)
+        task.run(20.0)
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        checkpoint = doc_task["checkpoint"]
+        assert len(checkpoint["symbols"]) == 4
+        assert checkpoint["symbolsComplete"]
+        assert sorted(checkpoint["succeeded"]) == ["AMEX", "NASDAQ", "NASDAQ2"]
+        assert checkpoint["failed"] == ["NYSE"]
+        telemetry = doc_task["telemetry"]
+        assert telemetry["symbols"] == 4
+        assert telemetry["writes"]["written"] == 3
+
+    def test_run_staged(self, mocker):
+        mocker.patch(
+            "analyst.web_api.FmpClient.iter_ticker_symbols",
+            return_value=mock_filtered_ticker_symbols,
+        )
+        m_financials = mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            side_effect=lambda s, **_: [{"symbol": s}],
+        )
+        m_prices = mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask(
+            "TEST",
+            self.mock_db_client,
+            prefilter=lambda f: f[0]["symbol"] in ("AMEX", "NASDAQ"),
+        )
+        task.run(20.0)
+        assert m_financials.call_count == 4
+        assert sorted(c.args[0] for c in m_prices.call_args_list) == [
+            "AMEX",
+            "NASDAQ",
+        ]
+        doc = self.stock_data_collection.find_one({"symbol.symbol": "AMEX"})
+        assert doc["data"]["financial_statements"]["quarter"] == [{"symbol": "AMEX"}]
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert sorted(doc_task["checkpoint"]["succeeded"]) == ["AMEX", "NASDAQ"]
+        assert sorted(doc_task["checkpoint"]["rejected"]) == ["NASDAQ2", "NYSE"]
+        screener_result = self.screener_collection.find_one({"taskId": task.task_id})
+        assert len(screener_result["tickerSymbols"]) == 2
+
+    def test_run_staged_checkpoint(self, mocker):
+        mocker.patch("analyst.web_api.GetStockDataTask.CHECKPOINT_BATCH_SIZE", 1)
+        mocker.patch(
+            "analyst.web_api.FmpClient.iter_ticker_symbols",
+            return_value=mock_filtered_ticker_symbols,
+        )
+        checkpoints = []
+
+        def get_financial_statements(symbol_name, **_):
+            doc_task = self.task_collection.find_one({"taskType": "get_stock_data"})
+            checkpoints.append(doc_task["checkpoint"])
+            return None if symbol_name == "NASDAQ" else [{"symbol": symbol_name}]
+
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            side_effect=get_financial_statements,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask(
+            "TEST",
+            self.mock_db_client,
+            prefilter=lambda f: f[0]["symbol"] == "AMEX",
+        )
+        task.run(20.0, max_in_flight=1)
+        # Saved while the first stage was still running.
+        assert checkpoints[-1]["failed"] == ["NASDAQ"]
+        assert checkpoints[-1]["rejected"] == ["NASDAQ2"]
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert doc_task["checkpoint"]["rejected"] == ["NASDAQ2", "NYSE"]
+
+    def test_resume(self, mocker):
+        task_id = "INTERRUPTED"
+        self.task_collection.insert_one(
+            {
+                "taskId": task_id,
+                "taskType": "get_stock_data",
+                "started": "2023-01-01T00:00:00",
+                "ended": None,
+                "description": "TEST",
+                "complete": False,
+                "incremental": False,
+                "checkpoint": {
+                    "symbols": mock_filtered_ticker_symbols,
+                    "symbolsComplete": True,
+                    "succeeded": ["AMEX", "NASDAQ"],
+                    "failed": ["NYSE"],
+                },
+            }
+        )
+        # Stored, but interrupted before it was checkpointed.
+        self.stock_data_collection.insert_one(
+            {"taskId": task_id, "symbol": {"symbol": "NASDAQ2"}, "data": {}}
+        )
+        # Stored before the symbol ids.
+        self.stock_data_collection.insert_one(
+            {"taskId": task_id, "symbol": {"symbol": "AMEX"}, "data": {}}
+        )
+        m_financials = mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            return_value=mock_financials_quarter,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask("RESUME", self.mock_db_client)
+        task.resume(task_id)
+        fetched = sorted(c.args[0] for c in m_financials.call_args_list)
+        assert fetched == ["NASDAQ2", "NYSE"]
+        assert task.task_id == task_id
+        doc_task = self.task_collection.find_one({"taskId": task_id})
+        assert doc_task["complete"]
+        assert len(doc_task["checkpoint"]["succeeded"]) == 4
+        assert doc_task["checkpoint"]["failed"] == []
+        filter_ = {"taskId": task_id}
+        assert self.stock_data_collection.count_documents(filter_) == 3
+        filter_["symbolId"] = {"$exists": False}
+        assert self.stock_data_collection.count_documents(filter_) == 0
+        screener_result = self.screener_collection.find_one({"taskId": task_id})
+        assert len(screener_result["symbolIds"]) == 3
+
+    def test_resume_symbols_incomplete(self, mocker):
+        def symbols():
+            yield mock_filtered_ticker_symbols[0]
+            raise HTTPError("TEST")
+
+        mocker.patch(
+            "analyst.web_api.FmpClient.iter_ticker_symbols", return_value=symbols()
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            return_value=mock_financials_quarter,
+        )
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask("TEST", self.mock_db_client)
+        with pytest.raises(HTTPError):
+            task.run(20.0)
+        doc_task = self.task_collection.find_one({"taskId": task.task_id})
+        assert not doc_task["checkpoint"]["symbolsComplete"]
+        with pytest.raises(ValueError):
+            GetStockDataTask("RESUME", self.mock_db_client).resume(task.task_id)
+
+    def test_resume_options(self, mocker):
+        task_id = "INTERRUPTED"
+        task_doc = {
+            "taskId": task_id,
+            "taskType": "get_stock_data",
+            "started": "2023-01-01T00:00:00",
+            "ended": None,
+            "description": "TEST",
+            "complete": False,
+            "incremental": False,
+            "layout": "packed",
+            "prefilter": ["epsdiluted", 0.2],
+            "checkpoint": {
+                "symbols": [{"symbol": "PASS"}, {"symbol": "REJECT"}],
+                "symbolsComplete": True,
+                "succeeded": [],
+                "failed": [],
+                "rejected": [],
+            },
+        }
+        self.task_collection.insert_one(deepcopy(task_doc))
+        financials_quarter = [
+            {"date": f"2023-0{i + 1}-01", "epsdiluted": eps}
+            for i, eps in enumerate([1.0, 1.0, 1.0, 1.0, 1.3])
+        ]
+        mocker.patch(
+            "analyst.web_api.FmpClient.get_financial_statements",
+            side_effect=lambda s, **_: (
+                financials_quarter if s == "PASS" else financials_quarter[:4]
+            ),
+        )
+        m_prices = mocker.patch(
+            "analyst.web_api.FmpClient.get_daily_prices",
+            return_value=mock_daily_prices,
+        )
+        task = GetStockDataTask("RESUME", self.mock_db_client)
+        task.resume(task_id)
+        assert task.layout == "packed"
+        assert [c.args[0] for c in m_prices.call_args_list] == ["PASS"]
+        doc = self.stock_data_collection.find_one({"symbol.symbol": "PASS"})
+        assert isinstance(doc["data"]["prices"]["historical"]["close"], bytes)
+
+        # A pre-filter not made by yoy_growth_prefilter has to be given again.
+        task_doc.update(taskId="CUSTOM", prefilter=[])
+        self.task_collection.insert_one(task_doc)
+        task = GetStockDataTask("RESUME", self.mock_db_client)
+        with pytest.raises(ValueError):
+            task.resume("CUSTOM")
+
+
+class TestFmpClient:
+    def test_session_is_reused(self, mocker):
         m = mocker.patch(
             "requests.Session.get", return_value=mock_response(mock_daily_prices, 200)
         )
-        data = get(
-            "https://financialmodelingprep.com/api/v3/historical-price-full/TEST",
-            {"test": "test"},
+        client = FmpClient()
+        session = client.session
+        client.get("historical-price-full/TEST")
+        client.get("income-statement/TEST")
+        assert client.session is session
+        assert m.call_count == 2
+
+    def test_get_throttled(self, mocker):
+        m = mocker.patch(
+            "requests.Session.get",
+            side_effect=[
+                mock_response({}, 429, {"Retry-After": "0.1"}),
+                mock_response(mock_daily_prices, 200),
+            ],
+        )
+        client = FmpClient(rate_controller=AdaptiveRateController(6000))
+        data = client.get("historical-price-full/TEST")
+        assert m.call_count == 2
+        assert client.rate_controller.throttled_count == 1
+        assert client.rate_controller.rate_per_minute < 6000
+        assert type(data) is dict
+
+    def test_get_throttled_with_retry_after(self):
+        throttled = (429, {"Retry-After": "0"}, {})
+        responses = [throttled, throttled, (200, {}, mock_daily_prices)]
+        with local_server(responses) as (base_url, requested):
+            client = FmpClient(
+                base_url=base_url, rate_controller=AdaptiveRateController(6000)
+            )
+            with client:
+                data = client.get("historical-price-full/TEST")
+        assert len(requested) == 3
+        assert client.rate_controller.throttled_count == 2
+        stats = client.telemetry.summary()["endpoints"]["historical-price-full"]
+        assert stats["throttled"] == 2
+        assert stats["retries"] == 2
+        assert data == mock_daily_prices
+
+    def test_get_telemetry_adapter_retries(self):
+        # The first connection is closed without a response and retried by urllib3.
+        responses = [None, (200, {}, mock_daily_prices)]
+        with local_server(responses) as (base_url, requested):
+            with FmpClient(base_url=base_url) as client:
+                client.get("historical-price-full/TEST")
+        assert len(requested) == 2
+        stats = client.telemetry.summary()["endpoints"]["historical-price-full"]
+        assert stats["retries"] == 1
+        assert stats["requests"] == 1
+
+    def test_get_cached(self, mocker, tmp_path):
+        m = mocker.patch(
+            "requests.Session.get", return_value=mock_response(mock_daily_prices, 200)
+        )
+        client = FmpClient(cache=ResponseCache(tmp_path))
+        client.get("historical-price-full/TEST", {"from": "2023-01-01"})
+        data = client.get("historical-price-full/TEST", {"from": "2023-01-01"})
+        assert m.call_count == 1
+        assert data == mock_daily_prices
+
+    def test_get_replay_only(self, mocker, tmp_path):
+        m = mocker.patch("requests.Session.get")
+        client = FmpClient(cache=ResponseCache(tmp_path, replay_only=True))
+        with pytest.raises(NoDataError):
+            client.get("historical-price-full/TEST")
+        m.assert_not_called()
+
+    def test_get_telemetry(self, mocker):
+        mocker.patch(
+            "requests.Session.get",
+            side_effect=[
+                mock_response({}, 429),
+                mock_response(mock_daily_prices, 200),
+                mock_response([], 200),
+                mock_response({}, 500),
+            ],
         )
+        client = FmpClient(rate_controller=AdaptiveRateController(6000))
+        client.get("historical-price-full/TEST")
+        with pytest.raises(NoDataError):
+            client.get("historical-price-full/TEST")
+        with pytest.raises(HTTPError):
+            client.get("income-statement/TEST")
+        summary = client.telemetry.summary()
+        prices = summary["endpoints"]["historical-price-full"]
+        assert prices["requests"] == 3
+        assert prices["throttled"] == 1
+        assert prices["retries"] == 1
+        assert prices["noData"] == 1
+        assert prices["bytesReceived"] == len(json.dumps(mock_daily_prices)) + 2
+        assert sum(prices["latencyMs"]["histogram"].values()) == 2
+        assert summary["endpoints"]["income-statement"]["httpErrors"] == 1
+
+    def test_get_success(self, mocker):
+        m = mocker.patch(
+            "requests.Session.get", return_value=mock_response(mock_daily_prices, 200)
+        )
+        data = FmpClient().get("historical-price-full/TEST", {"test": "test"})
         args, kwargs = m.call_args
         assert args == (
             "https://financialmodelingprep.com/api/v3/historical-price-full/TEST",
@@ -204,73 +722,80 @@ class TestGet:
         mocker.patch("requests.Session.get", return_value=mock_response([], 200))
         url = "https://financialmodelingprep.com/api/v3/historical-price-full/TEST"
         with pytest.raises(NoDataError) as e:
-            get("https://financialmodelingprep.com/api/v3/historical-price-full/TEST")
+            FmpClient().get("historical-price-full/TEST")
         assert str(e.value) == f"No data returned: {url}"
 
 
 class TestGetDailyPrices:
     def test_det_daily_prices_success_default(self, mocker):
-        m = mocker.patch("analyst.web_api.get", return_value=mock_daily_prices)
-        prices = get_daily_prices("TEST")
-        m.assert_called_once_with(
-            "https://financialmodelingprep.com/api/v3/historical-price-full/TEST",
-            {},
+        m = mocker.patch(
+            "analyst.web_api.FmpClient.get", return_value=mock_daily_prices
         )
+        prices = FmpClient().get_daily_prices("TEST")
+        m.assert_called_once_with("historical-price-full/TEST", {})
         assert type(prices) is dict
 
     def test_det_daily_prices_success(self, mocker):
-        m = mocker.patch("analyst.web_api.get", return_value=mock_daily_prices)
-        prices = get_daily_prices("TEST", "2023-01-01", "2023-01-02")
+        m = mocker.patch(
+            "analyst.web_api.FmpClient.get", return_value=mock_daily_prices
+        )
+        prices = FmpClient().get_daily_prices("TEST", "2023-01-01", "2023-01-02")
         m.assert_called_once_with(
-            "https://financialmodelingprep.com/api/v3/historical-price-full/TEST",
+            "historical-price-full/TEST",
             {"from": "2023-01-01", "to": "2023-01-02"},
         )
         assert type(prices) is dict
 
     def test_det_daily_prices_http_error(self, mocker):
-        mocker.patch("analyst.web_api.get", side_effect=HTTPError("TEST"))
-        prices = get_daily_prices("TEST", "2023-01-01", "2023-01-02")
+        mocker.patch("analyst.web_api.FmpClient.get", side_effect=HTTPError("TEST"))
+        prices = FmpClient().get_daily_prices("TEST", "2023-01-01", "2023-01-02")
         assert prices is None
 
     def test_det_daily_prices_no_data_error(self, mocker):
         mocker.patch("requests.Session.get", return_value=mock_response([], 200))
-        prices = get_daily_prices("TEST", "2023-01-01", "2023-01-02")
+        prices = FmpClient().get_daily_prices("TEST", "2023-01-01", "2023-01-02")
         assert prices is None
 
 
 class TestGetFinancialStatements:
     def test_det_daily_prices_success_default(self, mocker):
-        m = mocker.patch("analyst.web_api.get", return_value=mock_financials_quarter)
-        financials = get_financial_statements("TEST")
+        m = mocker.patch(
+            "analyst.web_api.FmpClient.get", return_value=mock_financials_quarter
+        )
+        financials = FmpClient().get_financial_statements("TEST")
         m.assert_called_once_with(
-            "https://financialmodelingprep.com/api/v3/income-statement/TEST",
+            "income-statement/TEST",
             {"limit": 10, "period": "quarter"},
         )
         assert type(financials) is list
 
     def test_det_daily_prices_success(self, mocker):
-        m = mocker.patch("analyst.web_api.get", return_value=mock_financials_quarter)
-        financials = get_financial_statements("TEST", 20, "annual")
+        m = mocker.patch(
+            "analyst.web_api.FmpClient.get", return_value=mock_financials_quarter
+        )
+        financials = FmpClient().get_financial_statements("TEST", 20, "annual")
         m.assert_called_once_with(
-            "https://financialmodelingprep.com/api/v3/income-statement/TEST",
+            "income-statement/TEST",
             {"limit": 20, "period": "annual"},
         )
         assert type(financials) is list
 
     def test_det_daily_prices_http_error(self, mocker):
-        mocker.patch("analyst.web_api.get", side_effect=HTTPError("TEST"))
-        financials = get_financial_statements("TEST")
+        mocker.patch("analyst.web_api.FmpClient.get", side_effect=HTTPError("TEST"))
+        financials = FmpClient().get_financial_statements("TEST")
         assert financials is None
 
     def test_det_daily_prices_no_data_error(self, mocker):
         mocker.patch("requests.Session.get", return_value=mock_response([], 200))
-        financials = get_financial_statements("TEST")
+        financials = FmpClient().get_financial_statements("TEST")
         assert financials is None
 
 
 def test_get_ticker_symbols(mocker):
-    mocker.patch("requests.get", return_value=mock_response(mock_ticker_symbols, 200))
-    sym = get_ticker_symbols(20.0)
+    mocker.patch(
+        "requests.Session.get", return_value=mock_response(mock_ticker_symbols, 200)
+    )
+    sym = FmpClient().get_ticker_symbols(20.0)
     assert len(sym) == 4
     assert [s["symbol"] for s in sym] == [
         "AMEX_PASS_1",
@@ -278,3 +803,28 @@ def test_get_ticker_symbols(mocker):
         "NASDAQ_PASS_2",
         "NYSE_PASS_1",
     ]
+
+
+def test_get_ticker_symbols_empty(mocker, tmp_path):
+    mocker.patch("requests.Session.get", return_value=mock_response([], 200))
+    assert FmpClient().get_ticker_symbols(20.0) == []
+    client = FmpClient(cache=ResponseCache(tmp_path))
+    assert client.get_ticker_symbols(20.0) == []
+
+
+def test_iter_ticker_symbols_streaming(mocker):
+    mocker.patch("analyst.web_api.FmpClient.STREAM_CHUNK_SIZE", 7)
+    m = mocker.patch(
+        "requests.Session.get", return_value=mock_response(mock_ticker_symbols, 200)
+    )
+    client = FmpClient()
+    symbols = client.iter_ticker_symbols(20.0)
+    assert next(symbols)["symbol"] == "AMEX_PASS_1"
+    assert m.call_args.kwargs["stream"]
+    assert [s["symbol"] for s in symbols] == [
+        "NASDAQ_PASS_1",
+        "NASDAQ_PASS_2",
+        "NYSE_PASS_1",
+    ]
+    stats = client.telemetry.summary()["endpoints"]["stock/list"]
+    assert stats["bytesReceived"] == len(json.dumps(mock_ticker_symbols))